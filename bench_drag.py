@@ -0,0 +1,366 @@
+"""Microbenchmark of drag steps on randomly initialized generators.
+
+Builds StyleGAN2/StyleGAN3 generators with random weights, so that neither
+checkpoints nor network access are needed, and times `Renderer` drag steps
+over a set of configurations. Results are written as JSON and can be
+compared against a saved baseline to catch regressions before deploying.
+
+Examples:
+
+\b
+# Sweep every parameter around the default configuration.
+python bench_drag.py run --arch=stylegan2 --res=256,512 --out=bench.json
+
+\b
+# Same, and fail if any configuration got more than 10% slower.
+python bench_drag.py run --arch=stylegan2 --res=256,512 --out=bench.json \\
+    --baseline=baseline.json --tolerance=0.1
+
+\b
+# Compare eager and torch.compile() synthesis.
+python bench_drag.py run --arch=stylegan2 --res=256 --synthesis=eager,compiled --warmup=3
+
+\b
+# Compare FP32 and bfloat16 synthesis.
+python bench_drag.py run --arch=stylegan2,stylegan3 --res=256 --precision=fp32,bf16
+
+\b
+# Compare two saved results.
+python bench_drag.py compare bench.json baseline.json
+"""
+
+import copy
+import itertools
+import json
+import platform
+import sys
+import time
+from typing import List, Union
+
+import click
+import numpy as np
+import torch
+
+import dnnlib
+from torch_utils import compiled_synthesis
+from viz.renderer import Renderer
+
+#----------------------------------------------------------------------------
+# Synthetic generators.
+
+# Generator arguments of the official configs (StyleGAN3 = config T).
+ARCH_KWARGS = {
+    'stylegan2': dict(z_dim=512, c_dim=0, w_dim=512, img_channels=3, mapping_kwargs=dict(num_layers=8), channel_base=32768, channel_max=512, conv_clamp=256),
+    'stylegan3': dict(z_dim=512, c_dim=0, w_dim=512, img_channels=3, mapping_kwargs=dict(num_layers=2), channel_base=32768, channel_max=512),
+}
+
+def make_generator(arch, res, seed=0, channel_base=None, channel_max=None):
+    r"""Construct a randomly initialized generator of the given architecture
+    and output resolution.
+    """
+    if arch == 'stylegan2':
+        from training.networks_stylegan2 import Generator
+    elif arch == 'stylegan3':
+        from training.networks_stylegan3 import Generator
+    else:
+        raise ValueError(f'Unknown architecture: {arch}')
+    kwargs = copy.deepcopy(ARCH_KWARGS[arch])
+    if channel_base is not None:
+        kwargs['channel_base'] = channel_base
+    if channel_max is not None:
+        kwargs['channel_max'] = channel_max
+    torch.manual_seed(seed)
+    return Generator(img_resolution=res, **kwargs).eval().requires_grad_(False)
+
+def num_features(G):
+    r"""Number of feature maps returned by `G(..., return_feature=True)`."""
+    if hasattr(G.synthesis, 'block_resolutions'):
+        return len(G.synthesis.block_resolutions)
+    return len(G.synthesis.layer_names)
+
+def synthetic_pkl(arch, res):
+    # get_network() infers the architecture from the pickle name.
+    return f'synthetic-{arch}-{res}.pkl'
+
+def make_renderer(G, arch, device='cpu', w0_seed=0, w_plus=True, **renderer_kwargs):
+    r"""Construct a `Renderer` that uses the given in-memory generator."""
+    pkl = synthetic_pkl(arch, G.img_resolution)
+    renderer = Renderer(device=device, **renderer_kwargs)
+    renderer.add_pkl_data(pkl, dict(G_ema=G))
+    renderer.init_network(dnnlib.EasyDict(), pkl=pkl, w0_seed=w0_seed, w_plus=w_plus)
+    return renderer
+
+def make_drag_inputs(res, num_handles, seed=0, distance=0.25, with_mask=False):
+    r"""Deterministic handle points, targets at `distance * res` pixels away
+    from them, and an optional mask that fixes the left half of the image.
+    Points are `[y, x]` like in `Renderer`.
+    """
+    rnd = np.random.RandomState(seed)
+    margin = res // 8
+    points, targets = [], []
+    for _ in range(num_handles):
+        y, x = rnd.randint(margin, res - margin, size=2)
+        angle = rnd.uniform(0, 2 * np.pi)
+        ty = int(np.clip(y + distance * res * np.sin(angle), 0, res - 1))
+        tx = int(np.clip(x + distance * res * np.cos(angle), 0, res - 1))
+        points.append([int(y), int(x)])
+        targets.append([ty, tx])
+    mask = None
+    if with_mask:
+        mask = torch.ones([res, res])
+        mask[:, :res // 2] = 0
+    return points, targets, mask
+
+#----------------------------------------------------------------------------
+# Benchmark configurations.
+
+PARAMS = ['handles', 'r1', 'r2', 'latent', 'mask', 'feature_idx']
+
+def config_name(cfg):
+    synthesis = f',synthesis={cfg["synthesis"]}' if cfg.get('synthesis', 'eager') != 'eager' else ''
+    precision = f',precision={cfg["precision"]}' if cfg.get('precision', 'fp32') != 'fp32' else ''
+    return (f'{cfg["arch"]}-{cfg["res"]}/handles={cfg["handles"]},r1={cfg["r1"]},r2={cfg["r2"]},'
+        f'latent={cfg["latent"]},mask={int(cfg["mask"])},feature_idx={cfg["feature_idx"]}{synthesis}{precision}')
+
+def make_configs(archs, resolutions, values, grid=False, synthesis=('eager',), precision=('fp32',)):
+    r"""List the configurations to benchmark. `values` maps every parameter in
+    `PARAMS` to its list of values, the first of which is the default. Without
+    `grid`, each parameter is varied on its own around the defaults. Every
+    configuration is run with each `synthesis` mode and `precision`.
+    """
+    configs = []
+    for arch, res, mode, prec in itertools.product(archs, resolutions, synthesis, precision):
+        if grid:
+            combos = [dict(zip(PARAMS, combo)) for combo in itertools.product(*[values[p] for p in PARAMS])]
+        else:
+            defaults = {p: values[p][0] for p in PARAMS}
+            combos = [defaults] + [dict(defaults, **{p: v}) for p in PARAMS for v in values[p][1:]]
+        for combo in combos:
+            cfg = dict(arch=arch, res=res, synthesis=mode, precision=prec, **combo)
+            if cfg not in configs:
+                configs.append(cfg)
+    return configs
+
+#----------------------------------------------------------------------------
+
+def time_drag_steps(renderer, cfg, steps, warmup, seed=0):
+    r"""Run `warmup + steps` drag steps of the given configuration and return
+    the `{stage: seconds}` dicts of the timed steps and the number of them
+    that updated the latent.
+    """
+    renderer.init_network(dnnlib.EasyDict(), pkl=renderer.pkl, w0_seed=seed, w_plus=(cfg['latent'] == 'w+'))
+    points, targets, mask = make_drag_inputs(cfg['res'], cfg['handles'], seed=seed, with_mask=cfg['mask'])
+    res = dnnlib.EasyDict()
+    times = []
+    num_optimized = 0
+    for step in range(warmup + steps):
+        renderer._render_drag_impl(res, points, targets, mask, lambda_mask=20, reg=0, feature_idx=cfg['feature_idx'],
+            r1=cfg['r1'], r2=cfg['r2'], trunc_psi=0.7, is_drag=True, reset=(step == 0), to_pil=True)
+        step_times = renderer.timer.end_step()
+        if step >= warmup:
+            times.append(step_times)
+            num_optimized += int(not res.stop)
+    return times, num_optimized
+
+def summarize(times):
+    total = np.array([t['total'] for t in times])
+    stages = dict()
+    for t in times:
+        for name, value in t.items():
+            if name != 'total':
+                stages.setdefault(name, []).append(value)
+    return dict(
+        median  = float(np.median(total)),
+        mean    = float(np.mean(total)),
+        min     = float(np.min(total)),
+        max     = float(np.max(total)),
+        p90     = float(np.percentile(total, 90)),
+        stages  = {name: float(np.sum(values) / len(times)) for name, values in stages.items()},
+    )
+
+#----------------------------------------------------------------------------
+
+def compare_results(new, base, tolerance=0.1, metric='median'):
+    r"""Compare the `metric` of every configuration present in both results.
+    Prints a table and returns the names of the regressed configurations.
+    """
+    for key in ['torch', 'device', 'threads', 'processor']:
+        if new['meta'].get(key) != base['meta'].get(key):
+            print(f'Warning: {key} differs from baseline: {new["meta"].get(key)} vs. {base["meta"].get(key)}')
+    base_results = {r['name']: r for r in base['results']}
+    regressions = []
+    width = max([len(r['name']) for r in new['results']], default=0)
+    print(f'{"config":<{width}}  {"baseline":>10}  {"current":>10}  {"ratio":>6}')
+    for result in new['results']:
+        name = result['name']
+        if name not in base_results:
+            print(f'{name:<{width}}  {"-":>10}  {result["stats"][metric] * 1e3:8.1f}ms  {"new":>6}')
+            continue
+        old_value = base_results[name]['stats'][metric]
+        new_value = result['stats'][metric]
+        ratio = new_value / old_value
+        status = ''
+        if ratio > 1 + tolerance:
+            status = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            status = '  improved'
+        print(f'{name:<{width}}  {old_value * 1e3:8.1f}ms  {new_value * 1e3:8.1f}ms  {ratio:6.2f}{status}')
+    missing = set(base_results) - set(r['name'] for r in new['results'])
+    if len(missing) > 0:
+        print(f'{len(missing)} baseline configurations were not run.')
+    print(f'{len(regressions)} regressions beyond {tolerance:.0%}.')
+    return regressions
+
+def print_synthesis_speedups(results):
+    r"""Print the speedups of compiled and reduced-precision synthesis over
+    eager FP32 synthesis for the configurations run both ways.
+    """
+    by_name = {r['name']: r for r in results}
+    rows = []
+    for result in results:
+        cfg = result['config']
+        if cfg.get('synthesis', 'eager') == 'eager' and cfg.get('precision', 'fp32') == 'fp32':
+            continue
+        base = by_name.get(config_name(dict(cfg, synthesis='eager', precision='fp32')))
+        if base is not None:
+            rows.append((result['name'], base['stats'], result['stats']))
+    if len(rows) == 0:
+        return
+    width = max(len(name) for name, _, _ in rows)
+    print(f'{"config":<{width}}  {"eager fp32":>10}  {"variant":>10}  {"speedup":>7}  {"synthesis":>9}')
+    for name, base, variant in rows:
+        synth = base['stages'].get('synthesis', 0) / max(variant['stages'].get('synthesis', 0), 1e-9)
+        print(f'{name:<{width}}  {base["median"] * 1e3:8.1f}ms  {variant["median"] * 1e3:8.1f}ms  '
+            f'{base["median"] / variant["median"]:6.2f}x  {synth:8.2f}x')
+    stats = compiled_synthesis.get_stats()
+    if stats['eager'] + stats['compiled'] > 0:
+        print(f'Compiled {stats["compiled"]} calls, {stats["fallback"]} fallbacks to eager, {stats["compile_time"]:.1f}s compiling.')
+
+#----------------------------------------------------------------------------
+
+def parse_int_list(s: Union[str, List]) -> List[int]:
+    if isinstance(s, list): return s
+    return [int(x) for x in s.split(',')]
+
+def parse_str_list(s: Union[str, List]) -> List[str]:
+    if isinstance(s, list): return s
+    return [x.strip() for x in s.split(',')]
+
+def parse_bool_list(s: Union[str, List]) -> List[bool]:
+    if isinstance(s, list): return s
+    return [x.strip().lower() in ['1', 'true', 'on', 'yes'] for x in s.split(',')]
+
+#----------------------------------------------------------------------------
+
+@click.group()
+def main():
+    """Drag step microbenchmark on synthetic generators."""
+
+@main.command()
+@click.option('--arch', 'archs', type=parse_str_list, help='Generator architectures', default='stylegan2,stylegan3', show_default=True)
+@click.option('--res', 'resolutions', type=parse_int_list, help='Output resolutions', default='256,512,1024', show_default=True)
+@click.option('--handles', type=parse_int_list, help='Numbers of handle points', default='1,4,16', show_default=True)
+@click.option('--r1', type=parse_int_list, help='Motion supervision radii', default='3,6', show_default=True)
+@click.option('--r2', type=parse_int_list, help='Point tracking radii', default='12,24', show_default=True)
+@click.option('--latent', type=parse_str_list, help='Latent spaces (w, w+)', default='w+,w', show_default=True)
+@click.option('--mask', type=parse_bool_list, help='Without/with mask (0, 1)', default='0,1', show_default=True)
+@click.option('--feature-idx', type=parse_int_list, help='Feature map indices', default='5,3,6', show_default=True)
+@click.option('--grid', is_flag=True, help='Run the full cartesian product instead of one parameter at a time')
+@click.option('--synthesis', type=parse_str_list, help='Synthesis modes (eager, compiled)', default='eager', show_default=True)
+@click.option('--precision', type=parse_str_list, help='Synthesis precisions (fp32, bf16)', default='fp32', show_default=True)
+@click.option('--steps', type=int, help='Timed drag steps per configuration', default=10, show_default=True)
+@click.option('--warmup', type=int, help='Untimed drag steps per configuration', default=2, show_default=True)
+@click.option('--device', help='Torch device', default='cpu', show_default=True)
+@click.option('--threads', type=int, help='Number of CPU threads (default: torch default)')
+@click.option('--channel-base', type=int, help='Override the channel base of the generators')
+@click.option('--channel-max', type=int, help='Override the maximum channel count of the generators')
+@click.option('--seed', type=int, help='Random seed', default=0, show_default=True)
+@click.option('--out', help='Where to save the JSON results', metavar='FILE')
+@click.option('--baseline', help='Compare against these saved results', metavar='FILE')
+@click.option('--tolerance', type=float, help='Allowed relative slowdown', default=0.1, show_default=True)
+def run(archs, resolutions, handles, r1, r2, latent, mask, feature_idx, grid, synthesis, precision, steps, warmup, device, threads,
+    channel_base, channel_max, seed, out, baseline, tolerance):
+    """Time drag steps and optionally compare against a baseline.
+
+    The first value of every list is the default of that parameter. Unless
+    --grid is given, each parameter is varied on its own while the others
+    stay at their defaults. With --synthesis=eager,compiled, every
+    configuration also runs with torch.compile() synthesis and the speedups
+    are printed. Compiling happens during the second warmup step. The same
+    goes for --precision=fp32,bf16 and bfloat16 autocast synthesis.
+    """
+    assert all(l in ['w', 'w+'] for l in latent)
+    assert all(mode in ['eager', 'compiled'] for mode in synthesis)
+    assert all(prec in ['fp32', 'bf16'] for prec in precision)
+    if threads is not None:
+        torch.set_num_threads(threads)
+    values = dict(handles=handles, r1=r1, r2=r2, latent=latent, mask=mask, feature_idx=feature_idx)
+    configs = make_configs(archs, resolutions, values, grid=grid, synthesis=synthesis, precision=precision)
+
+    results = []
+    renderers = dict()
+    for cfg in configs:
+        name = config_name(cfg)
+        key = (cfg['arch'], cfg['res'], cfg['synthesis'], cfg['precision'])
+        if key not in renderers:
+            G = make_generator(cfg['arch'], cfg['res'], seed=seed, channel_base=channel_base, channel_max=channel_max)
+            renderers[key] = (make_renderer(G, cfg['arch'], device=device, w0_seed=seed,
+                compile_synthesis=(cfg['synthesis'] == 'compiled'), precision=cfg['precision']), num_features(G))
+        renderer, num_feat = renderers[key]
+        if cfg['feature_idx'] >= num_feat:
+            print(f'Skipping {name}: generator has only {num_feat} feature maps.')
+            continue
+        times, num_optimized = time_drag_steps(renderer, cfg, steps, warmup, seed=seed)
+        stats = summarize(times)
+        results.append(dict(name=name, config=cfg, steps=len(times), optimized_steps=num_optimized, stats=stats))
+        print(f'{name}: median {stats["median"] * 1e3:.1f}ms, min {stats["min"] * 1e3:.1f}ms, p90 {stats["p90"] * 1e3:.1f}ms')
+    if 'compiled' in synthesis or precision != ['fp32']:
+        print_synthesis_speedups(results)
+
+    data = dict(
+        meta = dict(
+            torch       = torch.__version__,
+            device      = device,
+            threads     = torch.get_num_threads(),
+            processor   = platform.processor() or platform.machine(),
+            platform    = platform.platform(),
+            python      = platform.python_version(),
+            time        = time.strftime('%Y-%m-%d %H:%M:%S'),
+            steps       = steps,
+            warmup      = warmup,
+            channel_base = channel_base,
+            channel_max = channel_max,
+            compile_stats = compiled_synthesis.get_stats() if 'compiled' in synthesis else None,
+        ),
+        results = results,
+    )
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(data, f, indent=2)
+    if baseline is not None:
+        with open(baseline) as f:
+            base = json.load(f)
+        if len(compare_results(data, base, tolerance=tolerance)) > 0:
+            sys.exit(1)
+
+@main.command()
+@click.argument('current', metavar='CURRENT')
+@click.argument('baseline', metavar='BASELINE')
+@click.option('--tolerance', type=float, help='Allowed relative slowdown', default=0.1, show_default=True)
+@click.option('--metric', type=click.Choice(['median', 'mean', 'min', 'p90']), default='median', show_default=True)
+def compare(current, baseline, tolerance, metric):
+    """Compare saved results against a baseline."""
+    with open(current) as f:
+        new = json.load(f)
+    with open(baseline) as f:
+        base = json.load(f)
+    if len(compare_results(new, base, tolerance=tolerance, metric=metric)) > 0:
+        sys.exit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,403 @@
+"""Benchmark of the custom ops in torch_utils/ops on StyleGAN shapes.
+
+Times the forward and backward passes of `bias_act`, `upfirdn2d`,
+`filtered_lrelu`, `conv2d_gradfix`, `conv2d_resample`, and
+`modulated_conv2d` for each available implementation. The shapes are
+taken from the layers of the official StyleGAN2 (config F) and StyleGAN3
+(config T) generators at 512x512: channel counts, resolutions, up/down
+factors, and filter sizes. Every result records the time per call,
+throughput in output elements per second, and peak memory. The output
+and input gradients of every implementation other than `ref` are checked
+against `ref`, and the run fails if they differ by more than --max-error.
+
+On CPU-only hosts the `ref` and `fast` implementations are benchmarked.
+The `cuda` implementations need a CUDA device and the compiled plugins.
+`conv2d_resample` and `modulated_conv2d` are composed of the other ops and
+are run as `auto`, i.e. with whatever implementation those ops select.
+`modulated_conv2d` is run fused, non-fused, and with `fused_modconv='auto'`,
+which picks one of the two per layer from the modconv_dispatch table.
+Results use the same JSON layout as bench_drag.py, so they can be compared
+with `bench_drag.py compare`.
+
+Examples:
+
+\b
+# All ops on CPU.
+python bench_ops.py --device=cpu --out=ops.json
+
+\b
+# Only the resampling ops, all implementations, on GPU.
+python bench_ops.py --ops=upfirdn2d,filtered_lrelu --device=cuda
+
+\b
+# Compare against a saved baseline.
+python bench_ops.py --device=cpu --baseline=ops-baseline.json --tolerance=0.1
+"""
+
+import json
+import platform
+import re
+import sys
+import time
+
+import click
+import numpy as np
+import torch
+
+from bench_drag import compare_results, parse_str_list
+from torch_utils.ops import bias_act, conv2d_gradfix, conv2d_resample, filtered_lrelu, upfirdn2d
+
+#----------------------------------------------------------------------------
+# Benchmark cases. Shapes exclude the batch dimension.
+
+SG3_PADDING_KEEP = [9, 8, 9, 8]         # up=2, down=2, same size.
+SG3_PADDING_GROW = [-6, -9, -6, -9]     # up=4, down=2, e.g. 36 -> 52.
+
+CASES = [
+    # Bias + leaky ReLU + clamp after the convolutions of StyleGAN2 and in the mapping network.
+    dict(op='bias_act', name='mapping-fc', shape=[512], act='lrelu', clamp=None),
+    dict(op='bias_act', name='sg2-b64', shape=[512, 64, 64], act='lrelu', clamp=256),
+    dict(op='bias_act', name='sg2-b256', shape=[128, 256, 256], act='lrelu', clamp=256),
+    dict(op='bias_act', name='sg2-b512', shape=[64, 512, 512], act='lrelu', clamp=256),
+
+    # Upsampling of the skip images, the resampling in conv2d_resample, and StyleGAN3 filters.
+    dict(op='upfirdn2d', name='sg2-torgb-skip-256', shape=[3, 256, 256], up=2, down=1, taps=4, padding=[2, 1, 2, 1]),
+    dict(op='upfirdn2d', name='sg2-conv-up-filter-b64', shape=[512, 65, 65], up=1, down=1, taps=4, padding=[1, 1, 1, 1]),
+    dict(op='upfirdn2d', name='sg2-down-b256', shape=[128, 256, 256], up=1, down=2, taps=4, padding=[1, 1, 1, 1]),
+    dict(op='upfirdn2d', name='sg3-up2-12tap-b148', shape=[512, 148, 148], up=2, down=1, taps=12, padding=SG3_PADDING_KEEP),
+    dict(op='upfirdn2d', name='sg3-down2-12tap-b148', shape=[512, 296, 296], up=1, down=2, taps=12, padding=0),
+
+    # StyleGAN3 synthesis layers (config T, 512x512).
+    dict(op='filtered_lrelu', name='sg3-L1_36_512', shape=[512, 36, 36], up=2, down=2, up_taps=12, down_taps=12, padding=SG3_PADDING_KEEP),
+    dict(op='filtered_lrelu', name='sg3-L2_52_512', shape=[512, 36, 36], up=4, down=2, up_taps=24, down_taps=12, padding=SG3_PADDING_GROW),
+    dict(op='filtered_lrelu', name='sg3-L6_148_512', shape=[512, 84, 84], up=4, down=2, up_taps=24, down_taps=12, padding=SG3_PADDING_GROW),
+    dict(op='filtered_lrelu', name='sg3-L9_276_215', shape=[215, 276, 276], up=2, down=2, up_taps=12, down_taps=12, padding=SG3_PADDING_KEEP),
+    dict(op='filtered_lrelu', name='sg3-L13_512_64', shape=[64, 532, 532], up=2, down=2, up_taps=12, down_taps=12, padding=[-11, -12, -11, -12]),
+
+    # Plain convolutions of StyleGAN2 synthesis layers and ToRGB.
+    dict(op='conv2d_gradfix', name='sg2-conv3x3-b64', shape=[512, 64, 64], out_channels=512, kernel=3),
+    dict(op='conv2d_gradfix', name='sg2-conv3x3-b256', shape=[128, 256, 256], out_channels=128, kernel=3),
+    dict(op='conv2d_gradfix', name='sg2-torgb-b512', shape=[64, 512, 512], out_channels=3, kernel=1),
+
+    # Convolutions with resampling as in StyleGAN2 synthesis layers and discriminator blocks.
+    dict(op='conv2d_resample', name='sg2-conv-up-b64', shape=[512, 32, 32], out_channels=512, kernel=3, up=2, down=1, taps=4),
+    dict(op='conv2d_resample', name='sg2-conv-up-b256', shape=[256, 128, 128], out_channels=128, kernel=3, up=2, down=1, taps=4),
+    dict(op='conv2d_resample', name='sg2-conv-b256', shape=[128, 256, 256], out_channels=128, kernel=3, up=1, down=1, taps=4),
+    dict(op='conv2d_resample', name='sg2-conv-down-b256', shape=[128, 256, 256], out_channels=256, kernel=3, up=1, down=2, taps=4),
+
+    # Modulated convolutions of StyleGAN2 synthesis layers, fused, non-fused, and autotuned.
+    dict(op='modulated_conv2d', name='sg2-conv-up-b64', shape=[512, 32, 32], out_channels=512, kernel=3, up=2, demodulate=True),
+    dict(op='modulated_conv2d', name='sg2-conv-b64', shape=[512, 64, 64], out_channels=512, kernel=3, up=1, demodulate=True),
+    dict(op='modulated_conv2d', name='sg2-conv-b256', shape=[128, 256, 256], out_channels=128, kernel=3, up=1, demodulate=True),
+    dict(op='modulated_conv2d', name='sg2-torgb-b512', shape=[64, 512, 512], out_channels=3, kernel=1, up=1, demodulate=False),
+]
+
+OPS = ['bias_act', 'upfirdn2d', 'filtered_lrelu', 'conv2d_gradfix', 'conv2d_resample', 'modulated_conv2d']
+COMPOSITE_OPS = ['conv2d_resample', 'modulated_conv2d'] # Run with impl='auto'.
+
+# Implementations supported by the basic ops.
+OP_IMPLS = dict(
+    bias_act        = ['ref', 'cuda'],
+    upfirdn2d       = ['ref', 'fast', 'cuda'],
+    filtered_lrelu  = ['ref', 'fast', 'cuda'],
+    conv2d_gradfix  = ['ref', 'cuda'],
+)
+
+def lowpass_filter(taps, factor, device):
+    r"""Separable Kaiser low-pass filter of the kind StyleGAN3 uses for
+    resampling by `factor`.
+    """
+    from training.networks_stylegan3 import SynthesisLayer
+    fs = 16 * factor
+    f = SynthesisLayer.design_lowpass_filter(numtaps=taps, cutoff=8, width=4, fs=fs)
+    return f.to(device)
+
+def resample_filter(taps, device):
+    r"""Filter as prepared by `upfirdn2d.setup_filter()`: the binomial
+    [1,3,3,1] for 4 taps (non-separable, like in StyleGAN2), otherwise a
+    separable low-pass filter.
+    """
+    if taps == 4:
+        return upfirdn2d.setup_filter([1, 3, 3, 1], device=device)
+    return upfirdn2d.setup_filter(lowpass_filter(taps, 2, 'cpu').numpy(), device=device)
+
+#----------------------------------------------------------------------------
+
+def build_case(case, impl, batch, device, dtype):
+    r"""Construct the inputs of a case. Returns `(fn, inputs)`, where `fn()`
+    computes the output from `inputs`, the tensors that receive gradients.
+    """
+    rnd = torch.Generator().manual_seed(0)
+    def randn(*shape, grad=True):
+        return torch.randn(shape, generator=rnd).to(device=device, dtype=dtype).requires_grad_(grad)
+
+    op = case['op']
+    x = randn(batch, *case['shape'])
+    if op == 'bias_act':
+        b = randn(case['shape'][0])
+        return (lambda: bias_act.bias_act(x, b, act=case['act'], clamp=case['clamp'], impl=impl)), [x, b]
+
+    if op == 'upfirdn2d':
+        f = resample_filter(case['taps'], device)
+        return (lambda: upfirdn2d.upfirdn2d(x, f, up=case['up'], down=case['down'], padding=case['padding'], gain=case['up'] ** 2, impl=impl)), [x]
+
+    if op == 'filtered_lrelu':
+        fu = lowpass_filter(case['up_taps'], case['up'], device)
+        fd = lowpass_filter(case['down_taps'], case['down'], device)
+        b = randn(case['shape'][0])
+        return (lambda: filtered_lrelu.filtered_lrelu(x, fu=fu, fd=fd, b=b, up=case['up'], down=case['down'],
+            padding=case['padding'], clamp=256, impl=impl)), [x, b]
+
+    k = case['kernel']
+    w = randn(case['out_channels'], case['shape'][0], k, k)
+    if op == 'conv2d_gradfix':
+        def conv():
+            # The custom op is toggled globally, as in the training loop.
+            old = conv2d_gradfix.enabled
+            conv2d_gradfix.enabled = (impl == 'cuda')
+            try:
+                return conv2d_gradfix.conv2d(x, w, padding=k // 2)
+            finally:
+                conv2d_gradfix.enabled = old
+        return conv, [x, w]
+
+    if op == 'conv2d_resample':
+        f = resample_filter(case['taps'], device)
+        return (lambda: conv2d_resample.conv2d_resample(x, w, f=f, up=case['up'], down=case['down'], padding=k // 2)), [x, w]
+
+    if op == 'modulated_conv2d':
+        from training.networks_stylegan2 import modulated_conv2d
+        f = resample_filter(4, device)
+        styles = randn(batch, case['shape'][0])
+        return (lambda: modulated_conv2d(x, w, styles, up=case['up'], padding=k // 2, resample_filter=f,
+            demodulate=case['demodulate'], fused_modconv=case['fused'])), [x, w, styles]
+
+    raise ValueError(f'Unknown op: {op}')
+
+def expand_cases(cases, ops, impls, name_filter, device):
+    r"""List `(case, impl)` pairs to run. Composite ops run once as `auto`,
+    modulated_conv2d fused, non-fused, and autotuned. Implementations that would
+    silently fall back to another one are skipped.
+    """
+    runs = []
+    for case in cases:
+        if case['op'] not in ops:
+            continue
+        if case['op'] == 'modulated_conv2d':
+            variants = [dict(case, name=f'{case["name"]}-{suffix}', fused=fused) for suffix, fused in [('fused', True), ('nonfused', False), ('auto', 'auto')]]
+        else:
+            variants = [case]
+        for variant in variants:
+            if name_filter is not None and not re.search(name_filter, f'{variant["op"]}/{variant["name"]}'):
+                continue
+            for impl in (['auto'] if variant['op'] in COMPOSITE_OPS else [i for i in impls if i in OP_IMPLS[variant['op']]]):
+                if impl == 'cuda' and not cuda_impl_available(variant['op'], device):
+                    continue
+                runs.append((variant, impl))
+    return runs
+
+def cuda_impl_available(op, device):
+    if torch.device(device).type != 'cuda':
+        return False
+    module = dict(bias_act=bias_act, upfirdn2d=upfirdn2d, filtered_lrelu=filtered_lrelu).get(op)
+    return module._init() if module is not None else True
+
+#----------------------------------------------------------------------------
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def _zero_grads(inputs):
+    for t in inputs:
+        t.grad = None
+
+def _proc_status(key):
+    # Value of a memory field of /proc/self/status in bytes, or None.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5') # Resets VmHWM to the current resident set size.
+        return True
+    except OSError:
+        return False
+
+def measure_peak_memory(fn, inputs, dy, device, backward):
+    r"""Peak number of bytes allocated by one call on top of the inputs. On
+    CPU, this is the growth of the peak resident set size of the process, or
+    None where it cannot be reset (non-Linux).
+    """
+    _zero_grads(inputs)
+    peak = None
+    if device.type == 'cuda':
+        _sync(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        y = fn()
+        if backward:
+            y.backward(dy)
+        _sync(device)
+        peak = torch.cuda.max_memory_allocated(device) - base
+    else:
+        base = _proc_status('VmRSS')
+        reset = _reset_peak_rss()
+        y = fn()
+        if backward:
+            y.backward(dy)
+        if reset and base is not None:
+            peak = max(_proc_status('VmHWM') - base, 0)
+    del y
+    _zero_grads(inputs)
+    return peak
+
+def time_case(fn, inputs, device, iters, warmup, backward):
+    r"""Time `iters` calls after `warmup` untimed ones. Returns the forward
+    and backward times in seconds and the output gradient used.
+    """
+    y = fn()
+    dy = torch.randn(y.shape, generator=torch.Generator().manual_seed(1)).to(device=y.device, dtype=y.dtype)
+    del y
+    forward_times, backward_times = [], []
+    for i in range(warmup + iters):
+        _zero_grads(inputs)
+        _sync(device)
+        t0 = time.perf_counter()
+        y = fn()
+        _sync(device)
+        t1 = time.perf_counter()
+        if backward:
+            y.backward(dy)
+            _sync(device)
+        t2 = time.perf_counter()
+        del y
+        if i >= warmup:
+            forward_times.append(t1 - t0)
+            backward_times.append(t2 - t1)
+    _zero_grads(inputs)
+    return forward_times, (backward_times if backward else None), dy
+
+def check_case(case, impl, batch, device, dtype, dy):
+    r"""Compare the output and the input gradients of `impl` against the
+    reference implementation. Returns the largest absolute differences,
+    relative to the largest magnitude of the reference values.
+    """
+    errors = []
+    for fn, inputs in [build_case(case, impl, batch, device, dtype), build_case(case, 'ref', batch, device, dtype)]:
+        y = fn()
+        grads = torch.autograd.grad(y, inputs, dy)
+        errors.append([y.detach()] + list(grads))
+    def rel_error(a, b):
+        return float((a.float() - b.float()).abs().max() / b.float().abs().max().clamp(min=1e-8))
+    values, ref_values = errors
+    return rel_error(values[0], ref_values[0]), max(rel_error(a, b) for a, b in zip(values[1:], ref_values[1:]))
+
+def summarize(times):
+    times = np.array(times)
+    return dict(
+        median  = float(np.median(times)),
+        mean    = float(np.mean(times)),
+        min     = float(np.min(times)),
+        max     = float(np.max(times)),
+        p90     = float(np.percentile(times, 90)),
+    )
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--ops', type=parse_str_list, help='Ops to benchmark', default=','.join(OPS), show_default=True)
+@click.option('--impl', 'impls', type=parse_str_list, help='Implementations of the basic ops', default='ref,fast,cuda', show_default=True)
+@click.option('--filter', 'name_filter', help='Only run cases whose op/name matches this regex')
+@click.option('--batch', type=int, help='Batch size', default=1, show_default=True)
+@click.option('--dtype', type=click.Choice(['float32', 'float16', 'bfloat16']), default='float32', show_default=True)
+@click.option('--backward/--no-backward', default=True, help='Also time the backward pass', show_default=True)
+@click.option('--check/--no-check', default=True, help='Compare against the ref implementation', show_default=True)
+@click.option('--max-error', type=float, help='Max relative error of the checks', default=1e-4, show_default=True)
+@click.option('--iters', type=int, help='Timed calls per case', default=10, show_default=True)
+@click.option('--warmup', type=int, help='Untimed calls per case', default=2, show_default=True)
+@click.option('--device', help='Torch device', default=('cuda' if torch.cuda.is_available() else 'cpu'), show_default=True)
+@click.option('--threads', type=int, help='Number of CPU threads (default: torch default)')
+@click.option('--out', help='Where to save the JSON results', metavar='FILE')
+@click.option('--baseline', help='Compare against these saved results', metavar='FILE')
+@click.option('--tolerance', type=float, help='Allowed relative slowdown', default=0.1, show_default=True)
+def main(ops, impls, name_filter, batch, dtype, backward, check, max_error, iters, warmup, device, threads, out, baseline, tolerance):
+    """Benchmark torch_utils ops on StyleGAN shapes."""
+    assert all(op in OPS for op in ops), f'Unknown op in {ops}'
+    if threads is not None:
+        torch.set_num_threads(threads)
+    device = torch.device(device)
+    dtype = getattr(torch, dtype)
+    runs = expand_cases(CASES, ops, impls, name_filter, device)
+    if 'cuda' in impls and device.type != 'cuda':
+        print('Skipping the cuda implementations: not running on a CUDA device.')
+
+    results = []
+    failures = []
+    for case, impl in runs:
+        fn, inputs = build_case(case, impl, batch, device, dtype)
+        forward_times, backward_times, dy = time_case(fn, inputs, device, iters, warmup, backward)
+        phases = [('forward', forward_times)] + ([('backward', backward_times)] if backward else [])
+        params = {k: v for k, v in case.items() if k not in ['op', 'name']}
+        errors = None
+        if check and impl not in ['ref', 'auto']:
+            errors = dict(zip(['forward', 'backward'], check_case(case, impl, batch, device, dtype, dy)))
+        for phase, times in phases:
+            stats = summarize(times)
+            peak = measure_peak_memory(fn, inputs, dy, device, backward=(phase == 'backward'))
+            name = f'{case["op"]}/{case["name"]}/{impl}/{phase}'
+            error = errors[phase] if errors is not None else None
+            results.append(dict(name=name, op=case['op'], case=case['name'], impl=impl, phase=phase, params=params,
+                batch=batch, out_shape=list(dy.shape), stats=stats, throughput=dy.numel() / stats['median'],
+                calls_per_sec=1 / stats['median'], peak_memory=peak, max_error=error))
+            status = ''
+            if error is not None:
+                status = f'  error {error:.1e}' + ('  MISMATCH' if error > max_error else '')
+                if error > max_error:
+                    failures.append(name)
+            memory = f'{peak / 2**20:9.1f} MB' if peak is not None else f'{"-":>9} MB'
+            print(f'{name:<60} {stats["median"] * 1e3:9.2f}ms {dy.numel() / stats["median"] / 1e6:10.1f} Melem/s {memory}{status}')
+        del fn, inputs, dy
+
+    data = dict(
+        meta = dict(
+            torch       = torch.__version__,
+            device      = str(device),
+            dtype       = str(dtype),
+            threads     = torch.get_num_threads(),
+            processor   = platform.processor() or platform.machine(),
+            platform    = platform.platform(),
+            python      = platform.python_version(),
+            time        = time.strftime('%Y-%m-%d %H:%M:%S'),
+            batch       = batch,
+            iters       = iters,
+            warmup      = warmup,
+        ),
+        results = results,
+    )
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(data, f, indent=2)
+    if len(failures) > 0:
+        print(f'{len(failures)} results differ from the ref implementation by more than {max_error:g}.')
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as f:
+            base = json.load(f)
+        regressions = compare_results(data, base, tolerance=tolerance)
+    if len(failures) > 0 or len(regressions) > 0:
+        sys.exit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
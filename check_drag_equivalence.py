@@ -0,0 +1,222 @@
+"""Check that an alternative drag implementation matches the reference.
+
+Runs the reference `Renderer._render_drag_impl` and an alternative side
+by side on the same randomly initialized generator, seed, points, and mask
+for a number of steps. After every step it compares the tracked points,
+the latents, and the output images, and checks them against tolerances.
+The result is a pass/fail report in JSON and a plot of the divergence over
+the steps.
+
+The alternative is a `Renderer` subclass given as `module:Name` (default:
+`Renderer` itself). It can be configured with extra constructor arguments
+and extra `_render_drag_impl` arguments given as JSON objects.
+
+Examples:
+
+\b
+# Sanity check: the reference against itself must match exactly.
+python check_drag_equivalence.py --arch=stylegan2 --res=256 --outdir=out
+
+\b
+# Check a hypothetical renderer option.
+python check_drag_equivalence.py --alt-renderer-kwargs='{"some_option": true}' --outdir=out
+
+\b
+# Check bfloat16 synthesis, which keeps the layers up to the tracked features
+# in FP32 and passes the default tolerances. With "fp32_features": false, the
+# trajectories drift apart by a pixel within a few steps and fail them.
+python check_drag_equivalence.py --alt-renderer-kwargs='{"precision": "bf16"}' --outdir=out
+"""
+
+import copy
+import importlib
+import json
+import math
+import os
+
+import click
+import numpy as np
+
+import dnnlib
+from bench_drag import make_drag_inputs, make_generator, make_renderer, synthetic_pkl
+from viz.renderer import Renderer
+
+#----------------------------------------------------------------------------
+
+def load_renderer_class(spec):
+    r"""Resolve `module:Name` to a `Renderer` subclass."""
+    if spec is None:
+        return Renderer
+    module_name, _, name = spec.partition(':')
+    cls = getattr(importlib.import_module(module_name), name)
+    if not (isinstance(cls, type) and issubclass(cls, Renderer)):
+        raise click.ClickException(f'{spec} is not a Renderer subclass')
+    return cls
+
+def point_error(a, b):
+    r"""Largest Euclidean distance between corresponding points, in pixels."""
+    if len(a) != len(b):
+        return math.inf
+    return max([math.hypot(p[0] - q[0], p[1] - q[1]) for p, q in zip(a, b)], default=0.0)
+
+def latent_error(w_alt, w_ref):
+    r"""Relative L2 distance and max absolute difference of two latents."""
+    w_alt = w_alt.detach().float().cpu()
+    w_ref = w_ref.detach().float().cpu()
+    if w_alt.shape != w_ref.shape:
+        return math.inf, math.inf
+    diff = w_alt - w_ref
+    return float(diff.norm() / w_ref.norm().clamp(min=1e-8)), float(diff.abs().max())
+
+def image_psnr(img_alt, img_ref):
+    r"""PSNR in dB of two uint8 images; infinite if they are identical."""
+    mse = np.mean((img_alt.astype(np.float64) - img_ref.astype(np.float64)) ** 2)
+    return math.inf if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+#----------------------------------------------------------------------------
+
+def run_side_by_side(ref, alt, points, targets, mask, steps, drag_kwargs, alt_drag_kwargs):
+    r"""Run `steps` drag steps with both renderers and return the per-step
+    comparison records and the final images.
+    """
+    ref_points = copy.deepcopy(points)
+    alt_points = copy.deepcopy(points)
+    ref_res = dnnlib.EasyDict()
+    alt_res = dnnlib.EasyDict()
+    records = []
+    for step in range(steps):
+        ref._render_drag_impl(ref_res, ref_points, targets, mask, is_drag=True, reset=(step == 0), to_pil=False, **drag_kwargs)
+        alt._render_drag_impl(alt_res, alt_points, targets, mask, is_drag=True, reset=(step == 0), to_pil=False, **dict(drag_kwargs, **alt_drag_kwargs))
+        ref.timer.end_step()
+        alt.timer.end_step()
+        ref_img = ref_res.image.cpu().numpy()
+        alt_img = alt_res.image.cpu().numpy()
+        rel, abs_max = latent_error(alt.w, ref.w)
+        records.append(dict(
+            step            = step,
+            point_error     = point_error(alt_res.points, ref_res.points),
+            latent_rel      = rel,
+            latent_abs      = abs_max,
+            image_psnr      = image_psnr(alt_img, ref_img),
+            image_max_diff  = int(np.abs(alt_img.astype(np.int32) - ref_img.astype(np.int32)).max()),
+            ref_points      = copy.deepcopy(ref_res.points),
+            alt_points      = copy.deepcopy(alt_res.points),
+            ref_stop        = bool(ref_res.stop),
+            alt_stop        = bool(alt_res.stop),
+        ))
+    return records, ref_img, alt_img
+
+def check_tolerances(records, point_tol, latent_tol, min_psnr):
+    r"""Return `{check: dict(passed, worst, tolerance, first_failure)}`."""
+    checks = dict(
+        points  = ('point_error', lambda v: v <= point_tol, max, point_tol),
+        latents = ('latent_rel', lambda v: v <= latent_tol, max, latent_tol),
+        images  = ('image_psnr', lambda v: v >= min_psnr, min, min_psnr),
+        stop    = ('stop_mismatch', lambda v: not v, max, False),
+    )
+    report = dict()
+    for name, (key, ok, worst_fn, tolerance) in checks.items():
+        values = [r['ref_stop'] != r['alt_stop'] if key == 'stop_mismatch' else r[key] for r in records]
+        failures = [r['step'] for r, v in zip(records, values) if not ok(v)]
+        report[name] = dict(passed=len(failures) == 0, worst=worst_fn(values), tolerance=tolerance,
+            first_failure=(failures[0] if len(failures) > 0 else None))
+    return report
+
+def plot_divergence(records, point_tol, latent_tol, min_psnr, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    steps = [r['step'] for r in records]
+    panels = [
+        ('point_error', 'Point error [px]', point_tol, False),
+        ('latent_rel', 'Relative latent error', latent_tol, True),
+        ('image_psnr', 'Image PSNR [dB]', min_psnr, False),
+    ]
+    fig, axes = plt.subplots(len(panels), 1, figsize=(8, 9), sharex=True)
+    for ax, (key, label, tolerance, log) in zip(axes, panels):
+        values = [r[key] for r in records]
+        if key == 'image_psnr':
+            values = [min(v, 100.0) for v in values] # Identical images have infinite PSNR.
+        ax.plot(steps, values, marker='.')
+        ax.axhline(tolerance, color='r', linestyle='--', label='tolerance')
+        if log and max(values) > 0:
+            ax.set_yscale('symlog', linthresh=max(tolerance * 1e-3, 1e-12))
+        ax.set_ylabel(label)
+        ax.legend(loc='best')
+    axes[-1].set_xlabel('Drag step')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--arch', type=click.Choice(['stylegan2', 'stylegan3']), default='stylegan2', show_default=True)
+@click.option('--res', type=int, help='Output resolution', default=256, show_default=True)
+@click.option('--channel-base', type=int, help='Override the channel base of the generator')
+@click.option('--channel-max', type=int, help='Override the maximum channel count of the generator')
+@click.option('--seed', type=int, help='Seed of the weights, latent, and handles', default=0, show_default=True)
+@click.option('--handles', type=int, help='Number of handle points', default=2, show_default=True)
+@click.option('--mask/--no-mask', 'with_mask', default=True, help='Use a mask that fixes the left half', show_default=True)
+@click.option('--latent', type=click.Choice(['w', 'w+']), default='w+', show_default=True)
+@click.option('--feature-idx', type=int, default=5, show_default=True)
+@click.option('--r1', type=int, default=3, show_default=True)
+@click.option('--r2', type=int, default=12, show_default=True)
+@click.option('--steps', type=int, help='Number of drag steps', default=20, show_default=True)
+@click.option('--device', help='Torch device', default='cpu', show_default=True)
+@click.option('--alt', 'alt_spec', help='Alternative Renderer subclass as module:Name', metavar='SPEC')
+@click.option('--alt-renderer-kwargs', help='JSON object of extra constructor arguments', default='{}', show_default=True)
+@click.option('--alt-drag-kwargs', help='JSON object of extra _render_drag_impl arguments', default='{}', show_default=True)
+@click.option('--point-tol', type=float, help='Max point error in pixels', default=1.0, show_default=True)
+@click.option('--latent-tol', type=float, help='Max relative latent error', default=1e-3, show_default=True)
+@click.option('--min-psnr', type=float, help='Min image PSNR in dB', default=40.0, show_default=True)
+@click.option('--outdir', help='Where to save the report and plot', metavar='DIR', required=True)
+def main(arch, res, channel_base, channel_max, seed, handles, with_mask, latent, feature_idx, r1, r2, steps, device,
+    alt_spec, alt_renderer_kwargs, alt_drag_kwargs, point_tol, latent_tol, min_psnr, outdir):
+    """Compare an alternative drag implementation against the reference."""
+    alt_class = load_renderer_class(alt_spec)
+    alt_renderer_kwargs = json.loads(alt_renderer_kwargs)
+    alt_drag_kwargs = json.loads(alt_drag_kwargs)
+
+    G = make_generator(arch, res, seed=seed, channel_base=channel_base, channel_max=channel_max)
+    ref = make_renderer(G, arch, device=device, w0_seed=seed, w_plus=(latent == 'w+'))
+    alt = alt_class(device=device, **alt_renderer_kwargs)
+    alt.add_pkl_data(synthetic_pkl(arch, res), dict(G_ema=G))
+    alt.init_network(dnnlib.EasyDict(), pkl=synthetic_pkl(arch, res), w0_seed=seed, w_plus=(latent == 'w+'))
+
+    points, targets, mask = make_drag_inputs(res, handles, seed=seed, with_mask=with_mask)
+    drag_kwargs = dict(lambda_mask=20, reg=0, feature_idx=feature_idx, r1=r1, r2=r2, trunc_psi=0.7)
+    records, ref_img, alt_img = run_side_by_side(ref, alt, points, targets, mask, steps, drag_kwargs, alt_drag_kwargs)
+    checks = check_tolerances(records, point_tol, latent_tol, min_psnr)
+    passed = all(check['passed'] for check in checks.values())
+
+    os.makedirs(outdir, exist_ok=True)
+    report = dict(
+        passed      = passed,
+        checks      = checks,
+        config      = dict(arch=arch, res=res, channel_base=channel_base, channel_max=channel_max, seed=seed, handles=handles,
+                        mask=with_mask, latent=latent, steps=steps, device=device, alt=alt_spec or 'viz.renderer:Renderer',
+                        alt_renderer_kwargs=alt_renderer_kwargs, alt_drag_kwargs=alt_drag_kwargs, **drag_kwargs),
+        steps       = records,
+    )
+    with open(os.path.join(outdir, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    plot_divergence(records, point_tol, latent_tol, min_psnr, os.path.join(outdir, 'divergence.png'))
+    import PIL.Image
+    diff = np.abs(alt_img.astype(np.int32) - ref_img.astype(np.int32)).clip(0, 255).astype(np.uint8)
+    PIL.Image.fromarray(np.concatenate([ref_img, alt_img, diff], axis=1), 'RGB').save(os.path.join(outdir, 'final.png'))
+
+    for name, check in checks.items():
+        status = 'pass' if check['passed'] else f'FAIL (first at step {check["first_failure"]})'
+        print(f'{name:<8} worst {check["worst"]!s:<24} tolerance {check["tolerance"]!s:<10} {status}')
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,243 @@
+"""Check `dnnlib.util.open_url` and its download cache against a local
+HTTP server.
+
+The server serves random blobs and can be told to support HTTP Range
+requests or not, to drop the connection part way through the first
+requests, to send slowly, and to name the file in a Content-Disposition
+header. The checks cover plain and cached downloads, resuming after dropped
+connections (with and without Range support), parallel segments, size and
+SHA-256 verification, the number of requests of a failing download,
+progress reporting, uncached downloads, and the memory held while
+downloading, which must stay within a few 1 MB download chunks whatever
+the size of the file. For the cache, they cover the index, LRU eviction under a byte
+budget, and concurrent processes that open the same URL, which must
+download it only once.
+
+Examples:
+
+\b
+python check_open_url.py
+python check_open_url.py --size-mb=64 --segments=8
+"""
+
+import hashlib
+import http.server
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import click
+import numpy as np
+
+import dnnlib
+
+#----------------------------------------------------------------------------
+
+class BlobHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.blobs.get(self.path.lstrip('/'), None)
+        with server.lock:
+            server.requests.append(dict(path=self.path, range=self.headers.get('Range', None)))
+            drop = server.drops_left > 0
+            server.drops_left -= int(drop)
+        if data is None:
+            self.send_error(404)
+            return
+        start, end, status = 0, len(data), 200
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if server.ranges and match:
+            start, end, status = int(match[1]), (int(match[2]) + 1 if match[2] else len(data)), 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start))
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(data)}')
+        if server.filename is not None:
+            self.send_header('Content-Disposition', f'attachment; filename="{server.filename}"')
+        self.end_headers()
+        time.sleep(server.delay)
+        stop = start + (end - start) // 3 if drop else end
+        try:
+            for pos in range(start, stop, 1 << 16):
+                self.wfile.write(data[pos : min(pos + (1 << 16), stop)])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True # The client gave up on this request.
+        if drop:
+            self.close_connection = True
+
+class BlobServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, blobs):
+        super().__init__(('127.0.0.1', 0), BlobHandler)
+        self.blobs = blobs
+        self.lock = threading.Lock()
+        self.configure()
+
+    def configure(self, ranges=True, drops=0, filename=None, delay=0):
+        self.ranges = ranges        # Support Range requests?
+        self.drops_left = drops     # Drop the connection after a third of the body for this many requests.
+        self.filename = filename    # Content-Disposition file name.
+        self.delay = delay          # Seconds to wait before sending the body.
+        self.requests = []
+
+    def url(self, name):
+        return f'http://127.0.0.1:{self.server_address[1]}/{name}'
+
+#----------------------------------------------------------------------------
+
+def read_url(url, **kwargs):
+    with dnnlib.util.open_url(url, verbose=False, **kwargs) as f:
+        return f.read()
+
+def read_url_size(url, cache_dir):
+    return len(read_url(url, cache_dir=cache_dir))
+
+def cached_blobs(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if re.fullmatch(r'[0-9a-f]{32}_.*', name))
+
+def expect_error(fn):
+    try:
+        fn()
+    except IOError as e:
+        return str(e)
+    return None
+
+def run_checks(server, data, cache_dir, segments):
+    size = len(data)
+    sha256 = hashlib.sha256(data).hexdigest()
+    url = server.url('blob.pkl')
+    checks = dict()
+
+    server.configure(filename='generator.pkl')
+    checks['plain'] = read_url(url, cache_dir=cache_dir) == data and len(server.requests) == 1
+    cache_files = cached_blobs(cache_dir)
+    checks['cache file'] = len(cache_files) == 1 and cache_files[0].endswith('_generator.pkl')
+    entry = dnnlib.util.get_download_cache_index(cache_dir).get(url, {})
+    checks['index'] = entry.get('file', None) == cache_files[0] and entry.get('size', None) == size and entry.get('sha256', None) == sha256
+    server.configure()
+    checks['cache hit'] = read_url(url, cache_dir=cache_dir) == data and len(server.requests) == 0
+    error = expect_error(lambda: read_url(url, cache_dir=cache_dir, expected_sha256='0' * 64)) # Cached, but different => download again.
+    checks['hash checked on cache hit'] = error is not None and len(server.requests) == 1
+    shutil.rmtree(cache_dir)
+
+    server.configure(drops=2)
+    ok = read_url(url, cache_dir=cache_dir) == data
+    ranges = [r['range'] for r in server.requests]
+    checks['resume'] = ok and len(ranges) == 3 and ranges[0] is None and all(r is not None and not r.startswith('bytes=0-') for r in ranges[1:])
+    shutil.rmtree(cache_dir)
+
+    server.configure(ranges=False, drops=2)
+    checks['restart without ranges'] = read_url(url, cache_dir=cache_dir) == data and len(server.requests) == 3
+    shutil.rmtree(cache_dir)
+
+    server.configure(drops=100)
+    error = expect_error(lambda: read_url(url, cache_dir=cache_dir, num_attempts=3))
+    checks['retry budget'] = error is not None and len(server.requests) == 3
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    server.configure(drops=1)
+    ok = read_url(url, cache_dir=cache_dir, num_segments=segments, min_segment_size=1 << 20) == data
+    num_ranged = sum(r['range'] is not None for r in server.requests)
+    checks['parallel segments'] = ok and num_ranged >= segments
+    shutil.rmtree(cache_dir)
+
+    server.configure(ranges=False)
+    checks['segments without ranges'] = read_url(url, cache_dir=cache_dir, num_segments=segments, min_segment_size=1 << 20) == data
+    shutil.rmtree(cache_dir)
+
+    server.configure()
+    error = expect_error(lambda: read_url(url, cache_dir=cache_dir, expected_sha256='0' * 64))
+    checks['wrong hash rejected'] = error is not None and 'SHA-256' in error and len(cached_blobs(cache_dir)) == 0
+    error = expect_error(lambda: read_url(url, cache_dir=cache_dir, expected_size=size + 1))
+    checks['wrong size rejected'] = error is not None and len(cached_blobs(cache_dir)) == 0
+    checks['verified'] = read_url(url, cache_dir=cache_dir, expected_size=size, expected_sha256=sha256) == data
+    server.configure()
+    error = expect_error(lambda: read_url(url, cache_dir=cache_dir, expected_size=size + 1)) # Cached, but too small => download again.
+    checks['size checked on cache hit'] = error is not None and len(server.requests) == 1
+    shutil.rmtree(cache_dir)
+
+    reports = []
+    read_url(url, cache_dir=cache_dir, progress_fn=lambda done, total: reports.append((done, total)))
+    checks['progress'] = len(reports) >= 1 and reports[-1] == (size, size) and all(a[0] <= b[0] for a, b in zip(reports, reports[1:]))
+    shutil.rmtree(cache_dir)
+
+    checks['uncached'] = read_url(url, cache_dir=cache_dir, cache=False) == data and not os.path.exists(cache_dir)
+
+    tracemalloc.start()
+    dnnlib.util.open_url(url, cache_dir=cache_dir, verbose=False, return_filename=True)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    checks['streaming memory'] = peak < 4 << 20 # A few 1 MB chunks of _download_range().
+    print(f'Peak traced memory while downloading {size / 2**20:.0f} MB: {peak / 2**20:.1f} MB')
+    shutil.rmtree(cache_dir)
+
+    # Concurrent processes => one download.
+    server.configure(delay=1)
+    with multiprocessing.get_context('spawn').Pool(3) as pool:
+        sizes = pool.starmap(read_url_size, [(url, cache_dir)] * 3)
+    checks['one download for processes'] = sizes == [size] * 3 and len(server.requests) == 1
+    shutil.rmtree(cache_dir)
+
+    # LRU eviction: b is the least recently used when c arrives.
+    small = {name: server.url(name) for name in ['a.pkl', 'b.pkl', 'c.pkl']}
+    small_size = len(server.blobs['a.pkl'])
+    dnnlib.util.download_cache_max_bytes = small_size * 5 // 2
+    try:
+        for name in ['a.pkl', 'b.pkl', 'a.pkl', 'c.pkl']:
+            read_url(small[name], cache_dir=cache_dir)
+    finally:
+        dnnlib.util.download_cache_max_bytes = None
+    index = dnnlib.util.get_download_cache_index(cache_dir)
+    checks['LRU eviction'] = sorted(index.keys()) == [small['a.pkl'], small['c.pkl']] and len(cached_blobs(cache_dir)) == 2
+    shutil.rmtree(cache_dir)
+
+    server.configure()
+    checks['missing file'] = expect_error(lambda: read_url(server.url('missing.pkl'), cache_dir=cache_dir, num_attempts=2)) is not None
+    return checks
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--size-mb', type=int, help='Size of the served file', default=32, show_default=True)
+@click.option('--segments', type=int, help='Parallel segments to check', default=4, show_default=True)
+@click.option('--seed', type=int, help='Random seed', default=0, show_default=True)
+def main(size_mb, segments, seed):
+    """Check open_url() against a local HTTP server."""
+    data = np.random.RandomState(seed).bytes(size_mb << 20)
+    blobs = {'blob.pkl': data}
+    blobs.update({name: data[i << 20 : (i + 1) << 20] for i, name in enumerate(['a.pkl', 'b.pkl', 'c.pkl'])})
+    server = BlobServer(blobs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        checks = run_checks(server, data, os.path.join(tmp_dir, 'downloads'), segments)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    for name, ok in checks.items():
+        print(f'{name:<28} ' + ('pass' if ok else 'FAIL'))
+    passed = all(checks.values())
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,159 @@
+"""Check that the fast implementations of the resampling ops match `ref`.
+
+Runs `upfirdn2d` and `filtered_lrelu` with `impl='fast'` and `impl='ref'`
+on random configurations in float64: separable, non-separable, and missing
+filters, up/down factors, positive and negative padding, flipped filters,
+gains, slopes, and clamps. Outputs and input gradients must agree within a
+tolerance. Filters have dyadic coefficients, so that both paths see the
+same filter values after the float32 gain scaling. Finally, first and
+second order gradients of the fast paths are verified numerically with
+`torch.autograd.gradcheck`.
+
+Realistic shapes are checked in float32 by bench_ops.py.
+
+Examples:
+
+\b
+python check_ops_equivalence.py
+python check_ops_equivalence.py --ops=filtered_lrelu --trials=1000 --seed=1
+"""
+
+import random
+
+import click
+import numpy as np
+import torch
+
+from bench_drag import parse_str_list
+from torch_utils.ops import filtered_lrelu, upfirdn2d
+
+#----------------------------------------------------------------------------
+
+def random_filter(rnd, max_taps, allow_none=True):
+    r"""Random separable, non-separable, or missing filter with coefficients
+    in multiples of 1/8.
+    """
+    kind = rnd.random()
+    if allow_none and kind < 0.1:
+        return None
+    if kind < 0.35:
+        shape = [rnd.randint(1, 6), rnd.randint(1, 6)]
+    else:
+        shape = [rnd.randint(1, max_taps)]
+    return torch.tensor(np.array([rnd.randint(1, 8) for _ in range(int(np.prod(shape)))]).reshape(shape) / 8, dtype=torch.float32)
+
+def _filter_size(f):
+    return (1, 1) if f is None else (f.shape[-1], f.shape[0])
+
+def random_upfirdn2d_case(rnd):
+    f = random_filter(rnd, 12)
+    fw, fh = _filter_size(f)
+    up = [rnd.randint(1, 4), rnd.randint(1, 4)]
+    down = [rnd.randint(1, 4), rnd.randint(1, 4)]
+    size = [rnd.randint(4, 20), rnd.randint(4, 20)]
+    padding = [rnd.randint(-4, 12) for _ in range(4)]
+    if size[1] * up[0] + padding[0] + padding[1] < fw or size[0] * up[1] + padding[2] + padding[3] < fh:
+        return None
+    return dict(size=size, channels=3, kwargs=dict(f=f, up=up, down=down, padding=padding,
+        flip_filter=(rnd.random() < 0.5), gain=rnd.choice([1, 0.5, 4])))
+
+def random_filtered_lrelu_case(rnd):
+    fu = random_filter(rnd, 24)
+    fd = random_filter(rnd, 12)
+    (fuw, fuh), (fdw, fdh) = _filter_size(fu), _filter_size(fd)
+    up = rnd.choice([1, 2, 4])
+    down = rnd.choice([1, 2])
+    size = rnd.randint(6, 16)
+    padding = [rnd.randint(-3, 10) for _ in range(4)]
+    if size * up + padding[0] + padding[1] - fuw + 1 < fdw or size * up + padding[2] + padding[3] - fuh + 1 < fdh:
+        return None
+    return dict(size=[size, size], channels=3, bias=(rnd.random() < 0.7), kwargs=dict(fu=fu, fd=fd, up=up, down=down,
+        padding=padding, gain=rnd.choice([1.0, 4.0]), slope=rnd.choice([0.2, 0.0]), clamp=rnd.choice([None, 0.5, 2.0]),
+        flip_filter=(rnd.random() < 0.3)))
+
+#----------------------------------------------------------------------------
+
+def run_case(op, case, seed):
+    r"""Largest absolute difference of the outputs and input gradients of
+    the fast and ref implementations.
+    """
+    gen = torch.Generator().manual_seed(seed)
+    x = (torch.randn([2, case['channels']] + case['size'], generator=gen, dtype=torch.float64) * 2).requires_grad_(True)
+    inputs = [x]
+    kwargs = dict(case['kwargs'])
+    if op == 'filtered_lrelu':
+        kwargs['b'] = torch.randn([case['channels']], generator=gen, dtype=torch.float64).requires_grad_(True) if case['bias'] else None
+        inputs += [kwargs['b']] if case['bias'] else []
+        fn = lambda impl: filtered_lrelu.filtered_lrelu(x, impl=impl, **kwargs)
+    else:
+        fn = lambda impl: upfirdn2d.upfirdn2d(x, impl=impl, **kwargs)
+
+    y_ref = fn('ref')
+    y_fast = fn('fast')
+    if y_ref.shape != y_fast.shape:
+        return float('inf')
+    dy = torch.randn(y_ref.shape, generator=gen, dtype=torch.float64)
+    g_ref = torch.autograd.grad(y_ref, inputs, dy)
+    g_fast = torch.autograd.grad(y_fast, inputs, dy)
+    return max([float((a - b).detach().abs().max()) if a.numel() > 0 else 0.0 for a, b in zip([y_fast, *g_fast], [y_ref, *g_ref])])
+
+def run_gradchecks():
+    r"""Numerical first and second order gradient checks of the fast paths."""
+    x = torch.randn([1, 2, 12, 12], dtype=torch.float64, requires_grad=True)
+    b = torch.randn([2], dtype=torch.float64, requires_grad=True)
+    f = upfirdn2d.setup_filter([1, 3, 3, 1])
+    f12 = torch.rand([12])
+    checks = dict(
+        upsample2d      = ((lambda x: upfirdn2d.upsample2d(x, f, impl='fast')), (x,)),
+        downsample2d    = ((lambda x: upfirdn2d.downsample2d(x, f12, impl='fast')), (x,)),
+        filtered_lrelu  = ((lambda x, b: filtered_lrelu.filtered_lrelu(x, f12, f12, b, up=2, down=2, padding=10, clamp=1.0, impl='fast')), (x, b)),
+    )
+    results = dict()
+    for name, (fn, inputs) in checks.items():
+        results[name] = bool(torch.autograd.gradcheck(fn, inputs, raise_exception=False) and torch.autograd.gradgradcheck(fn, inputs, raise_exception=False))
+    return results
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--ops', type=parse_str_list, help='Ops to check', default='upfirdn2d,filtered_lrelu', show_default=True)
+@click.option('--trials', type=int, help='Random configurations per op', default=300, show_default=True)
+@click.option('--seed', type=int, help='Random seed', default=0, show_default=True)
+@click.option('--atol', type=float, help='Max absolute difference', default=1e-9, show_default=True)
+def main(ops, trials, seed, atol):
+    """Check the fast resampling ops against the reference implementations."""
+    makers = dict(upfirdn2d=random_upfirdn2d_case, filtered_lrelu=random_filtered_lrelu_case)
+    assert all(op in makers for op in ops), f'Unknown op in {ops}'
+    passed = True
+    for op in ops:
+        rnd = random.Random(seed)
+        worst = 0.0
+        num_cases = 0
+        failures = []
+        for trial in range(trials):
+            case = makers[op](rnd)
+            if case is None:
+                continue
+            error = run_case(op, case, seed=trial)
+            worst = max(worst, error)
+            num_cases += 1
+            if error > atol:
+                failures.append((trial, error, case))
+        print(f'{op:<16} {num_cases} configurations, worst difference {worst:.2e}: ' + ('pass' if len(failures) == 0 else f'FAIL ({len(failures)})'))
+        for trial, error, case in failures[:5]:
+            print(f'  trial {trial}: difference {error:.2e}, {case}')
+        passed = passed and len(failures) == 0
+
+    for name, ok in run_gradchecks().items():
+        print(f'{"gradcheck":<16} {name}: ' + ('pass' if ok else 'FAIL'))
+        passed = passed and ok
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,72 @@
+"""Check that loading only `G_ema` from network pickles matches a full load.
+
+For every pickle, loads it in full and with `legacy.load_network_pkl(f,
+keys=[key])`, and checks that the selected network has the same class,
+init arguments, and bitwise equal parameters and buffers. Reports the load
+times and the tensor bytes that each result keeps alive.
+
+Examples:
+
+\b
+python check_selective_load.py --network=stylegan2-ffhq-512x512.pkl
+python check_selective_load.py --network=a.pkl --network=b.pkl --key=G_ema
+"""
+
+import time
+
+import click
+import torch
+
+import dnnlib
+import legacy
+
+#----------------------------------------------------------------------------
+
+def tensor_bytes(data):
+    r"""Bytes of the distinct tensors held by the networks in `data`."""
+    tensors = dict()
+    for value in data.values():
+        if isinstance(value, torch.nn.Module):
+            for t in list(value.parameters()) + list(value.buffers()):
+                tensors[t.data_ptr()] = t.numel() * t.element_size()
+    return sum(tensors.values())
+
+def load(network_pkl, keys):
+    t0 = time.perf_counter()
+    with dnnlib.util.open_url(network_pkl, verbose=False) as f:
+        data = legacy.load_network_pkl(f, keys=keys)
+    return data, time.perf_counter() - t0
+
+def same_network(a, b):
+    if type(a) is not type(b) or getattr(a, 'init_kwargs', None) != getattr(b, 'init_kwargs', None):
+        return False
+    state_a, state_b = a.state_dict(), b.state_dict()
+    return state_a.keys() == state_b.keys() and all(torch.equal(state_a[k], state_b[k]) for k in state_a)
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--network', 'network_pkls', help='Network pickle filename or URL', multiple=True, required=True)
+@click.option('--key', help='Network to load', default='G_ema', show_default=True)
+def main(network_pkls, key):
+    """Check that loading one network of a pickle matches a full load."""
+    passed = True
+    for network_pkl in network_pkls:
+        full, full_time = load(network_pkl, None)
+        selected, selected_time = load(network_pkl, [key])
+        ok = list(selected.keys()) == [key] and same_network(selected[key], full[key])
+        passed = passed and ok
+        print(f'{network_pkl}: {"pass" if ok else "FAIL"}')
+        print(f'    full load:  {full_time:.2f}s, {tensor_bytes(full) / 2**20:.0f} MB of tensors ({", ".join(sorted(full.keys()))})')
+        print(f'    {key + " only:":<11} {selected_time:.2f}s, {tensor_bytes(selected) / 2**20:.0f} MB of tensors')
+        del full, selected
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,98 @@
+"""Check that networks sharing their weights through the weight store match
+private copies.
+
+For every pickle, builds `G_ema` twice through `torch_utils.weight_store`
+as the renderer does, and checks that the networks hold bitwise equal
+tensors to a network loaded with `load_state_dict()`, that the two copies
+share every tensor, that they generate the same images, and that
+`unshare()` gives a network private tensors that can be modified without
+affecting the store. Reports the bytes held with and without sharing.
+
+Examples:
+
+\b
+python check_weight_store.py --network=stylegan2-ffhq-512x512.pkl
+python check_weight_store.py --network=a.pkl --network=b.pkl
+"""
+
+import importlib
+
+import click
+import numpy as np
+import torch
+
+import dnnlib
+import legacy
+import native_checkpoint
+from torch_utils import quantization
+from torch_utils import weight_store
+
+#----------------------------------------------------------------------------
+
+def build(orig, network_pkl):
+    module_name, class_name, extra_kwargs = native_checkpoint.infer_generator_class(network_pkl)
+    Generator = getattr(importlib.import_module(module_name), class_name)
+    net = Generator(*orig.init_args, **orig.init_kwargs, **extra_kwargs).eval()
+    if quantization.is_quantized(orig):
+        quantization.quantize(net, names=quantization.quantized_names(orig))
+    return net
+
+def generate(G, seed):
+    z = torch.from_numpy(np.random.RandomState(seed).randn(1, G.z_dim)).float()
+    c = torch.zeros([1, G.c_dim])
+    with torch.no_grad():
+        return G(z, c, noise_mode='const')
+
+def tensors(net):
+    return list(net.state_dict(keep_vars=True).values())
+
+def num_bytes(nets):
+    ptrs = {t.data_ptr(): t.numel() * t.element_size() for net in nets for t in tensors(net)}
+    return sum(ptrs.values())
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--network', 'network_pkls', help='Network pickle filename or URL', multiple=True, required=True)
+@click.option('--seed', type=int, help='Random seed', default=0, show_default=True)
+def main(network_pkls, seed):
+    """Check that shared network weights match private copies."""
+    passed = True
+    for network_pkl in network_pkls:
+        with dnnlib.util.open_url(network_pkl, verbose=False) as f:
+            orig = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema']
+        private = build(orig, network_pkl)
+        private.load_state_dict(orig.state_dict())
+        weight_store.share(orig)
+        a = weight_store.share_from(build(orig, network_pkl), orig)
+        b = weight_store.share_from(build(orig, network_pkl), orig)
+
+        checks = dict()
+        checks['equal to private'] = all(torch.equal(x, y) for x, y in zip(tensors(a), tensors(private)))
+        checks['all shared'] = all(x.data_ptr() == y.data_ptr() and weight_store.is_shared(x) for x, y in zip(tensors(a), tensors(b)))
+        checks['no grads'] = not any(p.requires_grad for p in a.parameters())
+        img = generate(private, seed)
+        checks['same image'] = torch.equal(generate(a, seed), img) and torch.equal(generate(b, seed), img)
+        weight_store.unshare(b)
+        with torch.no_grad():
+            for p in b.parameters():
+                p.add_(1)
+        checks['copy on write'] = len(weight_store.check()) == 0 and torch.equal(generate(a, seed), img)
+
+        ok = all(checks.values())
+        passed = passed and ok
+        print(f'{network_pkl}: {"pass" if ok else "FAIL"}')
+        for name, check_ok in checks.items():
+            print(f'    {name:<18} {"pass" if check_ok else "FAIL"}')
+        print(f'    3 networks: {num_bytes([orig, a, private]) / 2**20:.0f} MB with the store, {3 * num_bytes([private]) / 2**20:.0f} MB without')
+        del orig, private, a, b
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,367 @@
+"""Catalog of the checkpoints in a model directory.
+
+`CheckpointCatalog(model_dir)` lists the network pickles and native
+checkpoints (see native_checkpoint.py) of a directory together with their
+metadata: architecture, resolution, latent sizes, file size, SHA-256,
+parameter bytes, and estimates of the memory that a drag session holds and
+of the compute per drag step. The metadata is extracted without
+constructing any network: native checkpoints describe their tensors in
+their header, and pickles are read with a selective unpickler that records
+the init arguments and tensor shapes of `G_ema` without reading the tensor
+data. The catalog is saved next to the checkpoints, in `catalog.json`, and
+`refresh()` only reads the files that were added or changed since.
+
+Examples:
+
+\b
+# List the checkpoints of a directory, scanning new and changed files.
+python checkpoint_catalog.py --model-dir=checkpoints
+
+\b
+# Print the catalog as JSON.
+python checkpoint_catalog.py --model-dir=checkpoints --json
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import warnings
+
+import click
+
+import dnnlib
+import native_checkpoint
+from torch_utils import selective_unpickle
+
+#----------------------------------------------------------------------------
+
+FORMAT_VERSION  = 1
+INDEX_NAME      = 'catalog.json'
+FEATURE_IDX     = 5             # Synthesis feature used for tracking, as in `Renderer._render_drag_impl()`.
+
+def is_checkpoint(filename):
+    return filename.endswith('.pkl') or native_checkpoint.is_native(filename)
+
+#----------------------------------------------------------------------------
+# Pickles: G_ema with tensor stubs instead of tensors.
+
+class _DataStub:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+class _TensorStub:
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = tuple(shape)
+
+class _PersistentStub:
+    def __init__(self, meta):
+        self.module_src = meta['module_src']
+        self.class_name = meta['class_name']
+        self.__dict__.update(meta['state'])
+
+def _rebuild_tensor(storage, _storage_offset, size, *_args, **_kwargs):
+    return _TensorStub(storage, size)
+
+_STUBS = {
+    ('torch_utils.persistence', '_reconstruct_persistent_obj'): _PersistentStub,
+    ('torch.storage', '_load_from_bytes'): lambda data: data,
+    ('torch._utils', '_rebuild_tensor_v2'): _rebuild_tensor,
+    ('torch._utils', '_rebuild_parameter'): lambda data, *_args: data,
+    ('torch._utils', '_rebuild_parameter_with_state'): lambda data, *_args: data,
+}
+
+class _MetadataUnpickler(selective_unpickle.SelectiveUnpickler):
+    lazy_data = True
+    full_unpickler = None # Never reads the tensor data.
+
+    def data_placeholder(self, nbytes):
+        return _DataStub(nbytes)
+
+    def find_class(self, module, name):
+        stub = _STUBS.get((module, name), None)
+        return stub if stub is not None else super().find_class(module, name)
+
+def _collect_tensors(net, prefix, tensors):
+    for attr in ['_parameters', '_buffers']:
+        for name, tensor in (net.__dict__.get(attr, None) or dict()).items():
+            if tensor is not None:
+                tensors[prefix + name] = tensor
+    for name, module in (net.__dict__.get('_modules', None) or dict()).items():
+        if module is not None:
+            _collect_tensors(module, f'{prefix}{name}.', tensors)
+
+def _describe_pickle(path):
+    with open(path, 'rb') as f:
+        G = _MetadataUnpickler(f, ['G_ema']).load()['G_ema']
+    stubs = dict()
+    _collect_tensors(G, '', stubs)
+    if not all(isinstance(t, _TensorStub) for t in stubs.values()):
+        raise ValueError('Tensors of unknown type')
+    tensors = {name: dict(shape=list(t.shape), nbytes=t.data.nbytes if isinstance(t.data, _DataStub) else 0) for name, t in stubs.items()}
+    storages = {id(t.data): tensors[name]['nbytes'] for name, t in stubs.items()}
+    kwargs = dict(G.__dict__.get('_init_kwargs', None) or dict())
+    attrs = {key: G.__dict__.get(key, kwargs.get(key, None)) for key in ['z_dim', 'c_dim', 'w_dim', 'img_resolution', 'img_channels', 'num_ws']}
+    return attrs, tensors, sum(storages.values())
+
+def _describe_network(path):
+    r"""Fallback for pickles that the stubs cannot describe, e.g. TensorFlow
+    pickles: construct `G_ema` once.
+    """
+    import legacy # pylint: disable=import-outside-toplevel
+    with open(path, 'rb') as f:
+        G = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema']
+    tensors = {name: dict(shape=list(t.shape), nbytes=t.numel() * t.element_size()) for name, t in list(G.named_parameters()) + list(G.named_buffers())}
+    attrs = {key: getattr(G, key, None) for key in ['z_dim', 'c_dim', 'w_dim', 'img_resolution', 'img_channels', 'num_ws']}
+    return attrs, tensors, sum(t['nbytes'] for t in tensors.values())
+
+def _describe_native(path):
+    spec = native_checkpoint.NativeCheckpoint(path).header['networks']['G_ema']
+    kwargs = spec['init_kwargs']
+    attrs = {key: kwargs.get(key, None) for key in ['z_dim', 'c_dim', 'w_dim', 'img_resolution', 'img_channels']}
+    attrs['num_ws'] = None
+    tensors = {name: dict(shape=t['shape'], nbytes=t['nbytes']) for name, t in spec['tensors'].items()}
+    return attrs, tensors, sum(t['nbytes'] for t in tensors.values())
+
+#----------------------------------------------------------------------------
+# Metadata derived from the tensor names and shapes.
+
+def _infer_arch(path, tensors):
+    for arch in ['stylegan_human', 'stylegan2', 'stylegan3']: # Like `native_checkpoint.infer_generator_class()`.
+        if arch in os.path.basename(path):
+            return arch
+    return 'stylegan3' if any(name.startswith('synthesis.input.') for name in tensors) else 'stylegan2'
+
+def _synthesis_layers(arch, tensors, img_resolution):
+    r"""[(name, out_channels, in_channels, kernel, height, width), ...] of
+    the synthesis convolutions, in the order in which they run.
+    """
+    aspect = 0.5 if arch == 'stylegan_human' else 1
+    for name, t in tensors.items():
+        if name.startswith('synthesis.') and name.endswith('.noise_const') and len(t['shape']) == 2:
+            aspect = t['shape'][1] / t['shape'][0]
+    layers = []
+    for name, t in tensors.items():
+        shape = t['shape']
+        if arch == 'stylegan3':
+            match = re.fullmatch(r'synthesis\.L(\d+)_(\d+)_(\d+)\.(weight|weight_int8)', name)
+            if match:
+                layers.append((int(match[1]), name, shape[0], shape[1], shape[-1], int(match[2]), int(match[2])))
+        else:
+            match = re.fullmatch(r'synthesis\.b(\d+)\.(conv0|conv1|torgb)\.(weight|weight_int8)', name)
+            if match:
+                res = int(match[1])
+                order = res * 4 + ['conv0', 'conv1', 'torgb'].index(match[2])
+                layers.append((order, name, shape[0], shape[1], shape[-1], res, max(int(res * aspect), 1)))
+    return [layer[1:] for layer in sorted(layers)]
+
+def describe_checkpoint(path):
+    r"""Metadata of the generator `G_ema` in checkpoint `path`, without
+    constructing it.
+    """
+    if native_checkpoint.is_native(path):
+        attrs, tensors, param_bytes = _describe_native(path)
+    else:
+        try:
+            attrs, tensors, param_bytes = _describe_pickle(path)
+        except Exception: # pylint: disable=broad-except
+            attrs, tensors, param_bytes = _describe_network(path)
+    arch = _infer_arch(path, tensors)
+    layers = _synthesis_layers(arch, tensors, attrs['img_resolution'])
+    if attrs['num_ws'] is None:
+        attrs['num_ws'] = len([layer for layer in layers if not layer[0].split('.')[-2] == 'torgb']) + (1 if arch != 'stylegan3' else 2)
+    height = attrs['img_resolution']
+    width = max(int(height * (layers[-1][5] / layers[-1][4])), 1) if len(layers) > 0 and arch != 'stylegan3' else height
+
+    # Tracking feature: one per block (StyleGAN2) or layer (StyleGAN3).
+    features = [layer for layer in layers if arch == 'stylegan3' or layer[0].endswith('.conv1.weight') or layer[0].endswith('.conv1.weight_int8')]
+    feature_channels = features[FEATURE_IDX][1] if len(features) > FEATURE_IDX else None
+
+    # Session memory like `Renderer.get_memory_usage()`: the network and the pickle it was built from, the
+    # resized reference features, and the latents with their optimizer state.
+    latent_bytes = attrs['num_ws'] * attrs['w_dim'] * 4 * 4
+    feature_bytes = feature_channels * height * width * 4 if feature_channels is not None else 0
+    step_flops = 3 * sum(2 * out_ch * in_ch * k * k * h * w for _name, out_ch, in_ch, k, h, w in layers) # Forward and backward.
+
+    return dict(
+        arch                = arch,
+        img_resolution      = height,
+        img_width           = width,
+        img_channels        = attrs['img_channels'],
+        z_dim               = attrs['z_dim'],
+        c_dim               = attrs['c_dim'],
+        w_dim               = attrs['w_dim'],
+        num_ws              = attrs['num_ws'],
+        num_tensors         = len(tensors),
+        param_bytes         = param_bytes,
+        quantized           = any(name.endswith('.weight_int8') for name in tensors),
+        feature_channels    = feature_channels,
+        est_session_bytes   = 2 * param_bytes + feature_bytes + latent_bytes,
+        est_step_gflops     = step_flops / 1e9,
+    )
+
+#----------------------------------------------------------------------------
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class CheckpointCatalog:
+    r"""Checkpoints of `model_dir` with their metadata, persisted in
+    `index_path` (default: `<model_dir>/catalog.json`, or the dnnlib cache
+    if the directory is not writable).
+    """
+    def __init__(self, model_dir, index_path=None):
+        self.model_dir  = os.path.abspath(model_dir)
+        self.index_path = index_path if index_path is not None else os.path.join(self.model_dir, INDEX_NAME)
+        self._lock      = threading.RLock()  # Guards _entries; never held while reading checkpoints.
+        self._refresh_lock = threading.Lock() # One refresh at a time.
+        self._entries   = dict()    # {filename: dict(size, mtime_ns, sha256, error | metadata...)}
+        self._watcher   = None
+        self._load_index()
+
+    def _load_index(self):
+        for path in [self.index_path, self._fallback_index_path()]:
+            try:
+                with open(path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if index.get('format', None) == FORMAT_VERSION:
+                self._entries = index['entries']
+                return
+
+    def _fallback_index_path(self):
+        digest = hashlib.md5(self.model_dir.encode('utf-8')).hexdigest()
+        return os.path.join(dnnlib.make_cache_dir_path('catalog'), f'{digest}.json')
+
+    def _save_index(self):
+        index = dict(format=FORMAT_VERSION, model_dir=self.model_dir, entries=self._entries)
+        for path in [self.index_path, self._fallback_index_path()]:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(index, f, indent=1, sort_keys=True)
+                os.replace(temp_path, path) # atomic
+                return
+            except OSError:
+                pass
+        warnings.warn(f'Cannot save the checkpoint catalog of "{self.model_dir}"')
+
+    def refresh(self):
+        r"""Describe the checkpoints that were added or changed since the
+        last refresh and forget the removed ones. Returns the number of
+        added, updated, removed, and unchanged files. Lookups see the
+        previous entries while new or changed files are read.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                old_entries = self._entries # Replaced, never modified in place.
+            counts = dict(added=0, updated=0, removed=0, unchanged=0)
+            filenames = sorted(f for f in os.listdir(self.model_dir) if is_checkpoint(f)) if os.path.isdir(self.model_dir) else []
+            by_hash = {entry['sha256']: entry for entry in old_entries.values()}
+            entries = dict()
+            for filename in filenames:
+                path = os.path.join(self.model_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                old = old_entries.get(filename, None)
+                if old is not None and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+                    entries[filename] = old
+                    counts['unchanged'] += 1
+                    continue
+                entry = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=_hash_file(path))
+                same = by_hash.get(entry['sha256'], None) # Copied or renamed => same metadata.
+                if same is not None and 'error' not in same and native_checkpoint.is_native(path) == same['format'].startswith('native'):
+                    metadata = {key: value for key, value in same.items() if key not in entry}
+                else:
+                    try:
+                        metadata = describe_checkpoint(path)
+                    except Exception as e: # pylint: disable=broad-except
+                        metadata = dict(error=f'{type(e).__name__}: {e}')
+                entry.update(metadata, format='native' if native_checkpoint.is_native(path) else 'pickle')
+                entries[filename] = entry
+                counts['added' if old is None else 'updated'] += 1
+            counts['removed'] = len(set(old_entries) - set(entries))
+            changed = (counts['added'] + counts['updated'] + counts['removed'] > 0) or not os.path.isfile(self.index_path)
+            with self._lock:
+                self._entries = entries
+            if changed:
+                self._save_index()
+            return counts
+
+    def watch(self, interval=10):
+        r"""Refresh every `interval` seconds in a background thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e: # pylint: disable=broad-except
+                    warnings.warn(f'Cannot refresh the checkpoint catalog of "{self.model_dir}": {e}')
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=run, name='checkpoint-catalog', daemon=True)
+            self._watcher.start()
+
+    def entries(self):
+        r"""{filename: entry} of the readable checkpoints."""
+        with self._lock:
+            return {filename: dict(entry) for filename, entry in self._entries.items() if 'error' not in entry}
+
+    def lookup(self, path):
+        r"""Entry of the checkpoint at `path`, or None if not in the catalog."""
+        if not isinstance(path, str) or os.path.dirname(os.path.abspath(path)) != self.model_dir:
+            return None
+        with self._lock:
+            entry = self._entries.get(os.path.basename(path), None)
+            return dict(entry) if entry is not None and 'error' not in entry else None
+
+    def choices(self):
+        r"""{name: path} for the model dropdown, where the name is the file
+        name without extension. Native checkpoints win over their pickles.
+        """
+        filenames = sorted(self.entries().keys(), key=native_checkpoint.is_native)
+        return {filename.split('.')[0]: os.path.join(self.model_dir, filename) for filename in filenames}
+
+#----------------------------------------------------------------------------
+
+def format_bytes(num_bytes):
+    return f'{num_bytes / 2**20:.0f} MB'
+
+@click.command()
+@click.option('--model-dir', help='Directory of the checkpoints', metavar='DIR', required=True)
+@click.option('--index', 'index_path', help='Catalog file [default: <model-dir>/catalog.json]', metavar='FILE')
+@click.option('--json', 'as_json', is_flag=True, help='Print the catalog as JSON')
+def main(model_dir, index_path, as_json):
+    """Scan a model directory and list its checkpoints."""
+    catalog = CheckpointCatalog(model_dir, index_path=index_path)
+    t0 = time.time()
+    counts = catalog.refresh()
+    if as_json:
+        print(json.dumps(catalog.entries(), indent=2, sort_keys=True))
+        return
+    print(f'Refreshed "{catalog.model_dir}" in {time.time() - t0:.2f}s: ' + ', '.join(f'{num} {name}' for name, num in counts.items()) + '.')
+    for filename, entry in catalog._entries.items(): # pylint: disable=protected-access
+        if 'error' in entry:
+            print(f'{filename}: {entry["error"]}')
+            continue
+        print(f'{filename}: {entry["arch"]} {entry["img_resolution"]}x{entry["img_width"]}, {entry["format"]}, '
+            f'{format_bytes(entry["size"])} file, {format_bytes(entry["param_bytes"])} params{" (int8)" if entry["quantized"] else ""}, '
+            f'~{format_bytes(entry["est_session_bytes"])}/session, ~{entry["est_step_gflops"]:.0f} GFLOP/step, sha256 {entry["sha256"][:12]}')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
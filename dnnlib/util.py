@@ -8,6 +8,7 @@
 
 """Miscellaneous utility classes and functions."""
 
+import concurrent.futures
 import ctypes
 import fnmatch
 import importlib
@@ -18,6 +19,7 @@ import shutil
 import sys
 import types
 import io
+import json
 import pickle
 import re
 import requests
@@ -25,6 +27,8 @@ import html
 import hashlib
 import glob
 import tempfile
+import threading
+import time
 import urllib
 import urllib.request
 import uuid
@@ -393,9 +397,302 @@ def is_url(obj: Any, allow_file_urls: bool = False) -> bool:
     return True
 
 
-def open_url(url: str, cache_dir: str = None, num_attempts: int = 10, verbose: bool = True, return_filename: bool = False, cache: bool = True) -> Any:
-    """Download the given URL and return a binary-mode file object to access the data."""
+class _DownloadProgress:
+    """Thread-safe count of the downloaded bytes that reports progress to the console and/or a callback."""
+
+    def __init__(self, url: str, verbose: bool, progress_fn: Any = None, interval: float = 0.5):
+        self.url = url
+        self.verbose = verbose
+        self.progress_fn = progress_fn
+        self.interval = interval
+        self.total = None
+        self.done = 0
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    def start(self) -> None:
+        if self.verbose:
+            print("Downloading %s ..." % self.url, end="", flush=True)
+
+    def update(self, num_bytes: int) -> None:
+        with self._lock:
+            self.done += num_bytes
+            now = time.time()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        if self.progress_fn is not None:
+            self.progress_fn(self.done, self.total)
+        if self.verbose:
+            total = "" if self.total is None else " / %.1f MB" % (self.total / 2**20)
+            print("\rDownloading %s ... %.1f MB%s" % (self.url, self.done / 2**20, total), end="", flush=True)
+
+    def retry(self) -> None:
+        if self.verbose:
+            print(".", end="", flush=True)
+
+    def finish(self, ok: bool) -> None:
+        if ok and self.progress_fn is not None:
+            self.progress_fn(self.done, self.total)
+        if self.verbose:
+            print(("\rDownloading %s ... " % self.url) + ("done" if ok else "failed"))
+
+
+def _download_range(session: Any, url: str, f: Any, lock: Any, start: int, end: int, progress: _DownloadProgress, num_attempts: int, timeout: float, res: Any = None) -> int:
+    """Download bytes [start, end) of the URL into the file object at the same offsets, resuming with HTTP Range
+    requests after errors. `end` = None downloads to the end, `res` = response already streaming from `start`.
+    Returns the end offset."""
+    pos = start
+    for attempts_left in reversed(range(num_attempts)):
+        try:
+            if res is None:
+                headers = {"Accept-Encoding": "identity"}
+                if pos > 0 or end is not None:
+                    headers["Range"] = "bytes=%d-%s" % (pos, "" if end is None else end - 1)
+                res = session.get(url, headers=headers, stream=True, timeout=timeout)
+                res.raise_for_status()
+                if "Range" in headers and res.status_code != 206:
+                    if end is not None and (start > 0 or end < int(res.headers.get("Content-Length", -1))):
+                        raise IOError("Server does not support range requests")
+                    progress.update(start - pos) # The server sends everything again => restart.
+                    pos = start
+            with res:
+                for chunk in res.iter_content(chunk_size=1 << 20):
+                    if end is not None:
+                        chunk = chunk[:end - pos]
+                    with lock:
+                        f.seek(pos)
+                        f.write(chunk)
+                    pos += len(chunk)
+                    progress.update(len(chunk))
+            res = None
+            if end is not None and pos < end:
+                raise IOError("Connection closed after %d of %d bytes" % (pos - start, end - start))
+            return pos
+        except KeyboardInterrupt:
+            raise
+        except:
+            res = None
+            if not attempts_left:
+                raise
+            progress.retry()
+    assert False
+
+
+def _download(session: Any, url: str, f: Any, num_attempts: int, num_segments: int, min_segment_size: int, progress: _DownloadProgress, timeout: float) -> Tuple[str, int]:
+    """Download the URL into the file object, in parallel segments if requested and supported by the server.
+    Returns the file name reported by the server (or the URL) and the number of bytes downloaded.
+    Only the initial request is retried here; the ranges resume with the attempts that are left."""
+    for attempts_left in reversed(range(num_attempts)):
+        try:
+            res = session.get(url, headers={"Accept-Encoding": "identity"}, stream=True, timeout=timeout)
+            res.raise_for_status()
+        except KeyboardInterrupt:
+            raise
+        except:
+            if not attempts_left:
+                raise
+            progress.retry()
+            continue
+
+        match = re.search(r'filename="([^"]*)"', res.headers.get("Content-Disposition", ""))
+        url_name = match[1] if match else url
+        total = int(res.headers["Content-Length"]) if "Content-Length" in res.headers else None
+        progress.total = total
+        f.seek(0)
+        f.truncate()
+        lock = threading.Lock()
+
+        # Parallel segments => one range request per segment.
+        segment_size = None
+        if num_segments > 1 and total is not None and res.headers.get("Accept-Ranges", "") == "bytes":
+            segment_size = max(-(-total // num_segments), min_segment_size)
+        if segment_size is not None and segment_size < total:
+            res.close()
+            f.truncate(total)
+            bounds = [(begin, min(begin + segment_size, total)) for begin in range(0, total, segment_size)]
+            with concurrent.futures.ThreadPoolExecutor(len(bounds)) as executor:
+                futures = [executor.submit(_download_range, session, url, f, lock, begin, end, progress, attempts_left + 1, timeout) for begin, end in bounds]
+                for future in futures:
+                    future.result()
+            size = total
+        else:
+            size = _download_range(session, url, f, lock, 0, total, progress, attempts_left + 1, timeout, res=res)
+
+        if size == 0:
+            raise IOError("No data received")
+        if size < 8192:
+            f.seek(0)
+            content_str = f.read().decode("utf-8", errors="replace")
+            if "download_warning" in res.headers.get("Set-Cookie", ""):
+                links = [html.unescape(link) for link in content_str.split('"') if "export=download" in link]
+                if len(links) == 1:
+                    if not attempts_left:
+                        raise IOError("Google Drive virus checker nag")
+                    url = requests.compat.urljoin(url, links[0])
+                    progress.retry()
+                    continue
+            if "Google Drive - Quota exceeded" in content_str:
+                raise IOError("Google Drive download quota exceeded -- please try again later")
+        return url_name, size
+    assert False
+
+
+def _verify_download(f: Any, size: int, expected_size: int = None, expected_sha256: str = None) -> None:
+    """Raise an IOError unless the downloaded file object has the expected size and SHA-256 (if given)."""
+    if expected_size is not None and size != expected_size:
+        raise IOError("Downloaded %d bytes, expected %d" % (size, expected_size))
+    if expected_sha256 is not None:
+        sha256 = hashlib.sha256()
+        f.seek(0)
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+        if sha256.hexdigest() != expected_sha256.lower():
+            raise IOError("SHA-256 of the download is %s, expected %s" % (sha256.hexdigest(), expected_sha256))
+
+
+# Download cache: an index of the cached URLs (file, size, SHA-256, last access) next to the files, a lock per
+# URL so that concurrent processes download it once, and LRU eviction under a byte budget.
+
+download_cache_max_bytes = None # Byte budget of the download cache, None = unlimited or $DNNLIB_DOWNLOAD_CACHE_MAX_BYTES.
+
+
+class _FileLock:
+    """Cross-process exclusive lock on a file, held inside a `with` block."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+
+    def __enter__(self) -> "_FileLock":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._f = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt # pylint: disable=import-outside-toplevel
+            while True:
+                try:
+                    self._f.seek(0)
+                    msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass # LK_LOCK gives up after 10 seconds; keep waiting.
+        else:
+            import fcntl # pylint: disable=import-outside-toplevel
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *_args) -> None:
+        if os.name == "nt":
+            import msvcrt # pylint: disable=import-outside-toplevel
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        self._f.close() # Releases the flock.
+        self._f = None
+
+
+def get_download_cache_budget() -> Union[int, None]:
+    """Return the byte budget of the download cache, or None if unlimited."""
+    if download_cache_max_bytes is not None:
+        return download_cache_max_bytes
+    if "DNNLIB_DOWNLOAD_CACHE_MAX_BYTES" in os.environ:
+        return int(os.environ["DNNLIB_DOWNLOAD_CACHE_MAX_BYTES"])
+    return None
+
+
+def _read_cache_index(cache_dir: str) -> dict:
+    try:
+        with open(os.path.join(cache_dir, "index.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _write_cache_index(cache_dir: str, index: dict) -> None:
+    path = os.path.join(cache_dir, "index.json")
+    temp_file = path + "." + uuid.uuid4().hex + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(temp_file, path) # atomic
+
+
+def _hash_file(filename: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_download_cache_index(cache_dir: str = None) -> dict:
+    """Return the index of the download cache: {url: dict(file, size, sha256, last_access)}, where `file` is
+    relative to the cache directory."""
+    return _read_cache_index(cache_dir if cache_dir is not None else make_cache_dir_path('downloads'))
+
+
+def _cache_lookup(cache_dir: str, url: str, url_md5: str, expected_size: int = None, expected_sha256: str = None) -> Union[str, None]:
+    """Return the cached file of the URL and mark it as used, or None if it is not cached or does not match the
+    expected size or SHA-256. Also adopts files cached before the index existed."""
+    with _FileLock(os.path.join(cache_dir, "index.lock")):
+        index = _read_cache_index(cache_dir)
+        entry = index.get(url, None)
+        if entry is not None and not os.path.isfile(os.path.join(cache_dir, entry["file"])):
+            del index[url] # Deleted by hand.
+            entry = None
+        if entry is None:
+            cache_files = glob.glob(os.path.join(cache_dir, url_md5 + "_*"))
+            if len(cache_files) != 1:
+                return None
+            entry = dict(file=os.path.basename(cache_files[0]), size=os.path.getsize(cache_files[0]), sha256=None)
+        if expected_size is not None and entry["size"] != expected_size:
+            return None
+        if expected_sha256 is not None:
+            if entry["sha256"] is None:
+                entry["sha256"] = _hash_file(os.path.join(cache_dir, entry["file"]))
+            if entry["sha256"] != expected_sha256.lower():
+                return None
+        entry["last_access"] = time.time()
+        index[url] = entry
+        _write_cache_index(cache_dir, index)
+        return os.path.join(cache_dir, entry["file"])
+
+
+def _cache_add(cache_dir: str, url: str, filename: str, size: int, sha256: str) -> None:
+    """Add a downloaded file to the index and evict the least recently used other files beyond the budget."""
+    with _FileLock(os.path.join(cache_dir, "index.lock")):
+        index = _read_cache_index(cache_dir)
+        index[url] = dict(file=os.path.basename(filename), size=size, sha256=sha256, last_access=time.time())
+        budget = get_download_cache_budget()
+        if budget is not None:
+            total = sum(entry["size"] for entry in index.values())
+            for other_url, entry in sorted(index.items(), key=lambda item: item[1]["last_access"]):
+                if total <= budget:
+                    break
+                if other_url == url:
+                    continue
+                try:
+                    os.remove(os.path.join(cache_dir, entry["file"]))
+                except FileNotFoundError:
+                    pass
+                del index[other_url]
+                total -= entry["size"]
+        _write_cache_index(cache_dir, index)
+
+
+def open_url(url: str, cache_dir: str = None, num_attempts: int = 10, verbose: bool = True, return_filename: bool = False, cache: bool = True,
+    expected_size: int = None, expected_sha256: str = None, num_segments: int = 1, min_segment_size: int = 16 << 20, progress_fn: Any = None, timeout: float = 60) -> Any:
+    """Download the given URL and return a binary-mode file object to access the data.
+
+    The data is streamed to a temporary file, so it is never held in memory. Interrupted transfers resume with
+    HTTP Range requests where the server supports them, and with `num_segments` > 1, large files are downloaded
+    in that many parallel range requests. `expected_size` and `expected_sha256` are verified after downloading
+    and on cache hits, where a mismatch downloads the file again. `progress_fn(done_bytes, total_bytes)` is
+    called periodically, where `total_bytes` is None if unknown.
+
+    Cached files are listed in an index in the cache directory (see `get_download_cache_index()`), and the least
+    recently used ones are deleted when the cache exceeds `download_cache_max_bytes`. Concurrent processes that
+    open the same URL wait for a single download."""
     assert num_attempts >= 1
+    assert num_segments >= 1
     assert not (return_filename and (not cache))
 
     # Doesn't look like an URL scheme so interpret it as a local filename.
@@ -424,68 +721,53 @@ def open_url(url: str, cache_dir: str = None, num_attempts: int = 10, verbose: b
 
     assert is_url(url)
 
-    # Lookup from cache.
     if cache_dir is None:
         cache_dir = make_cache_dir_path('downloads')
 
     url_md5 = hashlib.md5(url.encode("utf-8")).hexdigest()
-    if cache:
-        cache_files = glob.glob(os.path.join(cache_dir, url_md5 + "_*"))
-        if len(cache_files) == 1:
-            filename = cache_files[0]
-            return filename if return_filename else open(filename, "rb")
-
-    # Download.
-    url_name = None
-    url_data = None
-    with requests.Session() as session:
-        if verbose:
-            print("Downloading %s ..." % url, end="", flush=True)
-        for attempts_left in reversed(range(num_attempts)):
+    if not cache:
+        f = _download_to_file(url, tempfile.TemporaryFile(), num_attempts=num_attempts, verbose=verbose, expected_size=expected_size,
+            expected_sha256=expected_sha256, num_segments=num_segments, min_segment_size=min_segment_size, progress_fn=progress_fn, timeout=timeout)[0]
+        f.seek(0)
+        return f
+
+    # Lookup from cache, or download while holding the URL's lock so that other processes wait for the result.
+    with _FileLock(os.path.join(cache_dir, "locks", url_md5 + ".lock")):
+        cache_file = _cache_lookup(cache_dir, url, url_md5, expected_size=expected_size, expected_sha256=expected_sha256)
+        if cache_file is None:
+            temp_file = os.path.join(cache_dir, "tmp_" + uuid.uuid4().hex + "_" + url_md5)
             try:
-                with session.get(url) as res:
-                    res.raise_for_status()
-                    if len(res.content) == 0:
-                        raise IOError("No data received")
-
-                    if len(res.content) < 8192:
-                        content_str = res.content.decode("utf-8")
-                        if "download_warning" in res.headers.get("Set-Cookie", ""):
-                            links = [html.unescape(link) for link in content_str.split('"') if "export=download" in link]
-                            if len(links) == 1:
-                                url = requests.compat.urljoin(url, links[0])
-                                raise IOError("Google Drive virus checker nag")
-                        if "Google Drive - Quota exceeded" in content_str:
-                            raise IOError("Google Drive download quota exceeded -- please try again later")
-
-                    match = re.search(r'filename="([^"]*)"', res.headers.get("Content-Disposition", ""))
-                    url_name = match[1] if match else url
-                    url_data = res.content
-                    if verbose:
-                        print(" done")
-                    break
-            except KeyboardInterrupt:
-                raise
+                f, url_name, size = _download_to_file(url, open(temp_file, "w+b"), num_attempts=num_attempts, verbose=verbose, expected_size=expected_size,
+                    expected_sha256=expected_sha256, num_segments=num_segments, min_segment_size=min_segment_size, progress_fn=progress_fn, timeout=timeout)
+                f.close()
+                sha256 = expected_sha256.lower() if expected_sha256 is not None else _hash_file(temp_file)
+                safe_name = re.sub(r"[^0-9a-zA-Z-._]", "_", url_name)
+                cache_file = os.path.join(cache_dir, url_md5 + "_" + safe_name)
+                for stale_file in glob.glob(os.path.join(cache_dir, url_md5 + "_*")): # E.g. of a different size.
+                    os.remove(stale_file)
+                os.replace(temp_file, cache_file) # atomic
             except:
-                if not attempts_left:
-                    if verbose:
-                        print(" failed")
-                    raise
-                if verbose:
-                    print(".", end="", flush=True)
-
-    # Save to cache.
-    if cache:
-        safe_name = re.sub(r"[^0-9a-zA-Z-._]", "_", url_name)
-        cache_file = os.path.join(cache_dir, url_md5 + "_" + safe_name)
-        temp_file = os.path.join(cache_dir, "tmp_" + uuid.uuid4().hex + "_" + url_md5 + "_" + safe_name)
-        os.makedirs(cache_dir, exist_ok=True)
-        with open(temp_file, "wb") as f:
-            f.write(url_data)
-        os.replace(temp_file, cache_file) # atomic
-        if return_filename:
-            return cache_file
-
-    # Return data as file object.
-    assert not return_filename
-    return io.BytesIO(url_data)
+                if os.path.isfile(temp_file):
+                    os.remove(temp_file)
+                raise
+            _cache_add(cache_dir, url, cache_file, size, sha256)
+    return cache_file if return_filename else open(cache_file, "rb")
+
+
+def _download_to_file(url: str, f: Any, num_attempts: int, verbose: bool, expected_size: int, expected_sha256: str, num_segments: int,
+    min_segment_size: int, progress_fn: Any, timeout: float) -> Tuple[Any, str, int]:
+    """Download the URL into the binary file object and verify it. Closes the file on errors.
+    Returns the file object, the file name reported by the server, and the size."""
+    progress = _DownloadProgress(url, verbose=verbose, progress_fn=progress_fn)
+    try:
+        progress.start()
+        with requests.Session() as session:
+            url_name, size = _download(session, url, f, num_attempts=num_attempts, num_segments=num_segments,
+                min_segment_size=min_segment_size, progress=progress, timeout=timeout)
+        _verify_download(f, size, expected_size=expected_size, expected_sha256=expected_sha256)
+        progress.finish(ok=True)
+    except:
+        progress.finish(ok=False)
+        f.close()
+        raise
+    return f, url_name, size
@@ -19,6 +19,8 @@ import PIL.Image
 import torch
 
 import legacy
+import native_checkpoint
+from torch_utils import compiled_synthesis
 
 #----------------------------------------------------------------------------
 
@@ -69,7 +71,7 @@ def make_transform(translate: Tuple[float,float], angle: float):
 #----------------------------------------------------------------------------
 
 @click.command()
-@click.option('--network', 'network_pkl', help='Network pickle filename', required=True)
+@click.option('--network', 'network_pkl', help='Network pickle or native checkpoint filename', required=True)
 @click.option('--seeds', type=parse_range, help='List of random seeds (e.g., \'0,1,4-6\')', required=True)
 @click.option('--trunc', 'truncation_psi', type=float, help='Truncation psi', default=1, show_default=True)
 @click.option('--class', 'class_idx', type=int, help='Class label (unconditional if not specified)')
@@ -77,6 +79,7 @@ def make_transform(translate: Tuple[float,float], angle: float):
 @click.option('--translate', help='Translate XY-coordinate (e.g. \'0.3,1\')', type=parse_vec2, default='0,0', show_default=True, metavar='VEC2')
 @click.option('--rotate', help='Rotation angle in degrees', type=float, default=0, show_default=True, metavar='ANGLE')
 @click.option('--outdir', help='Where to save the output images', type=str, required=True, metavar='DIR')
+@click.option('--compile', 'compile_synthesis', help='Run the synthesis network through torch.compile()', is_flag=True)
 def generate_images(
     network_pkl: str,
     seeds: List[int],
@@ -85,7 +88,8 @@ def generate_images(
     outdir: str,
     translate: Tuple[float,float],
     rotate: float,
-    class_idx: Optional[int]
+    class_idx: Optional[int],
+    compile_synthesis: bool
 ):
     """Generate images using pretrained network pickle.
 
@@ -104,12 +108,17 @@ def generate_images(
 
     print('Loading networks from "%s"...' % network_pkl)
     device = torch.device('cuda')
-    with dnnlib.util.open_url(network_pkl) as f:
-        G = legacy.load_network_pkl(f)['G_ema'].to(device) # type: ignore
-        # import pickle
-        # G = legacy.load_network_pkl(f)
-        # output = open('checkpoints/stylegan2-car-config-f-pt.pkl', 'wb')
-        # pickle.dump(G, output)
+    if native_checkpoint.is_native(network_pkl):
+        G = native_checkpoint.load_network(network_pkl, 'G_ema', device=device)
+    else:
+        with dnnlib.util.open_url(network_pkl) as f:
+            G = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema'].to(device) # type: ignore
+            # import pickle
+            # G = legacy.load_network_pkl(f)
+            # output = open('checkpoints/stylegan2-car-config-f-pt.pkl', 'wb')
+            # pickle.dump(G, output)
+    if compile_synthesis:
+        compiled_synthesis.enable(G, checkpoint=network_pkl)
 
     os.makedirs(outdir, exist_ok=True)
 
@@ -1,9 +1,9 @@
 from .utils import (ImageMask, draw_mask_on_image, draw_points_on_image,
-                    get_latest_points_pair, get_valid_mask,
-                    on_change_single_global_state)
+                    get_latest_points_pair, get_mask_bbox, get_valid_mask,
+                    on_change_single_global_state, update_mask)
 
 __all__ = [
     'draw_mask_on_image', 'draw_points_on_image',
     'on_change_single_global_state', 'get_latest_points_pair',
-    'get_valid_mask', 'ImageMask'
+    'get_mask_bbox', 'get_valid_mask', 'update_mask', 'ImageMask'
 ]
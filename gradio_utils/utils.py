@@ -30,17 +30,62 @@ class ImageMask(gr.components.Image):
         return super().preprocess(x)
 
 
-def get_valid_mask(mask: np.ndarray):
+def _rgb_to_luma(rgb: np.ndarray):
+    """ITU-R 601-2 luma with the same fixed-point rounding as PIL's
+    `convert('L')`, without a round trip through PIL.
+    """
+    rgb = rgb.astype(np.uint32)
+    luma = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 +
+            0x8000) >> 16
+    return luma.astype(np.uint8)
+
+
+def get_mask_bbox(mask: np.ndarray):
+    """Get the bounding box [x0, y0, x1, y1] (exclusive upper bounds) of the
+    painted pixels of a mask, or None if nothing is painted.
+    """
+    painted = mask[..., :3].any(axis=-1) if mask.ndim == 3 else mask != 0
+    rows = np.flatnonzero(painted.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(painted.any(axis=0))
+    return [int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1]
+
+
+def get_valid_mask(mask: np.ndarray, bbox=None):
     """Convert mask from gr.Image(0 to 255, RGBA) to binary mask.
+    If `bbox` is given, only that region of the mask is converted.
     """
+    if bbox is not None:
+        x0, y0, x1, y1 = bbox
+        mask = mask[y0:y1, x0:x1]
     if mask.ndim == 3:
-        mask_pil = Image.fromarray(mask).convert('L')
-        mask = np.array(mask_pil)
+        mask = _rgb_to_luma(mask)
     if mask.max() == 255:
         mask = mask / 255
     return mask
 
 
+def update_mask(mask: np.ndarray, sketch: np.ndarray, mode: str):
+    """Add (`mode='add_mask'`) or remove (`mode='remove_mask'`) the painted
+    area of a gr.Image sketch to/from a mask. Only the bounding box of the
+    strokes is converted and merged, the rest of the mask is left untouched.
+    """
+    bbox = get_mask_bbox(sketch)
+    if bbox is None or mode not in ['add_mask', 'remove_mask']:
+        return mask
+    x0, y0, x1, y1 = bbox
+    painted = get_valid_mask(sketch, bbox)
+    if mask.dtype != np.result_type(mask, painted):
+        mask = mask.astype(np.result_type(mask, painted))
+    if mode == 'add_mask':
+        region = mask[y0:y1, x0:x1] + painted
+    else:
+        region = mask[y0:y1, x0:x1] - painted
+    mask[y0:y1, x0:x1] = np.clip(region, 0, 1)
+    return mask
+
+
 def draw_points_on_image(image,
                          points,
                          curr_point=None,
@@ -177,15 +177,24 @@ class Texture:
         yield
         gl.glBindTexture(gl.GL_TEXTURE_2D, prev_id)
 
-    def update(self, image):
+    def update(self, image, rect=None):
+        # rect = [x0, y0, x1, y1] updates only the given sub-rectangle of an existing texture.
         if image is not None:
             image = prepare_texture_data(image)
-            assert self.is_compatible(image=image)
+            if rect is None:
+                assert self.is_compatible(image=image)
+            else:
+                assert image.shape[:2] == (rect[3] - rect[1], rect[2] - rect[0])
+                assert self.is_compatible(channels=image.shape[2], dtype=image.dtype)
         with self.bind():
             fmt = get_texture_format(self.dtype, self.channels)
             gl.glPushClientAttrib(gl.GL_CLIENT_PIXEL_STORE_BIT)
             gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
-            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, fmt.internalformat, self.width, self.height, 0, fmt.format, fmt.type, image)
+            if rect is None:
+                gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, fmt.internalformat, self.width, self.height, 0, fmt.format, fmt.type, image)
+            else:
+                x0, y0, x1, y1 = rect
+                gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, x0, y0, x1 - x0, y1 - y0, fmt.format, fmt.type, np.ascontiguousarray(image))
             if self.mipmap:
                 gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
             gl.glPopClientAttrib()
@@ -12,40 +12,66 @@ import click
 import pickle
 import re
 import copy
+import glob
+import hashlib
+import inspect
+import os
+import warnings
 import numpy as np
 import torch
 import dnnlib
+import native_checkpoint
 from torch_utils import misc
+from torch_utils import selective_unpickle
 
 #----------------------------------------------------------------------------
 
-def load_network_pkl(f, force_fp16=False):
-    data = _LegacyUnpickler(f).load()
+tf_cache            = True  # Cache converted TensorFlow pickles on disk?
+tf_cache_dir        = None  # Where to cache them, None = <dnnlib cache dir>/legacy.
 
-    # Legacy TensorFlow pickle => convert.
-    if isinstance(data, tuple) and len(data) == 3 and all(isinstance(net, _TFNetworkStub) for net in data):
-        tf_G, tf_D, tf_Gs = data
-        G = convert_tf_generator(tf_G)
-        D = convert_tf_discriminator(tf_D)
-        G_ema = convert_tf_generator(tf_Gs)
-        data = dict(G=G, D=D, G_ema=G_ema)
+def load_network_pkl(f, force_fp16=False, keys=None):
+    r"""Load a network pickle. With `keys`, e.g. ['G_ema'], only these
+    entries are returned, and the other networks of a snapshot are not
+    constructed. The selective load runs the slower pure-Python unpickler,
+    so it is only used for snapshots whose other entries hold tensors;
+    other pickles are loaded in full with the C unpickler.
+    """
+    # Legacy TensorFlow pickle converted before => load the cached result.
+    cache_path = _get_tf_cache_path(f) if tf_cache else None
+    data = _load_tf_cache(cache_path, keys) if cache_path is not None and os.path.isfile(cache_path) else None
+
+    if data is None:
+        data = _LegacyUnpickler(f).load() if keys is None else _SelectiveLegacyUnpickler(f, keys).load()
+
+        # Legacy TensorFlow pickle => convert.
+        if isinstance(data, tuple) and len(data) == 3 and all(isinstance(net, _TFNetworkStub) for net in data):
+            tf_G, tf_D, tf_Gs = data
+            G = convert_tf_generator(tf_G)
+            D = convert_tf_discriminator(tf_D)
+            G_ema = convert_tf_generator(tf_Gs)
+            data = dict(G=G, D=D, G_ema=G_ema)
+            if cache_path is not None:
+                _save_tf_cache(cache_path, data)
+            if keys is not None:
+                data = {key: value for key, value in data.items() if key in keys}
 
     # Add missing fields.
-    if 'training_set_kwargs' not in data:
+    if 'training_set_kwargs' not in data and (keys is None or 'training_set_kwargs' in keys):
         data['training_set_kwargs'] = None
-    if 'augment_pipe' not in data:
+    if 'augment_pipe' not in data and (keys is None or 'augment_pipe' in keys):
         data['augment_pipe'] = None
 
-    # Validate contents.
-    assert isinstance(data['G'], torch.nn.Module)
-    assert isinstance(data['D'], torch.nn.Module)
-    assert isinstance(data['G_ema'], torch.nn.Module)
-    assert isinstance(data['training_set_kwargs'], (dict, type(None)))
-    assert isinstance(data['augment_pipe'], (torch.nn.Module, type(None)))
+    # Validate contents. Inference-only pickles, e.g. from quantize_network.py, contain only G_ema.
+    G_only = ('G' not in data and 'D' not in data)
+    for key in (['G_ema'] if G_only else ['G', 'D', 'G_ema']):
+        if keys is None or key in keys:
+            assert isinstance(data[key], torch.nn.Module)
+    assert isinstance(data.get('training_set_kwargs', None), (dict, type(None)))
+    assert isinstance(data.get('augment_pipe', None), (torch.nn.Module, type(None)))
 
     # Force FP16.
     if force_fp16:
-        for key in ['G', 'D', 'G_ema']:
+        for key in [key for key in ['G', 'D', 'G_ema'] if key in data]:
             old = data[key]
             kwargs = copy.deepcopy(old.init_kwargs)
             fp16_kwargs = kwargs.get('synthesis_kwargs', kwargs)
@@ -68,6 +94,62 @@ class _LegacyUnpickler(pickle.Unpickler):
             return _TFNetworkStub
         return super().find_class(module, name)
 
+class _SelectiveLegacyUnpickler(selective_unpickle.SelectiveUnpickler):
+    full_unpickler = _LegacyUnpickler
+
+    def find_class(self, module, name):
+        if module == 'dnnlib.tflib.network' and name == 'Network':
+            return _TFNetworkStub
+        return super().find_class(module, name)
+
+#----------------------------------------------------------------------------
+# Converted TensorFlow pickles are cached as native checkpoints (see
+# native_checkpoint.py), keyed by the SHA-256 of the pickle and of the
+# converter code, so that changing the converter invalidates them.
+
+def _get_converter_hash():
+    converter = [_collect_tf_params, _populate_module_params, convert_tf_generator, convert_tf_discriminator]
+    src = ''.join(inspect.getsource(fn) for fn in converter)
+    return hashlib.sha256(src.encode('utf-8')).hexdigest()[:16]
+
+def _get_tf_cache_path(f):
+    r"""Cache path of the pickle in file object `f` if it is a legacy
+    TensorFlow pickle, None otherwise. Leaves the file position unchanged.
+    """
+    if not (hasattr(f, 'seekable') and f.seekable()):
+        return None
+    start = f.tell()
+    head = f.read(1 << 16)
+    f.seek(start)
+    if b'dnnlib.tflib.network' not in head: # The class of the first network.
+        return None
+    sha256 = hashlib.sha256(head)
+    f.seek(start + len(head))
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        sha256.update(chunk)
+    f.seek(start)
+    cache_dir = tf_cache_dir if tf_cache_dir is not None else dnnlib.make_cache_dir_path('legacy')
+    return os.path.join(cache_dir, f'{sha256.hexdigest()}-{_get_converter_hash()}{native_checkpoint.EXTENSION}')
+
+def _load_tf_cache(path, keys=None):
+    try:
+        checkpoint = native_checkpoint.NativeCheckpoint(path)
+        return {key: checkpoint.build(key).eval().requires_grad_(False) for key in checkpoint.keys() if keys is None or key in keys}
+    except Exception as e: # pylint: disable=broad-except
+        warnings.warn(f'Cannot load the converted TensorFlow pickle "{path}", converting again: {e}')
+        return None
+
+def _save_tf_cache(path, data):
+    from training import networks_stylegan2 # pylint: disable=import-outside-toplevel
+    networks = {key: (data[key], networks_stylegan2.__name__, type(data[key]).__name__, dict()) for key in ['G', 'D', 'G_ema']}
+    sha256 = os.path.basename(path).split('-')[0]
+    try:
+        for stale_path in glob.glob(os.path.join(os.path.dirname(path), f'{sha256}-*')): # Older converter versions.
+            os.remove(stale_path)
+        native_checkpoint.save(path, networks, source=dict(sha256=sha256, converter=_get_converter_hash()))
+    except OSError as e:
+        warnings.warn(f'Cannot cache the converted TensorFlow pickle in "{path}": {e}')
+
 #----------------------------------------------------------------------------
 
 def _collect_tf_params(tf_net):
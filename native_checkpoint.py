@@ -0,0 +1,408 @@
+"""Fast-loading native checkpoint format with memory-mapped tensors.
+
+Network pickles embed the source code of every class and store all of
+G, D, and G_ema, so loading one imports that code, unpickles every
+network, and copies the weights several times before the visualizers
+rebuild G_ema from the current code anyway. A native checkpoint stores
+only what the rebuild needs:
+
+    magic       8 bytes, b'DGNATIVE'
+    length      little-endian uint64, the length of the header in bytes
+    header      JSON: format version, source pickle, and for every network
+                its class, init arguments, quantized layers, and the dtype,
+                shape, offset, and weight store digest of every tensor of
+                its state dict
+    padding     up to a multiple of PAGE_SIZE
+    tensors     raw, each aligned to ALIGNMENT bytes
+
+Loading reads the header, constructs the network without drawing random
+initial weights, and assigns tensors that are views of a private memory
+map of the file: nothing is copied on the CPU, the pages are read on first
+use, and they stay shared with the page cache and with other processes
+that load the same file. The digests let the weight store share the
+tensors without reading them (see torch_utils/weight_store.py); files
+written before the digests were stored are hashed instead.
+Writes to the tensors are copy-on-write and never reach the file.
+
+Examples:
+
+\b
+# Convert G_ema of a pickle, inferring the architecture from its name.
+python native_checkpoint.py convert --source=checkpoints/stylegan2_lions_512_pytorch.pkl \\
+    --dest=checkpoints/stylegan2_lions_512_pytorch.mmap
+
+\b
+# Check that both load the same network and compare their cold load.
+python native_checkpoint.py verify --source=checkpoints/stylegan2_lions_512_pytorch.pkl \\
+    --native=checkpoints/stylegan2_lions_512_pytorch.mmap
+"""
+
+import hashlib
+import importlib
+import inspect
+import itertools
+import json
+import os
+import resource
+import struct
+import subprocess
+import sys
+import time
+import uuid
+
+import click
+import numpy as np
+import torch
+
+import dnnlib
+from torch_utils import quantization
+from torch_utils import weight_store
+
+#----------------------------------------------------------------------------
+
+MAGIC           = b'DGNATIVE'
+FORMAT_VERSION  = 1
+EXTENSION       = '.mmap'
+PAGE_SIZE       = 4096      # Alignment of the first tensor.
+ALIGNMENT       = 64        # Alignment of every tensor.
+
+_supports_assign = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters # PyTorch >= 2.1
+
+class _SkipRandomInit(torch.overrides.TorchFunctionMode):
+    r"""Context that makes the random initialization of networks allocate
+    uninitialized tensors instead, for weights that are replaced anyway.
+    """
+    _random = {torch.randn: torch.empty, torch.rand: torch.empty, torch.randn_like: torch.empty_like, torch.rand_like: torch.empty_like}
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = dict(kwargs or {})
+        if func in self._random:
+            kwargs.pop('generator', None)
+            func = self._random[func]
+        return func(*args, **kwargs)
+
+#----------------------------------------------------------------------------
+
+def infer_generator_class(name):
+    r"""Module, class name, and extra init kwargs of the current generator
+    code for the checkpoint `name`, inferred from the name like
+    `Renderer.get_network()` always has.
+    """
+    if 'stylegan2' in name:
+        return 'training.networks_stylegan2', 'Generator', dict()
+    if 'stylegan3' in name:
+        return 'training.networks_stylegan3', 'Generator', dict()
+    if 'stylegan_human' in name:
+        return 'stylegan_human.training_scripts.sg2.training.networks', 'Generator', dict(square=False, padding=True)
+    raise NameError('Cannot infer model type from pkl name!')
+
+def is_native(path):
+    r"""Whether `path` names a native checkpoint rather than a pickle."""
+    return isinstance(path, str) and path.endswith(EXTENSION)
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+def _dtype_name(dtype):
+    return str(dtype).split('.')[-1]
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Cannot store {type(value).__name__} in a native checkpoint header')
+
+#----------------------------------------------------------------------------
+
+def save(path, networks, source=None):
+    r"""Write a native checkpoint. `networks` is `{key: (net, module_name,
+    class_name, extra_kwargs)}`, where `net` is a persistent network whose
+    state dict loads into `module_name.class_name(*net.init_args,
+    **net.init_kwargs, **extra_kwargs)`. `source` describes where it came
+    from, e.g. the name, size, and SHA-256 of the pickle.
+    """
+    header = dict(format=FORMAT_VERSION, source=source, networks=dict())
+    blobs = []
+    offset = 0
+    for key, (net, module_name, class_name, extra_kwargs) in networks.items():
+        tensors = dict()
+        for name, tensor in net.state_dict().items():
+            tensor = tensor.detach().cpu().contiguous()
+            offset = _align(offset, ALIGNMENT)
+            nbytes = tensor.numel() * tensor.element_size()
+            tensors[name] = dict(dtype=_dtype_name(tensor.dtype), shape=list(tensor.shape), offset=offset, nbytes=nbytes,
+                sha256=weight_store.tensor_digest(tensor))
+            blobs.append((offset, tensor))
+            offset += nbytes
+        header['networks'][key] = dict(
+            module          = module_name,
+            class_name      = class_name,
+            init_args       = list(net.init_args),
+            init_kwargs     = dict(net.init_kwargs),
+            extra_kwargs    = dict(extra_kwargs),
+            quantized       = quantization.quantized_names(net),
+            tensors         = tensors,
+        )
+    header_bytes = json.dumps(header, default=_json_default).encode('utf-8')
+    data_offset = _align(len(MAGIC) + 8 + len(header_bytes), PAGE_SIZE)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for blob_offset, tensor in blobs:
+            f.write(b'\0' * (data_offset + blob_offset - f.tell()))
+            if tensor.numel() > 0:
+                f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path) # atomic
+    return header
+
+#----------------------------------------------------------------------------
+
+class NativeCheckpoint:
+    r"""A native checkpoint opened for loading. Only the header is read
+    here; the file is mapped on the first `state_dict()` or `build()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'Not a native checkpoint: "{path}"')
+            header_len, = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+        if self.header['format'] > FORMAT_VERSION:
+            raise ValueError(f'"{path}" has format version {self.header["format"]}, this code reads up to {FORMAT_VERSION}')
+        self._data_offset = _align(len(MAGIC) + 8 + header_len, PAGE_SIZE)
+        self._buffer = None
+
+    def keys(self):
+        return list(self.header['networks'].keys())
+
+    def __contains__(self, key):
+        return key in self.header['networks']
+
+    @property
+    def source(self):
+        return self.header['source']
+
+    def _get_buffer(self):
+        if self._buffer is None:
+            nbytes = os.path.getsize(self.path)
+            storage = torch.UntypedStorage.from_file(self.path, shared=False, nbytes=nbytes) # MAP_PRIVATE, i.e. copy-on-write
+            self._buffer = torch.empty(0, dtype=torch.uint8).set_(storage)
+        return self._buffer
+
+    def state_dict(self, key='G_ema'):
+        r"""The state dict of network `key` as views of the mapped file."""
+        buf = self._get_buffer()
+        state = dict()
+        for name, spec in self.header['networks'][key]['tensors'].items():
+            dtype = getattr(torch, spec['dtype'])
+            start = self._data_offset + spec['offset']
+            state[name] = buf[start : start + spec['nbytes']].view(dtype).view(spec['shape'])
+        return state
+
+    def build(self, key='G_ema', device='cpu'):
+        r"""Construct network `key` from the current code and load its
+        weights. On the CPU, the weights are the mapped tensors themselves.
+        """
+        spec = self.header['networks'][key]
+        network_class = getattr(importlib.import_module(spec['module']), spec['class_name'])
+        make = lambda: network_class(*spec['init_args'], **spec['init_kwargs'], **spec['extra_kwargs'])
+        state = self.state_dict(key)
+        if _supports_assign:
+            with _SkipRandomInit():
+                net = make()
+        else:
+            net = make()
+        if len(spec['quantized']) > 0:
+            quantization.quantize(net, names=spec['quantized'])
+        if _supports_assign:
+            net.load_state_dict(state, assign=True)
+        else:
+            net.load_state_dict(state)
+        net = net.to(device)
+        for name, tensor in itertools.chain(net.named_parameters(), net.named_buffers()):
+            digest = spec['tensors'].get(name, {}).get('sha256', None)
+            if digest is not None:
+                weight_store.set_digest(tensor, digest)
+        return net
+
+#----------------------------------------------------------------------------
+
+def load_network(path, key='G_ema', device='cpu'):
+    r"""Load network `key` of the native checkpoint `path`."""
+    return NativeCheckpoint(path).build(key, device=device)
+
+def _hash_file(f, chunk_size=1<<20):
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        sha256.update(chunk)
+        size += len(chunk)
+    return size, sha256.hexdigest()
+
+def convert(source, dest, keys=('G_ema',), arch_name=None):
+    r"""Convert networks `keys` of the pickle `source` to the native
+    checkpoint `dest`. Their classes are inferred from `arch_name`, or
+    from the name of `source` if not given.
+    """
+    import legacy # pylint: disable=import-outside-toplevel
+    module_name, class_name, extra_kwargs = infer_generator_class(arch_name if arch_name is not None else os.path.basename(source))
+    with dnnlib.util.open_url(source) as f:
+        size, sha256 = _hash_file(f)
+        f.seek(0)
+        data = legacy.load_network_pkl(f, keys=list(keys))
+    networks = {key: (data[key], module_name, class_name, extra_kwargs) for key in keys}
+    source_info = dict(name=os.path.basename(source), size=size, sha256=sha256)
+    return save(dest, networks, source=source_info)
+
+#----------------------------------------------------------------------------
+
+def _load_pickle_network(source, key='G_ema', arch_name=None):
+    r"""Load network `key` of a pickle the way the visualizers do."""
+    import legacy # pylint: disable=import-outside-toplevel
+    module_name, class_name, extra_kwargs = infer_generator_class(arch_name if arch_name is not None else os.path.basename(source))
+    with dnnlib.util.open_url(source, verbose=False) as f:
+        orig = legacy.load_network_pkl(f, keys=[key])[key]
+    network_class = getattr(importlib.import_module(module_name), class_name)
+    net = network_class(*orig.init_args, **orig.init_kwargs, **extra_kwargs)
+    if quantization.is_quantized(orig):
+        quantization.quantize(net, names=quantization.quantized_names(orig))
+    net.load_state_dict(orig.state_dict())
+    return net
+
+def _generate(G, seeds, device):
+    images = []
+    with torch.no_grad():
+        for seed in seeds:
+            z = torch.from_numpy(np.random.RandomState(seed).randn(1, G.z_dim)).to(device)
+            label = torch.zeros([1, G.c_dim], device=device)
+            images.append(G(z, label, truncation_psi=0.7, noise_mode='const'))
+    return images
+
+def _read_proc_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+def _reset_peak_rss():
+    r"""Reset the peak RSS of this process where supported (Linux) and
+    return the baseline to measure it against.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _read_proc_status('VmRSS')
+    except (OSError, KeyError):
+        return _get_peak_rss()
+
+def _get_peak_rss():
+    try:
+        return _read_proc_status('VmHWM')
+    except (OSError, KeyError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+def _time_load_in_subprocess(path, key, arch_name):
+    cmd = [sys.executable, os.path.abspath(__file__), 'time-load', '--network', path, '--key', key]
+    if arch_name is not None:
+        cmd += ['--arch', arch_name]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+#----------------------------------------------------------------------------
+
+@click.group()
+def main():
+    """Convert network pickles to native checkpoints and verify them."""
+
+@main.command('convert')
+@click.option('--source', help='Input pickle filename or URL', required=True, metavar='PATH')
+@click.option('--dest', help='Output native checkpoint [default: next to --source]', metavar='PATH')
+@click.option('--key', 'keys', help='Networks to convert', multiple=True, default=['G_ema'], show_default=True)
+@click.option('--arch', 'arch_name', help='Architecture if not in the source name', type=click.Choice(['stylegan2', 'stylegan3', 'stylegan_human']))
+def convert_command(source, dest, keys, arch_name):
+    """Convert a network pickle to a native checkpoint."""
+    if dest is None:
+        dest = os.path.splitext(source)[0] + EXTENSION
+    print(f'Converting "{source}"...')
+    header = convert(source, dest, keys=keys, arch_name=arch_name)
+    num_tensors = sum(len(net['tensors']) for net in header['networks'].values())
+    print(f'Saved {", ".join(keys)} ({num_tensors} tensors, {os.path.getsize(dest) / 2**20:.1f} MB) to "{dest}".')
+
+@main.command('verify')
+@click.option('--source', help='Network pickle filename or URL', required=True, metavar='PATH')
+@click.option('--native', 'native_path', help='Native checkpoint converted from --source', required=True, metavar='PATH')
+@click.option('--key', help='Network to compare', default='G_ema', show_default=True)
+@click.option('--arch', 'arch_name', help='Architecture if not in the source name', type=click.Choice(['stylegan2', 'stylegan3', 'stylegan_human']))
+@click.option('--seeds', help='Seeds whose images must match', default='0,1,2', show_default=True)
+@click.option('--timing/--no-timing', help='Compare cold loads in fresh processes', default=True, show_default=True)
+def verify_command(source, native_path, key, arch_name, seeds, timing):
+    """Check that a native checkpoint loads the same network as its pickle.
+
+    The state dicts must be bitwise equal and the images of --seeds
+    identical. With --timing, both are also loaded once in a fresh process
+    each to compare the load time and the peak RSS, also until the first
+    image.
+    """
+    seeds = [int(s) for s in seeds.split(',')]
+    device = torch.device('cpu')
+    G_pkl = _load_pickle_network(source, key, arch_name).eval()
+    G_native = load_network(native_path, key).eval()
+
+    state_pkl, state_native = G_pkl.state_dict(), G_native.state_dict()
+    if set(state_pkl.keys()) != set(state_native.keys()):
+        raise click.ClickException(f'State dict keys differ: {sorted(set(state_pkl.keys()) ^ set(state_native.keys()))}')
+    mismatch = [name for name in state_pkl if state_pkl[name].dtype != state_native[name].dtype or not torch.equal(state_pkl[name], state_native[name])]
+    if len(mismatch) > 0:
+        raise click.ClickException(f'{len(mismatch)} tensors differ, e.g. {mismatch[:5]}')
+    print(f'State dicts: {len(state_pkl)} tensors, bitwise equal.')
+
+    for seed, img_pkl, img_native in zip(seeds, _generate(G_pkl, seeds, device), _generate(G_native, seeds, device)):
+        if not torch.equal(img_pkl, img_native):
+            raise click.ClickException(f'Images of seed {seed} differ by up to {float((img_pkl - img_native).abs().max()):g}')
+    print(f'Images:      seeds {seeds} identical.')
+
+    if timing:
+        results = {name: _time_load_in_subprocess(path, key, arch_name) for name, path in [('pickle', source), ('native', native_path)]}
+        for name, r in results.items():
+            print(f'{name + ":":12} load {r["load_seconds"] * 1e3:8.1f} ms, peak RSS +{r["load_peak_rss_bytes"] / 2**20:7.1f} MB; '
+                f'first image after {r["first_image_seconds"] * 1e3:8.1f} ms more, peak RSS +{r["peak_rss_bytes"] / 2**20:7.1f} MB')
+        p, n = results['pickle'], results['native']
+        print(f'Native loads {p["load_seconds"] / n["load_seconds"]:.1f}x faster '
+            f'with {p["load_peak_rss_bytes"] / max(n["load_peak_rss_bytes"], 1):.1f}x less peak memory.')
+
+@main.command('time-load', hidden=True)
+@click.option('--network', 'path', required=True)
+@click.option('--key', default='G_ema')
+@click.option('--arch', 'arch_name')
+def time_load_command(path, key, arch_name):
+    """Load one network cold and print the timings as JSON."""
+    module_name, _class_name, _extra_kwargs = infer_generator_class(arch_name if arch_name is not None else os.path.basename(path))
+    importlib.import_module(module_name) # Import the code up front, as in a running visualizer.
+    if os.path.isfile(path) and hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED) # Drop the file from the page cache, if possible.
+        os.close(fd)
+    rss0 = _reset_peak_rss()
+    t0 = time.perf_counter()
+    G = load_network(path, key) if is_native(path) else _load_pickle_network(path, key, arch_name)
+    t1 = time.perf_counter()
+    load_rss = _get_peak_rss() - rss0
+    _generate(G.eval(), [0], torch.device('cpu'))
+    t2 = time.perf_counter()
+    print(json.dumps(dict(load_seconds=t1 - t0, load_peak_rss_bytes=load_rss, first_image_seconds=t2 - t1, peak_rss_bytes=_get_peak_rss() - rss0)))
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,101 @@
+"""Fill the seed cache of a checkpoint with the latents and images of seeds.
+
+Runs the mapping and synthesis networks in batches, like the renderer does
+for one seed, and stores the latent w, the initial image, and a thumbnail
+of every seed in the seed cache (see viz/seed_cache.py). Sessions of the
+Gradio demo started with --seed-cache-gb (and the same --seed-cache-dir as
+--cache-dir here, if any) then start from these seeds without running the
+generator, and its seed gallery shows them. Seeds that are cached already
+are skipped.
+
+Examples:
+
+\b
+# Cache seeds 0 to 99 of a checkpoint.
+python precompute_seeds.py --network=checkpoints/stylegan2_lions_512_pytorch.pkl --seeds=0-99
+
+\b
+# Into a 2 GB cache, with the truncation of the sessions.
+python precompute_seeds.py --network=checkpoints/stylegan2_lions_512_pytorch.pkl --seeds=0-999 \\
+    --trunc=0.7 --max-bytes=2000000000 --batch=16
+"""
+
+import os
+import time
+
+import click
+import numpy as np
+import torch
+
+import checkpoint_catalog
+from gen_images import parse_range
+from torch_utils import mixed_precision
+from viz import renderer as renderer_module
+from viz.seed_cache import SeedCache
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--network', 'network_pkl', help='Checkpoint filename', metavar='PATH', required=True)
+@click.option('--seeds', type=parse_range, help='List of seeds (e.g., \'0,1,4-6\')', required=True)
+@click.option('--trunc', 'trunc_psi', type=float, help='Truncation psi', default=0.7, show_default=True)
+@click.option('--trunc-cutoff', type=int, help='Truncation cutoff [default: none]')
+@click.option('--precision', type=click.Choice(list(renderer_module.PRECISION_MODES)), help='Synthesis precision of the sessions', default='fp32', show_default=True)
+@click.option('--feature-idx', type=int, help='Tracked features of the sessions', default=5, show_default=True)
+@click.option('--batch', 'batch_size', type=int, help='Seeds per batch', default=8, show_default=True)
+@click.option('--device', help='Device', default='cuda' if torch.cuda.is_available() else 'cpu', show_default=True)
+@click.option('--cache-dir', help='Seed cache [default: dnnlib cache dir]', metavar='DIR')
+@click.option('--max-bytes', type=int, help='Byte budget of the seed cache [default: unlimited]')
+@click.option('--no-images', is_flag=True, help='Only cache the latents')
+def main(network_pkl, seeds, trunc_psi, trunc_cutoff, precision, feature_idx, batch_size, device, cache_dir, max_bytes, no_images):
+    """Cache the latents and images of seeds of a checkpoint."""
+    device = torch.device(device)
+    catalog = None
+    if os.path.isfile(network_pkl):
+        catalog = checkpoint_catalog.CheckpointCatalog(os.path.dirname(os.path.abspath(network_pkl)))
+        catalog.refresh()
+        renderer_module.set_catalog(catalog)
+    seed_cache = SeedCache(cache_dir, max_bytes=max_bytes, catalog=catalog)
+    key_kwargs = dict(trunc_psi=trunc_psi, trunc_cutoff=trunc_cutoff, noise_mode='const', precision=precision)
+    cached = {seed for seed, _path in seed_cache.thumbnails(network_pkl, **key_kwargs)}
+    todo = [seed for seed in dict.fromkeys(seeds) if seed not in cached]
+    print(f'{len(seeds) - len(todo)} of {len(seeds)} seeds cached in "{seed_cache.cache_dir}".')
+    if len(todo) == 0:
+        return
+
+    # Same network as the sessions get.
+    print(f'Loading "{network_pkl}"...')
+    G = renderer_module.build_network(renderer_module.load_pkl_data(network_pkl, 'G_ema'), network_pkl, 'G_ema', device)
+    G.eval()
+    # Same FP32 layers as Renderer._render_drag_impl().
+    renderer_kwargs = renderer_module.PRECISION_MODES[precision]
+    synthesis_precision = renderer_kwargs['precision']
+    num_fp32_layers = feature_idx + 1 if renderer_kwargs.get('fp32_features', True) else 0
+    if num_fp32_layers >= len(mixed_precision.synthesis_layers(G.synthesis)):
+        synthesis_precision = 'fp32'
+    mixed_precision.set_fp32_layers(G.synthesis, num_fp32_layers)
+
+    t0 = time.time()
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start : start + batch_size]
+        z = torch.from_numpy(np.concatenate([np.random.RandomState(seed).randn(1, 512) for seed in batch])).to(device).float()
+        label = torch.zeros([len(batch), G.c_dim], device=device)
+        with torch.no_grad():
+            ws = G.mapping(z, label, truncation_psi=trunc_psi, truncation_cutoff=trunc_cutoff)
+            images = None
+            if not no_images:
+                with mixed_precision.autocast(device.type, synthesis_precision):
+                    images = G(ws, label, noise_mode='const', input_is_w=True) # As in Renderer._render_drag_impl().
+                images = (images.float() * 127.5 + 128).clamp(0, 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+        for i, seed in enumerate(batch):
+            seed_cache.put(network_pkl, seed, w=ws[i : i + 1], image=images[i] if images is not None else None, **key_kwargs)
+        done = start + len(batch)
+        print(f'{done}/{len(todo)} seeds, {(time.time() - t0) / done:.2f}s per seed.')
+    print(f'Cached {len(todo)} seeds in {time.time() - t0:.1f}s.')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
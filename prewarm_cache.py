@@ -0,0 +1,116 @@
+"""Download the networks of a manifest into the download cache.
+
+Later calls of `dnnlib.util.open_url()` for these URLs are then served from
+the cache, e.g. when the visualizer or the Gradio demo first opens a
+pretrained network. URLs that are already cached are skipped; concurrent
+processes that need the same URL wait for this download instead of
+starting their own.
+
+A manifest is one of:
+
+\b
+- a text file with one `URL [SIZE [SHA256]]` per line; `#` starts a comment,
+- a JSON list of URLs or of objects with `url` and optional `size` and `sha256`,
+- a Python file with a module-level `PRETRAINED_URLS` list, which is read
+  without importing the file (visualizer_drag.py by default).
+
+Examples:
+
+\b
+python prewarm_cache.py
+python prewarm_cache.py --manifest=models.txt --max-bytes=20000000000 --segments=4
+python prewarm_cache.py --dry-run
+"""
+
+import ast
+import json
+import os
+import time
+
+import click
+
+import dnnlib
+
+#----------------------------------------------------------------------------
+
+def read_manifest(path):
+    r"""List of dict(url, size, sha256) from a manifest file."""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.py'):
+        for node in ast.parse(text, filename=path).body:
+            if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'PRETRAINED_URLS' for t in node.targets):
+                items = ast.literal_eval(node.value)
+                break
+        else:
+            raise click.ClickException(f'"{path}" has no module-level PRETRAINED_URLS list')
+    elif path.endswith('.json'):
+        items = json.loads(text)
+    else:
+        items = []
+        for line in text.splitlines():
+            fields = line.split('#', 1)[0].split()
+            if len(fields) > 0:
+                items.append(dict(url=fields[0], size=int(fields[1]) if len(fields) > 1 else None, sha256=fields[2] if len(fields) > 2 else None))
+    entries = []
+    for item in items:
+        item = dict(url=item) if isinstance(item, str) else item
+        entries.append(dict(url=item['url'], size=item.get('size', None), sha256=item.get('sha256', None)))
+    return entries
+
+def format_size(num_bytes):
+    return f'{num_bytes / 2**20:.1f} MB' if num_bytes is not None else '? MB'
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--manifest', help='Text, JSON, or Python file listing the URLs', metavar='FILE', default='visualizer_drag.py', show_default=True)
+@click.option('--cache-dir', help='Download cache [default: dnnlib cache dir]', metavar='DIR')
+@click.option('--max-bytes', type=int, help='Byte budget of the download cache [default: unlimited or $DNNLIB_DOWNLOAD_CACHE_MAX_BYTES]')
+@click.option('--segments', type=int, help='Parallel range requests per download', default=1, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Only report which URLs are cached')
+def main(manifest, cache_dir, max_bytes, segments, dry_run):
+    """Download the networks of a manifest into the download cache."""
+    entries = read_manifest(manifest)
+    if cache_dir is None:
+        cache_dir = dnnlib.make_cache_dir_path('downloads')
+    if max_bytes is not None:
+        dnnlib.util.download_cache_max_bytes = max_bytes
+    print(f'{len(entries)} URLs in "{manifest}", cache "{cache_dir}".')
+
+    failed = []
+    for entry in entries:
+        url = entry['url']
+        cached = dnnlib.util.get_download_cache_index(cache_dir).get(url, None)
+        if cached is not None and entry['size'] in (None, cached['size']) and entry['sha256'] in (None, cached['sha256']):
+            print(f'cached      {format_size(cached["size"]):>10}  {url}')
+            continue
+        if dry_run:
+            print(f'missing     {format_size(entry["size"]):>10}  {url}')
+            continue
+        t0 = time.time()
+        try:
+            filename = dnnlib.util.open_url(url, cache_dir=cache_dir, return_filename=True, verbose=False,
+                expected_size=entry['size'], expected_sha256=entry['sha256'], num_segments=segments)
+        except IOError as e:
+            print(f'FAILED      {format_size(entry["size"]):>10}  {url}: {e}')
+            failed.append(url)
+            continue
+        print(f'downloaded  {format_size(os.path.getsize(filename)):>10}  {url} ({time.time() - t0:.1f}s)')
+
+    # Downloads late in the manifest may have evicted earlier ones.
+    index = dnnlib.util.get_download_cache_index(cache_dir)
+    cached_urls = [entry['url'] for entry in entries if entry['url'] in index]
+    print(f'{len(cached_urls)} of {len(entries)} URLs cached, {format_size(sum(index[url]["size"] for url in cached_urls))}.')
+    budget = dnnlib.util.get_download_cache_budget()
+    if not dry_run and budget is not None and len(cached_urls) + len(failed) < len(entries):
+        print(f'Warning: the manifest does not fit into the cache budget of {format_size(budget)}.')
+    if len(failed) > 0:
+        raise click.ClickException(f'{len(failed)} of {len(entries)} downloads failed')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
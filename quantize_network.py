@@ -0,0 +1,155 @@
+"""Quantize the weights of a generator to int8 for inference.
+
+Converts `G_ema` of a network pickle with `torch_utils.quantization`: conv
+and fully-connected weights become int8 with one scale per output channel,
+which needs no calibration data. The result is an inference-only pickle
+with just `G_ema`, about 4x smaller, that loads wherever the original does:
+gen_images.py, the visualizers, and stylegan_human/generate.py.
+
+A quality report compares the quantized and the original generator on the
+given seeds: PSNR of the uint8 images, LPIPS distance (VGG16 features, as in
+the StyleGAN metrics), and time per image.
+
+Examples:
+
+\b
+python quantize_network.py --network=stylegan2-ffhq-512x512.pkl --out=stylegan2-ffhq-512x512-int8.pkl
+
+\b
+# More seeds, no LPIPS (avoids downloading VGG16).
+python quantize_network.py --network=in.pkl --out=out.pkl --seeds=0-31 --no-lpips
+"""
+
+import copy
+import json
+import math
+import os
+import pickle
+import time
+
+import click
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import dnnlib
+import legacy
+from gen_images import parse_range
+from torch_utils import quantization
+
+#----------------------------------------------------------------------------
+
+def generate(G, seed, truncation_psi, noise_mode, device):
+    r"""One uint8 image [H, W, C] of `G` and the seconds it took."""
+    z = torch.from_numpy(np.random.RandomState(seed).randn(1, G.z_dim)).to(device)
+    label = torch.zeros([1, G.c_dim], device=device)
+    t0 = time.perf_counter()
+    img = G(z, label, truncation_psi=truncation_psi, noise_mode=noise_mode)
+    seconds = time.perf_counter() - t0
+    img = (img.permute(0, 2, 3, 1) * 127.5 + 128).clamp(0, 255).to(torch.uint8)
+    return img[0], seconds
+
+def psnr(img_a, img_b):
+    mse = float(((img_a.to(torch.float64) - img_b.to(torch.float64)) ** 2).mean())
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def load_vgg16(device):
+    url = 'https://nvlabs-fi-cdn.nvidia.com/stylegan2-ada-pytorch/pretrained/metrics/vgg16.pt'
+    with dnnlib.util.open_url(url) as f:
+        return torch.jit.load(f).eval().to(device)
+
+def lpips(vgg16, img_a, img_b):
+    r"""LPIPS distance of two uint8 images, computed like the PPL metric."""
+    features = []
+    for img in [img_a, img_b]:
+        x = img.permute(2, 0, 1).unsqueeze(0).to(torch.float32)
+        if x.shape[2] > 256:
+            x = F.interpolate(x, size=(256, 256), mode='area')
+        features.append(vgg16(x, resize_images=False, return_lpips=True))
+    return float((features[0] - features[1]).square().sum())
+
+#----------------------------------------------------------------------------
+
+def quality_report(G, G_int8, seeds, truncation_psi, noise_mode, device, vgg16=None):
+    r"""Compare `G_int8` against `G` on `seeds`."""
+    per_seed = []
+    times = dict(fp32=[], int8=[])
+    with torch.no_grad():
+        for seed in seeds:
+            img, t_fp32 = generate(G, seed, truncation_psi, noise_mode, device)
+            img_int8, t_int8 = generate(G_int8, seed, truncation_psi, noise_mode, device)
+            times['fp32'].append(t_fp32)
+            times['int8'].append(t_int8)
+            per_seed.append(dict(
+                seed            = seed,
+                psnr            = psnr(img_int8, img),
+                lpips           = lpips(vgg16, img_int8, img) if vgg16 is not None else None,
+                max_abs_diff    = int((img_int8.to(torch.int32) - img.to(torch.int32)).abs().max()),
+            ))
+    psnrs = [r['psnr'] for r in per_seed]
+    lpipss = [r['lpips'] for r in per_seed if r['lpips'] is not None]
+    return dict(
+        psnr_mean       = float(np.mean(psnrs)),
+        psnr_min        = float(np.min(psnrs)),
+        lpips_mean      = float(np.mean(lpipss)) if len(lpipss) > 0 else None,
+        lpips_max       = float(np.max(lpipss)) if len(lpipss) > 0 else None,
+        weight_bytes    = dict(fp32=quantization.get_weight_bytes(G), int8=quantization.get_weight_bytes(G_int8)),
+        seconds_per_image = {key: float(np.median(values[1:] if len(values) > 1 else values)) for key, values in times.items()},
+        seeds           = per_seed,
+    )
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--network', 'network_pkl', help='Network pickle filename or URL', required=True)
+@click.option('--out', 'out_pkl', help='Where to save the quantized pickle', metavar='FILE', required=True)
+@click.option('--seeds', type=parse_range, help='Seeds of the quality report', default='0-7', show_default=True)
+@click.option('--trunc', 'truncation_psi', type=float, help='Truncation psi', default=0.7, show_default=True)
+@click.option('--noise-mode', type=click.Choice(['const', 'random', 'none']), default='const', show_default=True)
+@click.option('--min-numel', type=int, help='Leave smaller weights in FP32', default=4096, show_default=True)
+@click.option('--lpips/--no-lpips', 'with_lpips', help='Include LPIPS in the report', default=True, show_default=True)
+@click.option('--report', 'report_json', help='Where to save the report [default: next to --out]', metavar='FILE')
+@click.option('--device', help='Torch device', default='cpu', show_default=True)
+def main(network_pkl, out_pkl, seeds, truncation_psi, noise_mode, min_numel, with_lpips, report_json, device):
+    """Convert a network pickle to an int8 inference-only pickle and report its quality."""
+    device = torch.device(device)
+    print(f'Loading "{network_pkl}"...')
+    with dnnlib.util.open_url(network_pkl) as f:
+        data = legacy.load_network_pkl(f, keys=['G_ema', 'training_set_kwargs'])
+    G = data['G_ema'].eval().requires_grad_(False).to(device)
+    G_int8 = quantization.quantize(copy.deepcopy(G), min_numel=min_numel)
+    print(f'Quantized {len(quantization.quantized_names(G_int8))} layers.')
+
+    os.makedirs(os.path.dirname(out_pkl) or '.', exist_ok=True)
+    with open(out_pkl, 'wb') as f:
+        pickle.dump(dict(G_ema=copy.deepcopy(G_int8).cpu(), training_set_kwargs=data['training_set_kwargs']), f)
+    print(f'Saved "{out_pkl}".')
+
+    vgg16 = None
+    if with_lpips:
+        try:
+            vgg16 = load_vgg16(device)
+        except Exception as e: # pylint: disable=broad-except
+            print(f'Cannot load VGG16, skipping LPIPS: {e}')
+    report = quality_report(G, G_int8, seeds, truncation_psi, noise_mode, device, vgg16=vgg16)
+    report.update(network=network_pkl, out=out_pkl, truncation_psi=truncation_psi, noise_mode=noise_mode, min_numel=min_numel)
+    if report_json is None:
+        report_json = os.path.splitext(out_pkl)[0] + '-report.json'
+    with open(report_json, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    sizes = report['weight_bytes']
+    times = report['seconds_per_image']
+    lpips_text = f'{report["lpips_mean"]:.4f} mean, {report["lpips_max"]:.4f} max' if report['lpips_mean'] is not None else 'n/a'
+    print(f'Weights:    {sizes["fp32"] / 2**20:.1f} MB -> {sizes["int8"] / 2**20:.1f} MB')
+    print(f'PSNR:       {report["psnr_mean"]:.2f} dB mean, {report["psnr_min"]:.2f} dB min over {len(seeds)} seeds')
+    print(f'LPIPS:      {lpips_text}')
+    print(f'Time/image: {times["fp32"] * 1e3:.1f} ms -> {times["int8"] * 1e3:.1f} ms')
+    print(f'Report saved to "{report_json}".')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,184 @@
+"""Replay recorded drag sessions headlessly and report per-event latency.
+
+Session traces are recorded by `visualizer_drag_gradio.py` and
+`visualizer_drag.py` with --session-log-dir (see viz/session_log.py).
+Every trace is replayed against a fresh `Renderer`. Each `init`, `lr`,
+and `reset_points` event is timed, and so is every step of every drag.
+
+Examples:
+
+\b
+# Replay with the recorded checkpoints.
+python replay_session.py logs/gradio-*.jsonl --out=replay.json
+
+\b
+# Replay on CPU with random generators of the recorded architecture.
+python replay_session.py logs/gradio-*.jsonl --synthetic --device=cpu
+"""
+
+import json
+import re
+import time
+
+import click
+import numpy as np
+import torch
+
+import dnnlib
+from bench_drag import make_generator, synthetic_pkl
+from viz.renderer import Renderer
+from viz.session_log import decode_mask, read_events
+
+#----------------------------------------------------------------------------
+
+def infer_arch(pkl):
+    return 'stylegan3' if 'stylegan3' in pkl else 'stylegan2'
+
+def infer_resolution(pkl, events):
+    r"""Output resolution of the network, from the init event, the pickle
+    name, or the first recorded mask.
+    """
+    for event in events:
+        if event.get('img_resolution') is not None:
+            return event['img_resolution']
+    match = re.search(r'(\d+)x\d+', pkl) or re.search(r'-(\d+)(?:\.pkl)?$', pkl)
+    if match:
+        return int(match.group(1))
+    for event in events:
+        if event.get('mask') is not None:
+            return event['mask']['shape'][0]
+    return 512
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+#----------------------------------------------------------------------------
+
+class SessionReplayer:
+    def __init__(self, device='cpu', synthetic=False, network=None, max_steps=None, **synthetic_kwargs):
+        self.device     = torch.device(device)
+        self.synthetic  = synthetic
+        self.synthetic_kwargs = synthetic_kwargs  # Arguments for make_generator().
+        self.network    = network       # Replaces every recorded pkl, if given.
+        self.max_steps  = max_steps     # Upper limit of replayed steps per drag.
+        self._networks  = dict()        # {pkl: generator} for synthetic replay.
+
+    def _time(self, fn):
+        _sync(self.device)
+        t0 = time.perf_counter()
+        fn()
+        _sync(self.device)
+        return time.perf_counter() - t0
+
+    def replay(self, events):
+        r"""Replay one session. Returns a list of records, one per timed
+        event; drags are reported as one record with per-step latencies.
+        """
+        renderer = Renderer(device=self.device)
+        res = dnnlib.EasyDict()
+        records = []
+        drag = None
+
+        def run_steps(until):
+            while drag['done'] < until:
+                reset = (drag['done'] == 0)
+                latency = self._time(lambda: renderer._render_drag_impl(res, drag['points'], drag['targets'], drag['mask'],
+                    drag['lambda_mask'], reg=drag['reg'], feature_idx=drag['feature_idx'], r1=drag['r1'], r2=drag['r2'],
+                    trunc_psi=drag['trunc_psi'], is_drag=True, reset=reset, to_pil=True))
+                renderer.timer.end_step()
+                drag['latencies'].append(latency)
+                drag['done'] += 1
+
+        for idx, event in enumerate(events):
+            kind = event['type']
+            if kind == 'init':
+                pkl = self.network if self.network is not None else event['pkl']
+                if self.synthetic:
+                    arch = infer_arch(pkl)
+                    img_resolution = infer_resolution(pkl, [event] + events)
+                    pkl = synthetic_pkl(arch, img_resolution)
+                    if pkl not in self._networks:
+                        self._networks[pkl] = make_generator(arch, img_resolution, **self.synthetic_kwargs)
+                    renderer.add_pkl_data(pkl, dict(G_ema=self._networks[pkl]))
+                def init():
+                    renderer.init_network(res, pkl=pkl, w0_seed=event['w0_seed'], w_plus=event['w_plus'],
+                        trunc_psi=event['trunc_psi'], trunc_cutoff=event.get('trunc_cutoff', None), lr=event['lr'])
+                    renderer._render_drag_impl(res, is_drag=False, to_pil=True)
+                records.append(dict(index=idx, type=kind, latency=self._time(init)))
+            elif kind == 'lr':
+                records.append(dict(index=idx, type=kind, latency=self._time(lambda: renderer.update_lr(event['lr']))))
+            elif kind == 'reset_points':
+                def reset_points():
+                    renderer.feat_refs = None
+                records.append(dict(index=idx, type=kind, latency=self._time(reset_points)))
+            elif kind == 'drag_start':
+                drag = dict(event, points=[list(p) for p in event['points']], mask=decode_mask(event['mask']),
+                    index=idx, done=0, latencies=[])
+            elif kind == 'mask' and drag is not None:
+                run_steps(self._limit(event['step']))
+                drag['mask'] = decode_mask(event['mask'])
+            elif kind == 'drag_stop' and drag is not None:
+                run_steps(self._limit(event['steps']))
+                latencies = np.array(drag['latencies']) if len(drag['latencies']) > 0 else np.zeros([1])
+                records.append(dict(index=drag['index'], type='drag', steps=drag['done'], recorded_steps=event['steps'],
+                    reason=event.get('reason'), latency=float(latencies.sum()), step_median=float(np.median(latencies)),
+                    step_p90=float(np.percentile(latencies, 90)), step_max=float(latencies.max()), step_latencies=drag['latencies']))
+                drag = None
+        return records
+
+    def _limit(self, steps):
+        return steps if self.max_steps is None else min(steps, self.max_steps)
+
+#----------------------------------------------------------------------------
+
+def summarize(records):
+    r"""Latency statistics per event type, with drag steps as their own type."""
+    values = dict()
+    for record in records:
+        values.setdefault(record['type'], []).append(record['latency'])
+        if record['type'] == 'drag':
+            values.setdefault('drag_step', []).extend(record['step_latencies'])
+    return {kind: dict(count=len(v), mean=float(np.mean(v)), p50=float(np.median(v)), p90=float(np.percentile(v, 90)),
+        max=float(np.max(v))) for kind, v in values.items() if len(v) > 0}
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.argument('traces', metavar='TRACE', nargs=-1, required=True)
+@click.option('--device', help='Torch device', default=('cuda' if torch.cuda.is_available() else 'cpu'), show_default=True)
+@click.option('--synthetic', is_flag=True, help='Use random generators of the recorded architecture and resolution')
+@click.option('--channel-base', type=int, help='Channel base of the synthetic generators')
+@click.option('--channel-max', type=int, help='Maximum channel count of the synthetic generators')
+@click.option('--network', 'network_pkl', help='Use this network pickle instead of the recorded ones')
+@click.option('--max-steps', type=int, help='Replay at most this many steps per drag')
+@click.option('--out', help='Where to save the JSON report', metavar='FILE')
+def main(traces, device, synthetic, channel_base, channel_max, network_pkl, max_steps, out):
+    """Replay recorded sessions and report per-event latency."""
+    replayer = SessionReplayer(device=device, synthetic=synthetic, network=network_pkl, max_steps=max_steps,
+        channel_base=channel_base, channel_max=channel_max)
+    sessions = []
+    all_records = []
+    for path in traces:
+        print(f'Replaying "{path}"...')
+        records = replayer.replay(read_events(path))
+        for record in records:
+            extra = f', {record["steps"]} steps, median step {record["step_median"] * 1e3:.1f}ms' if record['type'] == 'drag' else ''
+            print(f'  event {record["index"]:4d} {record["type"]:<12} {record["latency"] * 1e3:10.1f}ms{extra}')
+        sessions.append(dict(trace=path, records=records, summary=summarize(records)))
+        all_records += records
+
+    summary = summarize(all_records)
+    print(f'{"event":<12} {"count":>6} {"mean":>10} {"p50":>10} {"p90":>10} {"max":>10}')
+    for kind, stats in summary.items():
+        print(f'{kind:<12} {stats["count"]:6d}' + ''.join(f' {stats[k] * 1e3:8.1f}ms' for k in ['mean', 'p50', 'p90', 'max']))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(dict(device=device, synthetic=synthetic, sessions=sessions, summary=summary), f, indent=2)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
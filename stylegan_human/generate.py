@@ -65,7 +65,7 @@ def generate_images(
         import torch
         device = torch.device('cuda')
         with dnnlib.util.open_url(network_pkl) as f:
-            G = legacy.load_network_pkl(f)['G_ema'].to(device) # type: ignore
+            G = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema'].to(device) # type: ignore
     os.makedirs(outdir, exist_ok=True)
 
 
@@ -118,7 +118,7 @@ def main(
 
     device = torch.device('cuda')
     with dnnlib.util.open_url(network_pkl) as f:
-        G = legacy.load_network_pkl(f)['G_ema'].to(device) # type: ignore
+        G = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema'].to(device) # type: ignore
 
     outdir = os.path.join(outdir)
     if not os.path.exists(outdir):
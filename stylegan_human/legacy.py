@@ -15,12 +15,20 @@ import torch
 import copy
 import numpy as np
 from torch_utils import misc
+from torch_utils import selective_unpickle
 
 
 #----------------------------------------------------------------------------
 ## loading torch pkl
-def load_network_pkl(f, force_fp16=False, G_only=False):
-    data = _LegacyUnpickler(f).load()
+def load_network_pkl(f, force_fp16=False, G_only=False, keys=None):
+    r"""Load a network pickle. With `keys`, e.g. ['G_ema'], only these
+    entries are returned, and the other networks of a snapshot are not
+    constructed. The selective load runs the slower pure-Python unpickler,
+    so it is only used for snapshots whose other entries hold tensors;
+    other pickles are loaded in full with the C unpickler.
+    """
+    data = _LegacyUnpickler(f).load() if keys is None else _SelectiveLegacyUnpickler(f, keys).load()
+    G_only = G_only or ('G' not in data and 'D' not in data) # e.g. quantized pickles from quantize_network.py
     if G_only:
         f = open('ori_model_Gonly.txt','a+')
     else: f = open('ori_model.txt','a+')
@@ -38,14 +46,15 @@ def load_network_pkl(f, force_fp16=False, G_only=False):
     #     data = dict(G=G, D=D, G_ema=G_ema)
 
     # Add missing fields.
-    if 'training_set_kwargs' not in data:
+    if 'training_set_kwargs' not in data and (keys is None or 'training_set_kwargs' in keys):
         data['training_set_kwargs'] = None
-    if 'augment_pipe' not in data:
+    if 'augment_pipe' not in data and (keys is None or 'augment_pipe' in keys):
         data['augment_pipe'] = None
 
     # Validate contents.
-    assert isinstance(data['G_ema'], torch.nn.Module)
-    if not G_only:
+    if keys is None or 'G_ema' in keys:
+        assert isinstance(data['G_ema'], torch.nn.Module)
+    if not G_only and keys is None:
         assert isinstance(data['D'], torch.nn.Module)
         assert isinstance(data['G'], torch.nn.Module)
         assert isinstance(data['training_set_kwargs'], (dict, type(None)))
@@ -56,7 +65,7 @@ def load_network_pkl(f, force_fp16=False, G_only=False):
         if G_only:
             convert_list = ['G_ema'] #'G'
         else: convert_list = ['G', 'D', 'G_ema']
-        for key in convert_list:
+        for key in [key for key in convert_list if key in data]:
             old = data[key]
             kwargs = copy.deepcopy(old.init_kwargs)
             if key.startswith('G'):
@@ -81,6 +90,14 @@ class _LegacyUnpickler(pickle.Unpickler):
             return _TFNetworkStub
         return super().find_class(module, name)
 
+class _SelectiveLegacyUnpickler(selective_unpickle.SelectiveUnpickler):
+    full_unpickler = _LegacyUnpickler
+
+    def find_class(self, module, name):
+        if module == 'dnnlib.tflib.network' and name == 'Network':
+            return _TFNetworkStub
+        return super().find_class(module, name)
+
 #----------------------------------------------------------------------------
 
 def num_range(s: str) -> List[int]:
@@ -51,7 +51,7 @@ def generate_style_mix(
     print('Loading networks from "%s"...' % network_pkl)
     device = torch.device('cuda')
     with dnnlib.util.open_url(network_pkl) as f:
-        G = legacy.load_network_pkl(f)['G_ema'].to(device)
+        G = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema'].to(device)
 
     os.makedirs(outdir, exist_ok=True)
 
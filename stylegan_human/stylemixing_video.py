@@ -67,7 +67,7 @@ def style_mixing_video(network_pkl: str,
     print('Loading networks from "%s"...' % network_pkl)
     device = torch.device('cuda')
     with dnnlib.util.open_url(network_pkl) as f:
-        Gs = legacy.load_network_pkl(f)['G_ema'].to(device) 
+        Gs = legacy.load_network_pkl(f, keys=['G_ema'])['G_ema'].to(device) 
 
     print(Gs.num_ws, Gs.w_dim, Gs.img_resolution) 
     max_style = int(2 * np.log2(Gs.img_resolution)) - 3
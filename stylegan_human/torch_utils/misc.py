@@ -65,6 +65,13 @@ try:
 except AttributeError:
     symbolic_assert = torch.Assert # 1.7.0
 
+#----------------------------------------------------------------------------
+# Is the code being traced by torch.compile()?
+
+def is_compiling():
+    compiler = getattr(torch, 'compiler', None)
+    return compiler is not None and hasattr(compiler, 'is_compiling') and compiler.is_compiling()
+
 #----------------------------------------------------------------------------
 # Context manager to suppress known warnings in torch.jit.trace().
 
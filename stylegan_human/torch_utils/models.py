@@ -14,6 +14,7 @@ import torch.nn.init as init
 from torch.autograd import Function
 
 from .op_edit import FusedLeakyReLU, fused_leaky_relu, upfirdn2d
+from .ops import modconv_dispatch
 
 
 class PixelNorm(nn.Module):
@@ -214,6 +215,8 @@ class ModulatedConv2d(nn.Module):
         )
         self.modulation = EqualLinear(style_dim, in_channel, bias_init=1)
         self.demodulate = demodulate
+        # True = grouped conv with per-sample weights, False = scale the activations, 'auto' = choose per configuration.
+        self.fused_modconv = 'auto'
 
     def __repr__(self):
         return (
@@ -222,8 +225,46 @@ class ModulatedConv2d(nn.Module):
         )
 
     def forward(self, input, style):
+        fused = self.fused_modconv
+        if fused == 'auto':
+            backward = torch.is_grad_enabled() and any(t.requires_grad for t in [input, style, self.weight])
+            key = modconv_dispatch.make_key(
+                input, self.weight, up=2 if self.upsample else 1, down=2 if self.downsample else 1,
+                demodulate=self.demodulate, backward=backward,
+            )
+            fused = modconv_dispatch.should_fuse(
+                key, input, lambda fused: self._forward(input, style, fused), grad_inputs=[input, style, self.weight]
+            )
+        return self._forward(input, style, fused)
+
+    def _forward(self, input, style, fused):
         batch, in_channel, height, width = input.shape
 
+        if not fused:
+            weight = self.scale * self.weight.squeeze(0)
+            style = self.modulation(style)
+
+            if self.demodulate:
+                demod = torch.rsqrt(style.pow(2) @ weight.pow(2).sum([2, 3]).t() + 1e-8)
+
+            input = input * style.view(batch, in_channel, 1, 1)
+
+            if self.upsample:
+                out = F.conv_transpose2d(input, weight.transpose(0, 1), padding=0, stride=2)
+                out = self.blur(out)
+
+            elif self.downsample:
+                input = self.blur(input)
+                out = F.conv2d(input, weight, padding=0, stride=2)
+
+            else:
+                out = F.conv2d(input, weight, padding=self.padding)
+
+            if self.demodulate:
+                out = out * demod.view(batch, self.out_channel, 1, 1)
+
+            return out
+
         style = self.modulation(style).view(batch, 1, in_channel, 1, 1)
         weight = self.scale * self.weight * style
 
@@ -13,15 +13,27 @@
 The pickled code is automatically imported into a separate Python module
 during unpickling. This way, any previously exported pickles will remain
 usable even if the original code is no longer available, or if the current
-version of the code is not consistent with what was originally pickled."""
+version of the code is not consistent with what was originally pickled.
+
+The imported modules are cached by the SHA-256 of their source code: in
+`sys.modules`, where they are shared with the other copy of this file in
+stylegan_human, and as compiled bytecode on disk, so that fresh processes
+skip compiling the sources of pickles loaded before."""
 
 import sys
 import pickle
 import io
 import inspect
 import copy
-import uuid
+import hashlib
+import importlib._bootstrap_external
+import importlib.util
+import marshal
+import os
+import time
 import types
+import uuid
+import warnings
 import dnnlib
 
 #----------------------------------------------------------------------------
@@ -32,6 +44,12 @@ _import_hooks       = []        # [hook_function, ...]
 _module_to_src_dict = dict()    # {module: src, ...}
 _src_to_module_dict = dict()    # {src: module, ...}
 
+module_cache        = True      # Persist the bytecode of imported modules on disk?
+module_cache_dir    = None      # Where to persist it, None = <dnnlib cache dir>/persistence.
+
+_module_cache_failed = False
+_stats              = dict(modules_compiled=0, modules_cached=0, modules_shared=0, compile_time=0.0, exec_time=0.0, unpickle_time=0.0)
+
 #----------------------------------------------------------------------------
 
 def persistent_class(orig_class):
@@ -182,6 +200,7 @@ def _reconstruct_persistent_obj(meta):
     r"""Hook that is called internally by the `pickle` module to unpickle
     a persistent object.
     """
+    t0 = time.perf_counter()
     meta = dnnlib.EasyDict(meta)
     meta.state = dnnlib.EasyDict(meta.state)
     for hook in _import_hooks:
@@ -201,6 +220,7 @@ def _reconstruct_persistent_obj(meta):
         setstate(meta.state) # pylint: disable=not-callable
     else:
         obj.__dict__.update(meta.state)
+    _stats['unpickle_time'] += time.perf_counter() - t0
     return obj
 
 #----------------------------------------------------------------------------
@@ -220,14 +240,80 @@ def _src_to_module(src):
     """
     module = _src_to_module_dict.get(src, None)
     if module is None:
-        module_name = "_imported_module_" + uuid.uuid4().hex
+        digest = hashlib.sha256(src.encode('utf-8')).hexdigest()
+        module_name = "_imported_module_" + digest[:32]
+        module = sys.modules.get(module_name, None) # Imported by the other copy of this file?
+        if module is not None:
+            _module_to_src_dict[module] = src
+            _src_to_module_dict[src] = module
+            _stats['modules_shared'] += 1
+            return module
+        code = _compile_module_src(src, digest, module_name)
         module = types.ModuleType(module_name)
         sys.modules[module_name] = module
         _module_to_src_dict[module] = src
         _src_to_module_dict[src] = module
-        exec(src, module.__dict__) # pylint: disable=exec-used
+        t0 = time.perf_counter()
+        try:
+            exec(code, module.__dict__) # pylint: disable=exec-used
+        except:
+            del sys.modules[module_name], _module_to_src_dict[module], _src_to_module_dict[src]
+            raise
+        _stats['exec_time'] += time.perf_counter() - t0
     return module
 
+def _get_module_cache_path(digest):
+    cache_dir = module_cache_dir if module_cache_dir is not None else dnnlib.make_cache_dir_path('persistence')
+    return os.path.join(cache_dir, f'{digest}.{sys.implementation.cache_tag}.pyc')
+
+def _compile_module_src(src, digest, module_name):
+    r"""Compile the source code of a module, or load its bytecode from the
+    on-disk module cache if it was compiled before. The cache files are
+    standard hash-based .pyc files (PEP 552), checked against the source.
+    """
+    global _module_cache_failed
+    path = _get_module_cache_path(digest) if module_cache else None
+    source_hash = importlib.util.source_hash(src.encode('utf-8'))
+    if path is not None and os.path.isfile(path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            exc_details = dict(name=module_name, path=path)
+            importlib._bootstrap_external._classify_pyc(data, module_name, exc_details) # Same bytecode version? pylint: disable=protected-access
+            importlib._bootstrap_external._validate_hash_pyc(data, source_hash, module_name, exc_details) # pylint: disable=protected-access
+            code = marshal.loads(memoryview(data)[16:])
+            _stats['modules_cached'] += 1
+            return code
+        except (OSError, ImportError, EOFError, ValueError, TypeError):
+            pass # Recompile.
+
+    t0 = time.perf_counter()
+    code = compile(src, module_name, 'exec')
+    _stats['compile_time'] += time.perf_counter() - t0
+    _stats['modules_compiled'] += 1
+    if path is not None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(importlib._bootstrap_external._code_to_hash_pyc(code, source_hash)) # pylint: disable=protected-access
+            os.replace(tmp_path, path) # atomic
+        except OSError as e:
+            if not _module_cache_failed:
+                warnings.warn(f'Cannot save the persistence module cache to "{path}": {e}')
+            _module_cache_failed = True
+    return code
+
+def get_stats():
+    r"""Modules compiled, loaded from the on-disk cache, and shared with the
+    other copy of this file, and the seconds spent compiling and executing
+    them and unpickling persistent objects overall.
+    """
+    return dict(_stats)
+
+def reset_stats():
+    _stats.update(modules_compiled=0, modules_cached=0, modules_shared=0, compile_time=0.0, exec_time=0.0, unpickle_time=0.0)
+
 #----------------------------------------------------------------------------
 
 def _check_pickleable(obj):
@@ -0,0 +1,89 @@
+"""Weight-only int8 quantization of networks for inference.
+
+`quantize(net)` replaces the weights of the convolution and fully-connected
+layers by int8 buffers with one float32 scale per output channel
+(symmetric, absmax), so no calibration data is needed. A forward pre-hook
+dequantizes the weight of a layer right before it runs and a forward hook
+releases it afterwards, so that at most one float32 copy of a weight exists
+at a time. Everything computed from the weights, e.g. the modulation and
+demodulation of StyleGAN, runs in float32 on the dequantized weights as
+before. Biases, styles, and other buffers are not quantized.
+
+Quantized networks pickle like any other persistent network, but are meant
+for inference only: their weights cannot be trained."""
+
+import torch
+
+#----------------------------------------------------------------------------
+
+def quantize_tensor(w, dim=0):
+    r"""Quantize `w` to int8 with one scale per index along `dim`. Returns
+    the int8 tensor and the float32 scales, shaped to broadcast against it.
+    """
+    w = w.detach().to(torch.float32)
+    reduce_dims = [d for d in range(w.ndim) if d != dim % w.ndim]
+    scale = w.abs().amax(dim=reduce_dims, keepdim=True) / 127
+    scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+    q = (w / scale).round().clamp(-127, 127).to(torch.int8)
+    return q.contiguous(), scale
+
+def dequantize_tensor(q, scale):
+    return q.to(scale.dtype) * scale
+
+#----------------------------------------------------------------------------
+
+def _dequantize_weight(module, _inputs):
+    module.weight = dequantize_tensor(module.weight_int8, module.weight_scale)
+
+def _release_weight(module, _inputs, _output):
+    if 'weight' in module.__dict__:
+        del module.weight
+
+def _get_weight(module):
+    w = module._parameters.get('weight', None) # pylint: disable=protected-access
+    if w is None:
+        w = module._buffers.get('weight', None) # pylint: disable=protected-access
+    return w
+
+#----------------------------------------------------------------------------
+
+def is_quantized(module):
+    return any(hasattr(m, 'weight_int8') for m in module.modules())
+
+def quantized_names(module):
+    r"""Names of the submodules of `module` whose weights are quantized."""
+    return [name for name, m in module.named_modules() if hasattr(m, 'weight_int8')]
+
+def quantize(module, min_numel=4096, names=None):
+    r"""Quantize the weights of `module` and its submodules in-place. Every
+    tensor called `weight` with at least two dimensions and `min_numel`
+    elements is quantized per output channel (the first dimension). With
+    `names`, exactly the listed submodules are quantized instead, e.g. to
+    reproduce the layout of another quantized network before loading its
+    state dict.
+    """
+    for name, m in list(module.named_modules()):
+        if hasattr(m, 'weight_int8'):
+            continue
+        w = _get_weight(m)
+        if w is None or w.ndim < 2:
+            continue
+        if (name not in names) if names is not None else (w.numel() < min_numel):
+            continue
+        q, scale = quantize_tensor(w)
+        if 'weight' in m._parameters: # pylint: disable=protected-access
+            del m._parameters['weight'] # pylint: disable=protected-access
+        else:
+            del m._buffers['weight'] # pylint: disable=protected-access
+        m.register_buffer('weight_int8', q.to(w.device))
+        m.register_buffer('weight_scale', scale.to(w.device))
+        m.register_forward_pre_hook(_dequantize_weight)
+        m.register_forward_hook(_release_weight)
+    return module
+
+def get_weight_bytes(module):
+    r"""Bytes taken by the parameters and buffers of `module`."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+#----------------------------------------------------------------------------
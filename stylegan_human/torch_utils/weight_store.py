@@ -0,0 +1,176 @@
+"""Process-wide store of read-only network weights, deduplicated by content.
+
+Fine-tunes of one base network, e.g. the variants of a checkpoint or the
+generators tuned by PTI, often have many bitwise identical tensors, and
+every session that loads a checkpoint has all of them. `share(net)`
+replaces the parameters and buffers of `net` by views of canonical tensors
+that are keyed by the SHA-256 of their contents and device, so that equal
+tensors are held once per device however many networks use them. The
+canonical tensors live as long as any network refers to them.
+
+Shared tensors are read-only: the networks are inference copies whose
+parameters do not require gradients. A workflow that modifies a network,
+e.g. tuning it, first calls `unshare(net)`, which gives the network private
+copies of its shared tensors (copy on write). In-place writes to a shared
+tensor are not prevented, but `check()` reports them, since all views of a
+tensor share its version counter. `copy.deepcopy()` of a shared network
+yields a private network as well.
+
+Checkpoints that store the digests of their tensors, e.g. native
+checkpoints, pass them on with `set_digest()`, so that sharing a network
+loaded from one neither hashes its tensors nor reads them from disk."""
+
+import hashlib
+import threading
+import time
+import weakref
+
+import torch
+
+#----------------------------------------------------------------------------
+
+_lock       = threading.RLock()  # Reentrant: the weakref callbacks may run during garbage collection under the lock.
+_tensors    = dict()    # {(digest, device): weakref to canonical tensor, ...}
+_versions   = dict()    # {(digest, device): version counter when stored, ...}
+_stats      = dict(tensors_stored=0, tensors_shared=0, bytes_stored=0, bytes_shared=0, hash_time=0.0)
+
+_SOURCE_ATTR = '_weight_store_source'   # Attribute of the views: (key, canonical tensor).
+_DIGEST_ATTR = '_weight_store_digest'   # Attribute of tensors with a known digest: (digest, version counter).
+
+#----------------------------------------------------------------------------
+
+def tensor_digest(t):
+    r"""SHA-256 of the dtype, shape, and contents of tensor `t`."""
+    t = t.detach()
+    if t.device.type != 'cpu':
+        t = t.cpu()
+    sha256 = hashlib.sha256(f'{t.dtype} {list(t.shape)}'.encode('utf-8'))
+    if t.numel() > 0:
+        sha256.update(t.contiguous().reshape(-1).view(torch.uint8).numpy())
+    return sha256.hexdigest()
+
+def set_digest(t, digest):
+    r"""Record that `tensor_digest(t)` is `digest`, so that `share()` does
+    not hash `t` again. Ignored once `t` is modified in place. Returns `t`.
+    """
+    setattr(t, _DIGEST_ATTR, (digest, t._version))
+    return t
+
+def _forget(key, ref):
+    with _lock:
+        if _tensors.get(key, None) is ref:
+            del _tensors[key]
+            del _versions[key]
+
+def _canonical(t, device):
+    r"""Key and canonical tensor on `device` with the contents of `t`."""
+    known = getattr(t, _DIGEST_ATTR, None)
+    if is_shared(t):
+        digest = getattr(t, _SOURCE_ATTR)[0][0] # Already a view => no need to hash it again.
+    elif known is not None and known[1] == t._version:
+        digest = known[0] # Stored with the checkpoint.
+    else:
+        t0 = time.perf_counter()
+        digest = tensor_digest(t)
+        _stats['hash_time'] += time.perf_counter() - t0
+    key = (digest, str(device))
+    with _lock:
+        ref = _tensors.get(key, None)
+        canonical = ref() if ref is not None else None
+        nbytes = t.numel() * t.element_size()
+        if canonical is not None:
+            _stats['tensors_shared'] += 1
+            _stats['bytes_shared'] += nbytes
+            return key, canonical
+        canonical = t.detach().to(device).contiguous() # Takes over `t` if it is already on the device.
+        ref = weakref.ref(canonical, lambda ref: _forget(key, ref))
+        _tensors[key] = ref
+        _versions[key] = canonical._version
+        _stats['tensors_stored'] += 1
+        _stats['bytes_stored'] += nbytes
+        return key, canonical
+
+def _view(key, canonical, param):
+    view = torch.nn.Parameter(canonical, requires_grad=False) if param else canonical.detach()
+    setattr(view, _SOURCE_ATTR, (key, canonical)) # Keeps the canonical tensor alive.
+    return view
+
+#----------------------------------------------------------------------------
+
+def share(net, device=None):
+    r"""Replace the parameters and buffers of `net` in place by read-only
+    views of the canonical tensors with the same contents on `device`
+    (default: where they are). A tensor that has no canonical copy yet
+    becomes one, so `net` must not be modified afterwards. Returns `net`.
+    """
+    for module in net.modules():
+        for tensors, param in [(module._parameters, True), (module._buffers, False)]: # pylint: disable=protected-access
+            for name, t in list(tensors.items()):
+                if t is None:
+                    continue
+                key, canonical = _canonical(t, t.device if device is None else torch.device(device))
+                tensors[name] = _view(key, canonical, param)
+    return net
+
+def share_from(net, source, device=None):
+    r"""Like `net.load_state_dict(source.state_dict())` followed by
+    `share(net, device)`, but without copying or hashing the tensors of
+    `source` that are shared already. Returns `net`.
+    """
+    sources = source.state_dict(keep_vars=True) # Keep the views.
+    for name, t in net.state_dict(keep_vars=True).items():
+        if name not in sources:
+            raise RuntimeError(f'Missing key in source network: {name}')
+        src = sources[name]
+        if src.shape != t.shape:
+            raise RuntimeError(f'Size mismatch for {name}: {list(src.shape)} vs. {list(t.shape)}')
+        if src.dtype != t.dtype:
+            src = src.to(t.dtype)
+        prefix, _, attr = name.rpartition('.')
+        module = net.get_submodule(prefix)
+        param = attr in module._parameters # pylint: disable=protected-access
+        key, canonical = _canonical(src, t.device if device is None else torch.device(device))
+        (module._parameters if param else module._buffers)[attr] = _view(key, canonical, param) # pylint: disable=protected-access
+    return share(net, device) # Non-persistent buffers.
+
+def unshare(net):
+    r"""Give `net` private, writable copies of its shared tensors (copy on
+    write), e.g. before tuning it. Parameters keep their `requires_grad`,
+    which the caller sets as needed. Returns `net`.
+    """
+    for module in net.modules():
+        for tensors, param in [(module._parameters, True), (module._buffers, False)]: # pylint: disable=protected-access
+            for name, t in list(tensors.items()):
+                if t is not None and is_shared(t):
+                    copy = t.detach().clone()
+                    tensors[name] = torch.nn.Parameter(copy, requires_grad=t.requires_grad) if param else copy
+    return net
+
+def is_shared(t):
+    r"""Whether tensor `t` is a view of a canonical tensor of the store."""
+    source = getattr(t, _SOURCE_ATTR, None)
+    return source is not None and t.data_ptr() == source[1].data_ptr()
+
+def check():
+    r"""Keys `(digest, device)` of the canonical tensors that were modified
+    in place since they were stored. Empty if the store is consistent.
+    """
+    with _lock:
+        items = [(key, ref()) for key, ref in _tensors.items()]
+        return [key for key, t in items if t is not None and t._version != _versions[key]]
+
+#----------------------------------------------------------------------------
+
+def get_stats():
+    r"""Canonical tensors and bytes held now, and overall the tensors and
+    bytes stored, served from the store instead of copied again (shared),
+    and the seconds spent hashing.
+    """
+    with _lock:
+        live = [t for t in (ref() for ref in _tensors.values()) if t is not None]
+        return dict(_stats, tensors_live=len(live), bytes_live=sum(t.numel() * t.element_size() for t in live))
+
+def reset_stats():
+    _stats.update(tensors_stored=0, tensors_shared=0, bytes_stored=0, bytes_shared=0, hash_time=0.0)
+
+#----------------------------------------------------------------------------
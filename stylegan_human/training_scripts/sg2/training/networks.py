@@ -12,6 +12,7 @@ import numpy as np
 import torch
 from torch_utils import misc
 from torch_utils import persistence
+from torch_utils import mixed_precision
 from torch_utils.ops import conv2d_resample
 from torch_utils.ops import upfirdn2d
 from torch_utils.ops import bias_act
@@ -297,7 +298,10 @@ class SynthesisLayer(torch.nn.Module):
             misc.assert_shape(x, [None, self.weight.shape[1], in_resolution, in_resolution])
         else:
             misc.assert_shape(x, [None, self.weight.shape[1], in_resolution, in_resolution // 2]) 
-        styles = self.affine(w)
+        with mixed_precision.fp32(x.device.type, enabled=mixed_precision.keep_fp32(self, 'affine', x.device.type)):
+            styles = self.affine(w)
+        if mixed_precision.keep_fp32(self, 'demod', x.device.type):
+            styles = styles.to(torch.float32) # Demodulation is elementwise, so FP32 inputs keep it in FP32.
 
         noise = None
         if self.use_noise and noise_mode == 'random':
@@ -331,7 +335,11 @@ class ToRGBLayer(torch.nn.Module):
         self.weight_gain = 1 / np.sqrt(in_channels * (kernel_size ** 2))
 
     def forward(self, x, w, fused_modconv=True):
-        styles = self.affine(w) * self.weight_gain
+        if mixed_precision.keep_fp32(self, 'torgb', x.device.type):
+            with mixed_precision.fp32(x.device.type):
+                return self.forward(x.to(torch.float32), w, fused_modconv=fused_modconv)
+        with mixed_precision.fp32(x.device.type, enabled=mixed_precision.keep_fp32(self, 'affine', x.device.type)):
+            styles = self.affine(w) * self.weight_gain
         x = modulated_conv2d(x=x, weight=self.weight, styles=styles, demodulate=False, fused_modconv=fused_modconv)
         x = bias_act.bias_act(x, self.bias.to(x.dtype), clamp=self.conv_clamp)
         return x
@@ -396,12 +404,17 @@ class SynthesisBlock(torch.nn.Module):
 
     def forward(self, x, img, ws, force_fp32=False, fused_modconv=None, **layer_kwargs):
         misc.assert_shape(ws, [None, self.num_conv + self.num_torgb, self.w_dim])
+        if mixed_precision.keep_fp32(self, 'layer', ws.device.type):
+            with mixed_precision.fp32(ws.device.type):
+                return self.forward(x, img, ws, force_fp32=force_fp32, fused_modconv=fused_modconv, **layer_kwargs)
         w_iter = iter(ws.unbind(dim=1))
         dtype = torch.float16 if self.use_fp16 and not force_fp32 else torch.float32
+        if mixed_precision.autocast_dtype(ws.device.type) is not None:
+            dtype = mixed_precision.autocast_dtype(ws.device.type) # Follow autocast, see torch_utils/mixed_precision.py.
         memory_format = torch.channels_last if self.channels_last and not force_fp32 else torch.contiguous_format
         if fused_modconv is None:
             with misc.suppress_tracer_warnings(): # this value will be treated as a constant
-                fused_modconv = (not self.training) and (dtype == torch.float32 or int(x.shape[0]) == 1)
+                fused_modconv = (not self.training) and (dtype == torch.float32 or int(ws.shape[0]) == 1) # x is None in the first block
 
         # Input.
         if self.in_channels == 0:
@@ -432,7 +445,8 @@ class SynthesisBlock(torch.nn.Module):
                 misc.assert_shape(img, [None, self.img_channels, self.resolution // 2, self.resolution // 2])
             else:
                 misc.assert_shape(img, [None, self.img_channels, self.resolution // 2, self.resolution // 4]) 
-            img = upfirdn2d.upsample2d(img, self.resample_filter)
+            with mixed_precision.fp32(img.device.type): # The image stays in FP32.
+                img = upfirdn2d.upsample2d(img, self.resample_filter)
         if self.is_last or self.architecture == 'skip':
             y = self.torgb(x, next(w_iter), fused_modconv=fused_modconv)
             y = y.to(dtype=torch.float32, memory_format=torch.contiguous_format)
@@ -1,13 +1,16 @@
 # Copyright (c) SenseTime Research. All rights reserved.
 
 
-import pickle
 import functools
 import torch
 from pti.pti_configs import paths_config, global_config
+from torch_utils import selective_unpickle
+from torch_utils import weight_store
 
 
 def toogle_grad(model, flag=True):
+    if flag:
+        weight_store.unshare(model)  # copy on write before tuning
     for p in model.parameters():
         p.requires_grad = flag
 
@@ -18,11 +21,11 @@ def load_tuned_G(run_id, type):
         new_G = torch.load(f).to(global_config.device).eval()
     new_G = new_G.float()
     toogle_grad(new_G, False)
-    return new_G
+    return weight_store.share(new_G)  # tensors left unchanged by tuning are shared with the base G
 
 
 def load_old_G():
     with open(paths_config.stylegan2_ada_shhq, 'rb') as f:
-        old_G = pickle.load(f)['G_ema'].to(global_config.device).eval()
+        old_G = selective_unpickle.load(f, ['G_ema'])['G_ema'].to(global_config.device).eval()
         old_G = old_G.float()
-    return old_G
+    return weight_store.share(old_G)
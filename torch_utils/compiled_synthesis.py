@@ -0,0 +1,136 @@
+"""Opt-in torch.compile() execution of `Generator.synthesis`.
+
+`enable(G, checkpoint)` replaces the forward of `G.synthesis` with a
+`CompiledForward`, so that callers keep calling `G(...)` or
+`G.synthesis(...)` as before. Compiled graphs are cached per checkpoint
+and call signature: device, shapes and dtypes of the tensor arguments,
+the other arguments, whether gradients are enabled, and the autocast
+state (see mixed_precision.py). The graphs take
+the synthesis network as an input, so they are reused when the same
+checkpoint is instantiated again. The first call of every signature runs
+eagerly: it autotunes the ops, e.g. the modulated convolution dispatch,
+and shows that the network runs at all before compiling it. Whenever
+compiling or running a compiled graph fails, the signature falls back to
+eager execution for good."""
+
+import time
+import warnings
+import torch
+
+from . import mixed_precision
+
+#----------------------------------------------------------------------------
+
+backend         = 'inductor'    # Backend passed to torch.compile().
+mode            = None          # Mode passed to torch.compile(), e.g. 'reduce-overhead' or 'max-autotune'.
+max_signatures  = 64            # Raise the recompile limit of torch.compile() to this many call signatures.
+verbose         = True          # Print when a signature is compiled or falls back to eager?
+
+_FAILED         = 'failed'
+_cache          = dict()        # {signature: compiled function | _FAILED}
+_compiled       = set()         # Signatures whose compiled function has run.
+_stats          = dict(eager=0, compiled=0, fallback=0, compile_time=0.0)
+
+#----------------------------------------------------------------------------
+
+def is_available():
+    return hasattr(torch, 'compile')
+
+def _describe(value):
+    if isinstance(value, torch.Tensor):
+        return ('tensor', str(value.device), str(value.dtype), tuple(value.shape), value.requires_grad)
+    if isinstance(value, (list, tuple)):
+        return tuple(_describe(v) for v in value)
+    return repr(value)
+
+def _synthesis_forward(module, args, kwargs):
+    return type(module).forward(module, *args, **kwargs)
+
+def _raise_recompile_limit():
+    config = torch._dynamo.config # pylint: disable=protected-access
+    for name in ['recompile_limit', 'cache_size_limit']:
+        if hasattr(config, name):
+            setattr(config, name, max(getattr(config, name), max_signatures))
+            return
+
+#----------------------------------------------------------------------------
+
+class CompiledForward:
+    def __init__(self, module, checkpoint):
+        self.module     = module
+        self.checkpoint = checkpoint    # Cache key of the weights' architecture, e.g. the pickle path.
+
+    def signature(self, args, kwargs):
+        autocast = tuple(str(mixed_precision.autocast_dtype(device_type)) for device_type in ['cpu', 'cuda'])
+        return (self.checkpoint, type(self.module).__qualname__, _describe(list(args)),
+            tuple(sorted((k, _describe(v)) for k, v in kwargs.items())), torch.is_grad_enabled(), self.module.training,
+            autocast, tuple(getattr(m, 'fp32_parts', None) for m in [self.module, *self.module.children()]))
+
+    def eager(self, *args, **kwargs):
+        return _synthesis_forward(self.module, args, kwargs)
+
+    def __call__(self, *args, **kwargs):
+        key = self.signature(args, kwargs)
+        fn = _cache.get(key, None)
+        if fn is None:
+            # First call: run eagerly, then compile for the next calls.
+            out = self.eager(*args, **kwargs)
+            _raise_recompile_limit()
+            options = None
+            if backend == 'inductor' and all(a.device.type == 'cpu' for a in args if isinstance(a, torch.Tensor)):
+                options = dict(layout_optimization=False) # Channels-last copies around CPU convolutions cost more than they save.
+            _cache[key] = torch.compile(_synthesis_forward, backend=backend, mode=mode, options=options, dynamic=False)
+            _stats['eager'] += 1
+            return out
+        if fn is _FAILED:
+            _stats['eager'] += 1
+            return self.eager(*args, **kwargs)
+
+        try:
+            t0 = time.perf_counter()
+            out = fn(self.module, args, kwargs)
+        except Exception as e: # pylint: disable=broad-except
+            _cache[key] = _FAILED
+            _stats['fallback'] += 1
+            warnings.warn(f'Compiled synthesis of "{self.checkpoint}" failed, falling back to eager: {type(e).__name__}: {e}')
+            return self.eager(*args, **kwargs)
+        if key not in _compiled:
+            _compiled.add(key)
+            _stats['compile_time'] += time.perf_counter() - t0
+            if verbose:
+                print(f'Compiled synthesis of "{self.checkpoint}" in {time.perf_counter() - t0:.1f}s.')
+        _stats['compiled'] += 1
+        return out
+
+#----------------------------------------------------------------------------
+
+def enable(G, checkpoint):
+    r"""Run `G.synthesis` through torch.compile() from now on. `checkpoint`
+    identifies the architecture and must differ between networks that
+    differ in anything other than their weights.
+    """
+    if not is_available():
+        warnings.warn('torch.compile() is not available, synthesis stays eager')
+        return G
+    G.synthesis.forward = CompiledForward(G.synthesis, checkpoint)
+    return G
+
+def disable(G):
+    if isinstance(G.synthesis.__dict__.get('forward', None), CompiledForward):
+        del G.synthesis.forward
+    return G
+
+def is_enabled(G):
+    return isinstance(G.synthesis.__dict__.get('forward', None), CompiledForward)
+
+def get_stats():
+    r"""Number of eager, compiled, and fallback calls and the total compile time."""
+    return dict(_stats)
+
+def reset():
+    _cache.clear()
+    _compiled.clear()
+    _stats.clear()
+    _stats.update(eager=0, compiled=0, fallback=0, compile_time=0.0)
+
+#----------------------------------------------------------------------------
@@ -63,6 +63,13 @@ try:
 except AttributeError:
     symbolic_assert = torch.Assert # 1.7.0
 
+#----------------------------------------------------------------------------
+# Is the code being traced by torch.compile()?
+
+def is_compiling():
+    compiler = getattr(torch, 'compiler', None)
+    return compiler is not None and hasattr(compiler, 'is_compiling') and compiler.is_compiling()
+
 #----------------------------------------------------------------------------
 # Context manager to temporarily suppress known warnings in torch.jit.trace().
 # Note: Cannot use catch_warnings because of https://bugs.python.org/issue29672
@@ -77,7 +84,8 @@ def suppress_tracer_warnings():
 #----------------------------------------------------------------------------
 # Assert that the shape of a tensor matches the given list of integers.
 # None indicates that the size of a dimension is allowed to vary.
-# Performs symbolic assertion when used in torch.jit.trace().
+# Performs symbolic assertion when used in torch.jit.trace(), and records
+# symbolic sizes as constraints without graph breaks in torch.compile().
 
 def assert_shape(tensor, ref_shape):
     if tensor.ndim != len(ref_shape):
@@ -85,6 +93,8 @@ def assert_shape(tensor, ref_shape):
     for idx, (size, ref_size) in enumerate(zip(tensor.shape, ref_shape)):
         if ref_size is None:
             pass
+        elif isinstance(size, torch.SymInt):
+            torch._check(size == int(ref_size)) # pylint: disable=protected-access
         elif isinstance(ref_size, torch.Tensor):
             with suppress_tracer_warnings(): # as_tensor results are registered as constants
                 symbolic_assert(torch.equal(torch.as_tensor(size), ref_size), f'Wrong size for dimension {idx}')
@@ -96,9 +106,12 @@ def assert_shape(tensor, ref_shape):
 
 #----------------------------------------------------------------------------
 # Function decorator that calls torch.autograd.profiler.record_function().
+# Skipped in torch.compile(), which ignores profiler ranges.
 
 def profiled_function(fn):
     def decorator(*args, **kwargs):
+        if is_compiling():
+            return fn(*args, **kwargs)
         with torch.autograd.profiler.record_function(fn.__name__):
             return fn(*args, **kwargs)
     decorator.__name__ = fn.__name__
@@ -0,0 +1,93 @@
+"""Reduced-precision execution of the synthesis networks with autocast.
+
+`autocast(device_type, precision)` runs everything inside it with
+torch.autocast(), e.g. in bfloat16 on CPUs that support it natively. The
+synthesis layers follow the autocast dtype instead of their own float16 /
+float32 choice, and keep the numerically sensitive parts in float32:
+
+    'affine'    The affine layers that compute the styles from W.
+    'demod'     The demodulation coefficients of the modulated convolutions.
+    'torgb'     The ToRGB layers, including their output image.
+    'layer'     Whole synthesis blocks (StyleGAN2) or layers (StyleGAN3).
+
+Which parts stay in float32 is configured per network and layer with
+`set_fp32_parts()`; by default all of them do except 'layer'.
+`set_fp32_layers()` keeps the first layers entirely in float32, e.g. the
+ones whose features the drag tracks and optimizes, so that only the
+layers after them run in reduced precision. Outside of autocast none of
+this has any effect."""
+
+import contextlib
+import torch
+
+#----------------------------------------------------------------------------
+
+PRECISIONS  = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+FP32_PARTS  = ('affine', 'demod', 'torgb')  # Default.
+ALL_PARTS   = FP32_PARTS + ('layer',)
+
+#----------------------------------------------------------------------------
+
+def autocast_dtype(device_type):
+    r"""The dtype of the enclosing autocast region, or None outside of one."""
+    if hasattr(torch, 'get_autocast_dtype'): # PyTorch >= 2.4
+        return torch.get_autocast_dtype(device_type) if torch.is_autocast_enabled(device_type) else None
+    if device_type == 'cpu':
+        enabled = torch.is_autocast_cpu_enabled()
+        return torch.get_autocast_cpu_dtype() if enabled else None
+    if device_type == 'cuda':
+        return torch.get_autocast_gpu_dtype() if torch.is_autocast_enabled() else None
+    return None
+
+def keep_fp32(module, part, device_type):
+    r"""Whether `module` must run `part` in float32 at this point, i.e.
+    inside a reduced-precision autocast region that does not cover `part`.
+    """
+    assert part in ALL_PARTS
+    if autocast_dtype(device_type) is None:
+        return False
+    return part in getattr(module, 'fp32_parts', FP32_PARTS)
+
+def fp32(device_type, enabled=True):
+    r"""Context that suspends autocast, so that float32 inputs give float32 outputs."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, enabled=False)
+
+def autocast(device_type, precision='fp32'):
+    r"""Context that runs the enclosed networks in the given precision:
+    'fp32' = as they are, 'bf16' / 'fp16' = with torch.autocast().
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision: {precision}')
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, dtype=PRECISIONS[precision])
+
+def set_fp32_parts(module, parts=FP32_PARTS):
+    r"""Keep `parts` of `module` and all of its submodules in float32 under
+    autocast; later calls on submodules override it for those layers.
+    """
+    parts = tuple(parts)
+    assert all(part in ALL_PARTS for part in parts), f'Unknown parts in {parts}'
+    for m in module.modules():
+        m.fp32_parts = parts
+    return module
+
+def synthesis_layers(synthesis):
+    r"""The blocks (StyleGAN2) or layers (StyleGAN3) of `synthesis` in the
+    order of the features they return.
+    """
+    if hasattr(synthesis, 'block_resolutions'):
+        return [getattr(synthesis, f'b{res}') for res in synthesis.block_resolutions]
+    return [getattr(synthesis, name) for name in synthesis.layer_names]
+
+def set_fp32_layers(synthesis, num_layers, parts=FP32_PARTS):
+    r"""Run the first `num_layers` blocks or layers of `synthesis` entirely
+    in float32 under autocast, and keep `parts` of the others in float32.
+    """
+    for idx, layer in enumerate(synthesis_layers(synthesis)):
+        set_fp32_parts(layer, tuple(parts) + (('layer',) if idx < num_layers else ()))
+    return synthesis
+
+#----------------------------------------------------------------------------
@@ -104,16 +104,20 @@ def filtered_lrelu(x, fu=None, fd=None, b=None, up=1, down=1, padding=0, gain=np
         slope:       Slope on the negative side of leaky ReLU (default: 0.2).
         clamp:       Maximum magnitude for leaky ReLU output (default: None).
         flip_filter: False = convolution, True = correlation (default: False).
-        impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+        impl:        Implementation to use. Can be `'ref'`, `'fast'`, or `'cuda'`
+                     (default: `'cuda'`). `'cuda'` falls back to `'fast'` on
+                     devices other than CUDA.
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
     """
     assert isinstance(x, torch.Tensor)
-    assert impl in ['ref', 'cuda']
+    assert impl in ['ref', 'fast', 'cuda']
     if impl == 'cuda' and x.device.type == 'cuda' and _init():
         return _filtered_lrelu_cuda(up=up, down=down, padding=padding, gain=gain, slope=slope, clamp=clamp, flip_filter=flip_filter).apply(x, fu, fd, b, None, 0, 0)
-    return _filtered_lrelu_ref(x, fu=fu, fd=fd, b=b, up=up, down=down, padding=padding, gain=gain, slope=slope, clamp=clamp, flip_filter=flip_filter)
+    if impl == 'ref':
+        return _filtered_lrelu_ref(x, fu=fu, fd=fd, b=b, up=up, down=down, padding=padding, gain=gain, slope=slope, clamp=clamp, flip_filter=flip_filter)
+    return _filtered_lrelu_fast(x, fu=fu, fd=fd, b=b, up=up, down=down, padding=padding, gain=gain, slope=slope, clamp=clamp, flip_filter=flip_filter)
 
 #----------------------------------------------------------------------------
 
@@ -272,3 +276,78 @@ def _filtered_lrelu_cuda(up=1, down=1, padding=0, gain=np.sqrt(2), slope=0.2, cl
     return FilteredLReluCuda
 
 #----------------------------------------------------------------------------
+
+class _LeakyReLUClamp(torch.autograd.Function):
+    # Leaky ReLU followed by clamp, in-place. Only the result is retained for
+    # the backward pass, which the following convolution retains anyway.
+    @staticmethod
+    def forward(ctx, x, slope, clamp): # pylint: disable=arguments-differ
+        ctx.mark_dirty(x)
+        torch.nn.functional.leaky_relu(x, negative_slope=slope, inplace=True)
+        if clamp is not None:
+            x.clamp_(-clamp, clamp)
+        ctx.save_for_backward(x)
+        ctx.slope = slope
+        ctx.clamp = clamp
+        return x
+
+    @staticmethod
+    def backward(ctx, dy): # pylint: disable=arguments-differ
+        y, = ctx.saved_tensors
+        dx = torch.ops.aten.leaky_relu_backward(dy, y, ctx.slope, True) # Single pass, differentiable.
+        if ctx.clamp is not None:
+            dx = torch.ops.aten.hardtanh_backward(dx, y, -ctx.clamp, ctx.clamp) # Zero where clamped.
+        return dx, None, None
+
+@misc.profiled_function
+def _filtered_lrelu_fast(x, fu=None, fd=None, b=None, up=1, down=1, padding=0, gain=np.sqrt(2), slope=0.2, clamp=None, flip_filter=False):
+    """Faster implementation of `filtered_lrelu()` using standard PyTorch ops, for
+    when the CUDA plugin is not available. Resamples with `upfirdn2d()` using
+    `impl='fast'`, which never materializes the zero-inserted image nor the
+    discarded pixels of the downsampling. The gain is folded into the
+    upsampling filter (lrelu(a*x) = a*lrelu(x) for a > 0), and the activation
+    and clamp run in-place on the upsampled tensor, which is retained once for
+    the backward pass instead of three times.
+    """
+    assert isinstance(x, torch.Tensor) and x.ndim == 4
+    fu_w, fu_h = _get_filter_size(fu)
+    fd_w, fd_h = _get_filter_size(fd)
+    if b is not None:
+        assert isinstance(b, torch.Tensor) and b.dtype == x.dtype
+        misc.assert_shape(b, [x.shape[1]])
+    assert isinstance(up, int) and up >= 1
+    assert isinstance(down, int) and down >= 1
+    px0, px1, py0, py1 = _parse_padding(padding)
+    assert gain == float(gain) and gain > 0
+    assert slope == float(slope) and slope >= 0
+    assert clamp is None or (clamp == float(clamp) and clamp >= 0)
+
+    # Calculate output size.
+    batch_size, channels, in_h, in_w = x.shape
+    in_dtype = x.dtype
+    out_w = (in_w * up + (px0 + px1) - (fu_w - 1) - (fd_w - 1) + (down - 1)) // down
+    out_h = (in_h * up + (py0 + py1) - (fu_h - 1) - (fd_h - 1) + (down - 1)) // down
+
+    # Upsampled intermediates stay in FP32 on CPU, where upfirdn2d() would convert them anyway.
+    if x.device.type == 'cpu' and in_dtype in [torch.float16, torch.bfloat16]:
+        x = x.to(torch.float32)
+        b = b.to(torch.float32) if b is not None else None
+
+    # Bias, upsampling with gain, leaky ReLU and clamp, downsampling.
+    if b is not None:
+        x = x + b.reshape([1, -1, 1, 1])
+    x = upfirdn2d.upfirdn2d(x=x, f=fu, up=up, padding=[px0, px1, py0, py1], gain=float(gain) * up**2, flip_filter=flip_filter, impl='fast')
+    if misc.is_compiling(): # torch.compile() fuses the activation by itself and does not support mark_dirty().
+        x = torch.nn.functional.leaky_relu(x, float(slope))
+        x = x.clamp(-float(clamp), float(clamp)) if clamp is not None else x
+    else:
+        x = _LeakyReLUClamp.apply(x, float(slope), (float(clamp) if clamp is not None else None))
+    x = upfirdn2d.upfirdn2d(x=x, f=fd, down=down, flip_filter=flip_filter, impl='fast')
+    x = x.to(in_dtype)
+
+    # Check output shape & dtype.
+    misc.assert_shape(x, [batch_size, channels, out_h, out_w])
+    assert x.dtype == in_dtype
+    return x
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,158 @@
+"""Per-layer choice between the fused and non-fused execution of modulated
+convolutions, autotuned once per configuration and persisted to disk."""
+
+import json
+import os
+import threading
+import time
+import uuid
+import warnings
+import torch
+
+from .. import misc
+
+#----------------------------------------------------------------------------
+
+enabled     = True  # Autotune unseen configurations? False = use the static heuristic.
+table_path  = None  # Where to persist the table, None = <dnnlib cache dir>/modconv_dispatch.json.
+warmup      = 1     # Untimed runs of each variant before timing.
+iters       = 2     # Timed runs of each variant; the best one counts.
+verbose     = False # Print every autotuned configuration?
+
+_table      = None  # {key: dict(fused, fused_ms, nonfused_ms)}, loaded lazily.
+_lock       = threading.RLock() # Guards loading, autotuning, and saving the table, so that every key is timed once by one thread.
+_save_failed = False
+_device_names = dict() # {device: name}, refreshed in eager mode and reused while compiling.
+
+#----------------------------------------------------------------------------
+
+def _device_name(device):
+    if device not in _device_names or not _is_tracing():
+        if device.type == 'cuda':
+            _device_names[device] = f'cuda:{torch.cuda.get_device_name(device)}'
+        else:
+            _device_names[device] = f'{device.type}:{torch.get_num_threads()}t'
+    return _device_names[device]
+
+_dtype_names = {torch.float16: 'float16', torch.bfloat16: 'bfloat16', torch.float32: 'float32', torch.float64: 'float64'}
+
+def _batch_bucket(batch_size):
+    return 1 << max(int(batch_size) - 1, 0).bit_length()
+
+def make_key(x, weight, up=1, down=1, demodulate=True, backward=False):
+    r"""Table key of one modulated convolution. Batch sizes are rounded up
+    to powers of two, so that e.g. galleries of varying size share entries.
+    """
+    _batch_size, in_channels, in_height, in_width = x.shape
+    out_channels, _, kh, kw = weight.shape[-4:]
+    return '/'.join(str(v) for v in [_device_name(x.device), _dtype_names[x.dtype], f'n{_batch_bucket(x.shape[0])}',
+        f'i{in_channels}', f'o{out_channels}', f'k{kh}x{kw}', f'r{in_height}x{in_width}', f'up{up}', f'down{down}',
+        'demod' if demodulate else 'nodemod', 'bwd' if backward else 'fwd'])
+
+def heuristic(x):
+    r"""Static choice: the fused op only pays off for single samples."""
+    return int(x.shape[0]) == 1
+
+#----------------------------------------------------------------------------
+
+def _get_table_path():
+    if table_path is not None:
+        return table_path
+    import dnnlib
+    return dnnlib.make_cache_dir_path('modconv_dispatch.json')
+
+def _read_table_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def load_table():
+    r"""The autotuned table, read from disk on first use."""
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = _read_table_file(_get_table_path())
+    return _table
+
+def _save_table():
+    global _save_failed
+    path = _get_table_path()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        merged = _read_table_file(path) # Keep entries written by other processes.
+        merged.update(_table)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path) # atomic
+    except OSError as e:
+        if not _save_failed:
+            warnings.warn(f'Cannot save the modulated conv dispatch table to "{path}": {e}')
+        _save_failed = True
+
+def reset(remove_file=False):
+    r"""Forget the table, optionally deleting it on disk as well."""
+    global _table
+    with _lock:
+        _table = None
+        if remove_file and os.path.isfile(_get_table_path()):
+            os.remove(_get_table_path())
+
+#----------------------------------------------------------------------------
+
+def _is_tracing():
+    return torch.jit.is_tracing() or torch.jit.is_scripting() or misc.is_compiling()
+
+def _time_variant(fn, inputs, device):
+    def run():
+        if len(inputs) > 0:
+            y = fn()
+            torch.autograd.grad(y, inputs, torch.ones_like(y))
+        else:
+            with torch.no_grad():
+                fn()
+    for _ in range(warmup):
+        run()
+    best = float('inf')
+    for _ in range(iters):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        t0 = time.perf_counter()
+        run()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+def should_fuse(key, x, run, grad_inputs=()):
+    r"""Return whether to execute the modulated convolution `key` as one
+    fused op. `run(fused)` executes it either way; unseen keys are
+    autotuned by timing both on the actual inputs, including the backward
+    pass w.r.t. `grad_inputs` if gradients are required. Threads that
+    meet the same unseen key wait for the one timing it.
+    """
+    entry = load_table().get(key, None)
+    if entry is not None:
+        return entry['fused']
+    if not enabled or _is_tracing():
+        return heuristic(x)
+
+    with _lock:
+        table = load_table()
+        entry = table.get(key, None) # Autotuned by another thread while we waited?
+        if entry is not None:
+            return entry['fused']
+        grad_inputs = [t for t in grad_inputs if torch.is_grad_enabled() and t.requires_grad]
+        with torch.enable_grad() if len(grad_inputs) > 0 else torch.no_grad():
+            fused_ms = _time_variant(lambda: run(True), grad_inputs, x.device)
+            nonfused_ms = _time_variant(lambda: run(False), grad_inputs, x.device)
+        table[key] = dict(fused=bool(fused_ms < nonfused_ms), fused_ms=round(fused_ms, 4), nonfused_ms=round(nonfused_ms, 4))
+        if verbose:
+            print(f'modconv_dispatch: {key}: fused {fused_ms:.2f}ms, non-fused {nonfused_ms:.2f}ms')
+        _save_table()
+        return table[key]['fused']
+
+#----------------------------------------------------------------------------
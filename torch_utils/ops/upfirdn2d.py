@@ -150,16 +150,20 @@ def upfirdn2d(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1, impl='cu
                      (default: 0).
         flip_filter: False = convolution, True = correlation (default: False).
         gain:        Overall scaling factor for signal magnitude (default: 1).
-        impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+        impl:        Implementation to use. Can be `'ref'`, `'fast'`, or `'cuda'`
+                     (default: `'cuda'`). `'cuda'` falls back to `'fast'` on
+                     devices other than CUDA.
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
     """
     assert isinstance(x, torch.Tensor)
-    assert impl in ['ref', 'cuda']
+    assert impl in ['ref', 'fast', 'cuda']
     if impl == 'cuda' and x.device.type == 'cuda' and _init():
         return _upfirdn2d_cuda(up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain).apply(x, f)
-    return _upfirdn2d_ref(x, f, up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain)
+    if impl == 'ref':
+        return _upfirdn2d_ref(x, f, up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain)
+    return _upfirdn2d_fast(x, f, up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain)
 
 #----------------------------------------------------------------------------
 
@@ -212,6 +216,84 @@ def _upfirdn2d_ref(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1):
 
 #----------------------------------------------------------------------------
 
+def _pad_or_crop(x, padx0, padx1, pady0, pady1):
+    # Like in _upfirdn2d_ref(), but without copies or views when there is nothing to do.
+    if max(padx0, padx1, pady0, pady1) > 0:
+        x = torch.nn.functional.pad(x, [max(padx0, 0), max(padx1, 0), max(pady0, 0), max(pady1, 0)])
+    if min(padx0, padx1, pady0, pady1) < 0:
+        x = x[:, :, max(-pady0, 0) : x.shape[2] - max(-pady1, 0), max(-padx0, 0) : x.shape[3] - max(-padx1, 0)]
+    return x
+
+def _upfirdn2d_fast_pass(x, f, upx, upy, downx, downy, padx0, padx1, pady0, pady1, flip_filter):
+    # Upfirdn with a 2D filter that has already been scaled by the gain.
+    # Symmetric padding and cropping is left to the convolution, which
+    # avoids copies.
+    num_channels = x.shape[1]
+    fh, fw = f.shape
+    if upx == 1 and upy == 1:
+        # Strided convolution only evaluates the pixels that are kept.
+        if not flip_filter:
+            f = f.flip([0, 1])
+        px = max(min(padx0, padx1), 0)
+        py = max(min(pady0, pady1), 0)
+        x = _pad_or_crop(x, padx0 - px, padx1 - px, pady0 - py, pady1 - py)
+        return conv2d_gradfix.conv2d(input=x, weight=f[np.newaxis, np.newaxis].repeat([num_channels, 1, 1, 1]), stride=[downy, downx], padding=[py, px], groups=num_channels)
+
+    # Transposed convolution = zero insertion followed by full convolution,
+    # but only multiplies the input pixels (polyphase decomposition).
+    if flip_filter:
+        f = f.flip([0, 1])
+    cx0, cx1, cy0, cy1 = fw - 1 - padx0, fw - upx - padx1, fh - 1 - pady0, fh - upy - pady1 # Crop of the full output.
+    cx = max(min(cx0, cx1), 0)
+    cy = max(min(cy0, cy1), 0)
+    x = conv2d_gradfix.conv_transpose2d(input=x, weight=f[np.newaxis, np.newaxis].repeat([num_channels, 1, 1, 1]), stride=[upy, upx], padding=[cy, cx], groups=num_channels)
+    x = _pad_or_crop(x, cx - cx0, cx - cx1, cy - cy0, cy - cy1)
+    if downx > 1 or downy > 1:
+        x = x[:, :, ::downy, ::downx]
+    return x
+
+@misc.profiled_function
+def _upfirdn2d_fast(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1):
+    """Faster implementation of `upfirdn2d()` using standard PyTorch ops, for
+    when the CUDA plugin is not available. Separable filters are applied one
+    axis at a time, upsampling uses transposed convolution instead of zero
+    insertion, and downsampling uses strided convolution. Matches
+    `_upfirdn2d_ref()` up to floating point rounding.
+    """
+    # Validate arguments.
+    assert isinstance(x, torch.Tensor) and x.ndim == 4
+    if f is None:
+        f = torch.ones([1, 1], dtype=torch.float32, device=x.device)
+    assert isinstance(f, torch.Tensor) and f.ndim in [1, 2]
+    assert f.dtype == torch.float32 and not f.requires_grad
+    _batch_size, _num_channels, in_height, in_width = x.shape
+    upx, upy = _parse_scaling(up)
+    downx, downy = _parse_scaling(down)
+    padx0, padx1, pady0, pady1 = _parse_padding(padding)
+
+    # Check that upsampled buffer is not smaller than the filter.
+    upW = in_width * upx + padx0 + padx1
+    upH = in_height * upy + pady0 + pady1
+    assert upW >= f.shape[-1] and upH >= f.shape[0]
+
+    # Setup filter.
+    f = f * (gain ** (f.ndim / 2))
+    in_dtype = x.dtype
+    if x.device.type == 'cpu' and in_dtype in [torch.float16, torch.bfloat16]:
+        x = x.to(torch.float32) # Depthwise convolutions are much slower in reduced precision on CPU.
+    f = f.to(x.dtype)
+
+    # Filter the rows and the columns separately if possible. Autocast must not change the dtype.
+    with torch.autocast(x.device.type, enabled=False):
+        if f.ndim == 2:
+            x = _upfirdn2d_fast_pass(x, f, upx, upy, downx, downy, padx0, padx1, pady0, pady1, flip_filter)
+        else:
+            x = _upfirdn2d_fast_pass(x, f.unsqueeze(0), upx, 1, downx, 1, padx0, padx1, 0, 0, flip_filter)
+            x = _upfirdn2d_fast_pass(x, f.unsqueeze(1), 1, upy, 1, downy, 0, 0, pady0, pady1, flip_filter)
+    return x.to(in_dtype)
+
+#----------------------------------------------------------------------------
+
 _upfirdn2d_cuda_cache = dict()
 
 def _upfirdn2d_cuda(up=1, down=1, padding=0, flip_filter=False, gain=1):
@@ -293,7 +375,7 @@ def filter2d(x, f, padding=0, flip_filter=False, gain=1, impl='cuda'):
                      (default: 0).
         flip_filter: False = convolution, True = correlation (default: False).
         gain:        Overall scaling factor for signal magnitude (default: 1).
-        impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+        impl:        Implementation to use. Can be `'ref'`, `'fast'`, or `'cuda'` (default: `'cuda'`).
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
@@ -331,7 +413,7 @@ def upsample2d(x, f, up=2, padding=0, flip_filter=False, gain=1, impl='cuda'):
                      (default: 0).
         flip_filter: False = convolution, True = correlation (default: False).
         gain:        Overall scaling factor for signal magnitude (default: 1).
-        impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+        impl:        Implementation to use. Can be `'ref'`, `'fast'`, or `'cuda'` (default: `'cuda'`).
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
@@ -370,7 +452,7 @@ def downsample2d(x, f, down=2, padding=0, flip_filter=False, gain=1, impl='cuda'
                      (default: 0).
         flip_filter: False = convolution, True = correlation (default: False).
         gain:        Overall scaling factor for signal magnitude (default: 1).
-        impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+        impl:        Implementation to use. Can be `'ref'`, `'fast'`, or `'cuda'` (default: `'cuda'`).
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
@@ -0,0 +1,293 @@
+"""Load selected entries of a pickled dict without constructing the others.
+
+Network snapshots are dicts like `dict(G=..., D=..., G_ema=...,
+augment_pipe=..., training_set_kwargs=...)`, but inference only needs
+`G_ema`. `load(f, keys=['G_ema'])` reads the pickle in two passes:
+
+1. A scan of the opcodes, which seeks over the tensor data, finds the
+   opcodes that build each value of the top-level dict.
+2. The pure-Python unpickler runs the pickle, but within the values that
+   are not wanted it replaces every large bytes object by a placeholder,
+   seeking over the tensor data where the file is not framed, and skips
+   every call (REDUCE, NEWOBJ, BUILD) that has a placeholder among its
+   arguments. This skips the tensors, and the networks built from them,
+   but still builds the strings, globals, and small objects that the
+   pickle memo may share with the wanted values; e.g. `G_ema` refers to
+   the class source and to numpy scalars of `G`.
+
+Large bytes objects, i.e. the pickled tensor data, are not kept in the memo
+either, so that each one is freed as soon as its tensor is built. If a
+wanted value refers to a placeholder or a dropped bytes object through the
+memo after all, the pickle is loaded in full instead. The same happens if the file is not
+seekable or the pickle is not a dict. Either way the result only contains
+the wanted keys.
+
+The pure-Python unpickler is about 2x slower than the C one, so it only
+runs where it saves memory: if values that are not wanted hold tensor data.
+Otherwise, e.g. for inference-only pickles that hold just `G_ema`, and for
+files that are not seekable or pickles that are not a dict, the C
+unpickler `full_unpickler` loads the pickle in full."""
+
+import io
+import itertools
+import pickle
+import pickletools
+import struct
+
+#----------------------------------------------------------------------------
+
+class _Skipped:
+    r"""Placeholder for an object that was not constructed."""
+    def __repr__(self):
+        return '<skipped>'
+
+_SKIPPED = _Skipped()
+
+class _FullLoad(Exception):
+    pass
+
+_OPS        = {op.code.encode('latin-1')[0]: op for op in pickletools.opcodes}
+_BIG_BYTES  = {'BINBYTES': '<I', 'BINBYTES8': '<Q', 'BYTEARRAY8': '<Q'}     # Data that pass 1 seeks over.
+_STRINGS    = {'SHORT_BINUNICODE', 'BINUNICODE', 'BINUNICODE8', 'UNICODE'}
+_MEMO_PUT   = {'MEMOIZE', 'PUT', 'BINPUT', 'LONG_BINPUT'}
+_MEMO_GET   = {'GET', 'BINGET', 'LONG_BINGET'}
+_MIN_DROP_BYTES = 1 << 16   # Bytes objects at least this large are not kept in the memo.
+
+#----------------------------------------------------------------------------
+
+def scan_values(f, data_ops=None):
+    r"""Scan the pickle in file object `f` from its current position without
+    unpickling it. Returns `{key: (first_op, last_op)}`: the range of opcode
+    indices that build the value of each string key of the top-level dict,
+    or None if the pickle is not a dict. Appends the opcode indices of the
+    large bytes objects to the list `data_ops`, if given.
+    """
+    stack = []      # [(first_op, str | None) | None for a mark, ...]
+    memo = dict()
+    top_is_dict = None  # Is the first object pushed a dict?
+    values = dict()
+    for index in itertools.count():
+        code = f.read(1)
+        if len(code) == 0:
+            raise EOFError
+        op = _OPS.get(code[0], None)
+        if op is None:
+            raise pickle.UnpicklingError(f'Invalid opcode {code!r}')
+        if op.name in _BIG_BYTES:
+            fmt = _BIG_BYTES[op.name]
+            length, = struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+            f.seek(length, io.SEEK_CUR)
+            arg = None
+            if data_ops is not None and length >= _MIN_DROP_BYTES:
+                data_ops.append(index)
+        else:
+            arg = op.arg.reader(f) if op.arg is not None else None
+        if op.name == 'STOP':
+            return values if top_is_dict else None
+
+        # Pop.
+        before = op.stack_before
+        if pickletools.markobject in before:
+            mark = len(stack) - 1 - stack[::-1].index(None)
+            num_below = before.index(pickletools.markobject)
+            popped = stack[mark - num_below : mark] + stack[mark + 1:]
+            del stack[mark - num_below:]
+        else:
+            popped = stack[len(stack) - len(before):]
+            del stack[len(stack) - len(before):]
+
+        # Top-level dict => record the opcodes of its values.
+        if top_is_dict and len(stack) == 0 and op.name in ('SETITEM', 'SETITEMS'):
+            items = popped[1:] + [(index, None)]
+            for (key_first, key), (value_first, _), (next_first, _) in zip(items[0::2], items[1::2], items[2::2]):
+                if isinstance(key, str):
+                    values[key] = (value_first, next_first - 1)
+
+        # Push.
+        if top_is_dict is None and len(op.stack_after) > 0:
+            top_is_dict = (op.name == 'EMPTY_DICT')
+        if op.name in _MEMO_PUT: # MEMOIZE pops and pushes the value, PUT leaves it on the stack.
+            stack.extend(popped)
+            memo[len(memo) if op.name == 'MEMOIZE' else arg] = stack[-1]
+        elif op.name in _MEMO_GET:
+            stack.append((index, memo.get(arg, (None, None))[1]))
+        elif op.name in _STRINGS:
+            stack.append((index, arg))
+        else:
+            first = min([index] + [item[0] for item in popped if item is not None])
+            stack.extend(None if item is pickletools.markobject else (first, None) for item in op.stack_after)
+
+#----------------------------------------------------------------------------
+
+def _contains_skipped(obj, incomplete):
+    if obj is _SKIPPED or id(obj) in incomplete:
+        return True
+    if isinstance(obj, (tuple, list, set, frozenset)):
+        return any(_contains_skipped(item, incomplete) for item in obj)
+    if isinstance(obj, dict):
+        return any(_contains_skipped(item, incomplete) for item in obj.values())
+    return False
+
+def _skip_big_bytes(fmt):
+    def skip(self, _load, placeholder=None):
+        length, = struct.unpack(fmt, self.read(struct.calcsize(fmt)))
+        if self._unframer.current_frame is None and self._seekable: # pylint: disable=protected-access
+            self._file.seek(length, io.SEEK_CUR) # pylint: disable=protected-access
+        else:
+            for pos in range(0, length, 1 << 20):
+                self.read(min(length - pos, 1 << 20))
+        self.stack.append(_SKIPPED if placeholder is None else placeholder(length))
+    return skip
+
+def _skip_call(num_args):
+    r"""REDUCE, NEWOBJ, NEWOBJ_EX: skip the call if any argument was skipped."""
+    def skip(self, load):
+        if _contains_skipped(self.stack[-num_args:], self._incomplete): # pylint: disable=protected-access
+            del self.stack[-num_args:]
+            self.stack.append(_SKIPPED)
+        else:
+            load(self)
+    return skip
+
+def _skip_build(self, load):
+    inst = self.stack[-2]
+    if inst is _SKIPPED:
+        self.stack.pop()
+    elif _contains_skipped(self.stack[-1], self._incomplete): # pylint: disable=protected-access
+        self.stack.pop()
+        self._incomplete.add(id(inst)) # pylint: disable=protected-access
+    else:
+        load(self)
+
+def _skip_into(num_items):
+    r"""SETITEM, APPEND: drop the items if the container was skipped."""
+    def skip(self, load):
+        if self.stack[-1 - num_items] is _SKIPPED:
+            del self.stack[-num_items:]
+        else:
+            load(self)
+    return skip
+
+def _skip_into_marked(self, load):
+    r"""SETITEMS, APPENDS, ADDITEMS: drop the items if the container was skipped."""
+    if self.metastack[-1][-1] is _SKIPPED:
+        self.pop_mark()
+    else:
+        load(self)
+
+_skip_handlers = dict(
+    REDUCE      = _skip_call(2),
+    NEWOBJ      = _skip_call(2),
+    NEWOBJ_EX   = _skip_call(3),
+    BUILD       = _skip_build,
+    SETITEM     = _skip_into(2),
+    APPEND      = _skip_into(1),
+    SETITEMS    = _skip_into_marked,
+    APPENDS     = _skip_into_marked,
+    ADDITEMS    = _skip_into_marked,
+    **{name: _skip_big_bytes(fmt) for name, fmt in _BIG_BYTES.items()},
+)
+
+def _is_data(value):
+    return isinstance(value, (bytes, bytearray)) and len(value) >= _MIN_DROP_BYTES
+
+def _memoize(self, load):
+    r"""MEMOIZE: do not keep tensor data, or the argument tuples holding it, alive once used."""
+    value = self.stack[-1]
+    if self._drop_data and (_is_data(value) or (type(value) is tuple and any(_is_data(item) for item in value))): # pylint: disable=protected-access
+        self.memo[len(self.memo)] = _SKIPPED
+    else:
+        load(self)
+
+def _make_handler(op, load):
+    skip = _skip_handlers.get(op.name, None)
+    check = op.name in _MEMO_GET
+    big = op.name in _BIG_BYTES
+    if op.name == 'MEMOIZE':
+        load = (lambda load: lambda self: _memoize(self, load))(load)
+    def handler(self):
+        self._op_index += 1 # pylint: disable=protected-access
+        ranges = self._skip_ranges # pylint: disable=protected-access
+        while len(ranges) > 0 and ranges[-1][1] < self._op_index: # pylint: disable=protected-access
+            ranges.pop()
+        if len(ranges) > 0 and ranges[-1][0] <= self._op_index: # pylint: disable=protected-access
+            if skip is not None:
+                return skip(self, load)
+        elif check:
+            load(self)
+            if _contains_skipped(self.stack[-1], self._incomplete): # pylint: disable=protected-access
+                raise _FullLoad()
+            return None
+        elif big and self.lazy_data:
+            return skip(self, load, self.data_placeholder)
+        return load(self)
+    return handler
+
+#----------------------------------------------------------------------------
+
+class SelectiveUnpickler(pickle._Unpickler): # pylint: disable=protected-access
+    r"""Unpickler that only constructs the given `keys` of a pickled dict.
+    Subclasses may override `find_class()` as with `pickle.Unpickler`, and
+    with `lazy_data`, replace the large bytes objects of the wanted values
+    by `data_placeholder(nbytes)` without reading them, e.g. to inspect
+    the shapes of tensors without loading their data. Subclasses that
+    override `find_class()` set `full_unpickler` to a `pickle.Unpickler`
+    that does the same, or to None to always unpickle selectively.
+    """
+    lazy_data = False
+    full_unpickler = pickle.Unpickler # C unpickler for pickles where nothing would be skipped.
+    dispatch = {code: _make_handler(_OPS[code], load) for code, load in pickle._Unpickler.dispatch.items() if code in _OPS} # pylint: disable=protected-access
+
+    def __init__(self, file, keys, **kwargs):
+        super().__init__(file, **kwargs)
+        self._file = file
+        self._keys = set(keys)
+        self._seekable = hasattr(file, 'seekable') and file.seekable()
+        self._skip_ranges = []  # [(first_op, last_op), ...] in decreasing order.
+        self._op_index = -1
+        self._incomplete = set() # IDs of objects whose BUILD was skipped.
+        self._drop_data = True  # Keep large bytes objects out of the memo?
+        self.num_skipped = 0    # Number of dict values not constructed, for information.
+
+    def data_placeholder(self, nbytes):
+        return _SKIPPED
+
+    def load(self):
+        values = None
+        data_ops = []
+        if self._seekable:
+            start = self._file.tell()
+            values = scan_values(self._file, data_ops)
+            self._file.seek(start)
+        if values is not None:
+            self._skip_ranges = sorted((value for key, value in values.items() if key not in self._keys), reverse=True)
+            self.num_skipped = len(self._skip_ranges)
+        skips_data = any(first <= index <= last for first, last in self._skip_ranges for index in data_ops)
+        if not skips_data and self.full_unpickler is not None and not self.lazy_data:
+            self.num_skipped = 0
+            data = self.full_unpickler(self._file, fix_imports=self.fix_imports, encoding=self.encoding, errors=self.errors, buffers=self._buffers).load()
+            return {key: value for key, value in data.items() if key in self._keys} if isinstance(data, dict) else data
+        try:
+            data = super().load()
+        except _FullLoad:
+            self._file.seek(start)
+            self._skip_ranges = []
+            self.num_skipped = 0
+            self._op_index = -1
+            self._incomplete = set()
+            self._drop_data = False
+            self.memo = dict()
+            data = super().load()
+        self.memo = dict() # Holds the pickled tensor data.
+        self._incomplete = set()
+        if isinstance(data, dict):
+            data = {key: value for key, value in data.items() if key in self._keys}
+        return data
+
+#----------------------------------------------------------------------------
+
+def load(f, keys, **kwargs):
+    r"""Load the given `keys` of the dict pickled in file object `f`."""
+    return SelectiveUnpickler(f, keys, **kwargs).load()
+
+#----------------------------------------------------------------------------
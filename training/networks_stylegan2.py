@@ -16,10 +16,12 @@ import torch
 import torch.nn.functional as F
 from torch_utils import misc
 from torch_utils import persistence
+from torch_utils import mixed_precision
 from torch_utils.ops import conv2d_resample
 from torch_utils.ops import upfirdn2d
 from torch_utils.ops import bias_act
 from torch_utils.ops import fma
+from torch_utils.ops import modconv_dispatch
 
 #----------------------------------------------------------------------------
 
@@ -41,8 +43,16 @@ def modulated_conv2d(
     resample_filter = None,     # Low-pass filter to apply when resampling activations. Must be prepared beforehand by calling upfirdn2d.setup_filter().
     demodulate      = True,     # Apply weight demodulation?
     flip_weight     = True,     # False = convolution, True = correlation (matches torch.nn.functional.conv2d).
-    fused_modconv   = True,     # Perform modulation, convolution, and demodulation as a single fused operation?
+    fused_modconv   = True,     # Perform modulation, convolution, and demodulation as a single fused operation? 'auto' = choose with modconv_dispatch.
+    fp32_demod      = False,    # Calculate the demodulation coefficients in FP32 even under autocast?
 ):
+    if fused_modconv == 'auto':
+        backward = torch.is_grad_enabled() and any(t.requires_grad for t in [x, weight, styles])
+        key = modconv_dispatch.make_key(x, weight, up=up, down=down, demodulate=demodulate, backward=backward)
+        run = lambda fused: modulated_conv2d(x=x, weight=weight, styles=styles, noise=noise, up=up, down=down, padding=padding,
+            resample_filter=resample_filter, demodulate=demodulate, flip_weight=flip_weight, fused_modconv=fused, fp32_demod=fp32_demod)
+        fused_modconv = modconv_dispatch.should_fuse(key, x, run, grad_inputs=[x, weight, styles])
+
     batch_size = x.shape[0]
     out_channels, in_channels, kh, kw = weight.shape
     misc.assert_shape(weight, [out_channels, in_channels, kh, kw]) # [OIkk]
@@ -57,11 +67,15 @@ def modulated_conv2d(
     # Calculate per-sample weights and demodulation coefficients.
     w = None
     dcoefs = None
-    if demodulate or fused_modconv:
+    if fused_modconv:
         w = weight.unsqueeze(0) # [NOIkk]
         w = w * styles.reshape(batch_size, 1, -1, 1, 1) # [NOIkk]
-    if demodulate:
+    if demodulate and fused_modconv:
         dcoefs = (w.square().sum(dim=[2,3,4]) + 1e-8).rsqrt() # [NO]
+    elif demodulate:
+        with mixed_precision.fp32(x.device.type, enabled=fp32_demod):
+            s, wt = (styles.float(), weight.float()) if fp32_demod else (styles, weight)
+            dcoefs = (s.square() @ wt.square().sum(dim=[2,3]).t() + 1e-8).rsqrt() # [NO], without materializing [NOIkk]
     if demodulate and fused_modconv:
         w = w * dcoefs.reshape(batch_size, -1, 1, 1, 1) # [NOIkk]
 
@@ -311,7 +325,8 @@ class SynthesisLayer(torch.nn.Module):
         assert noise_mode in ['random', 'const', 'none']
         in_resolution = self.resolution // self.up
         misc.assert_shape(x, [None, self.in_channels, in_resolution, in_resolution])
-        styles = self.affine(w)
+        with mixed_precision.fp32(x.device.type, enabled=mixed_precision.keep_fp32(self, 'affine', x.device.type)):
+            styles = self.affine(w)
 
         noise = None
         if self.use_noise and noise_mode == 'random':
@@ -321,7 +336,8 @@ class SynthesisLayer(torch.nn.Module):
 
         flip_weight = (self.up == 1) # slightly faster
         x = modulated_conv2d(x=x, weight=self.weight, styles=styles, noise=noise, up=self.up,
-            padding=self.padding, resample_filter=self.resample_filter, flip_weight=flip_weight, fused_modconv=fused_modconv)
+            padding=self.padding, resample_filter=self.resample_filter, flip_weight=flip_weight, fused_modconv=fused_modconv,
+            fp32_demod=mixed_precision.keep_fp32(self, 'demod', x.device.type))
 
         act_gain = self.act_gain * gain
         act_clamp = self.conv_clamp * gain if self.conv_clamp is not None else None
@@ -350,7 +366,11 @@ class ToRGBLayer(torch.nn.Module):
         self.weight_gain = 1 / np.sqrt(in_channels * (kernel_size ** 2))
 
     def forward(self, x, w, fused_modconv=True):
-        styles = self.affine(w) * self.weight_gain
+        if mixed_precision.keep_fp32(self, 'torgb', x.device.type):
+            with mixed_precision.fp32(x.device.type):
+                return self.forward(x.to(torch.float32), w, fused_modconv=fused_modconv)
+        with mixed_precision.fp32(x.device.type, enabled=mixed_precision.keep_fp32(self, 'affine', x.device.type)):
+            styles = self.affine(w) * self.weight_gain
         x = modulated_conv2d(x=x, weight=self.weight, styles=styles, demodulate=False, fused_modconv=fused_modconv)
         x = bias_act.bias_act(x, self.bias.to(x.dtype), clamp=self.conv_clamp)
         return x
@@ -374,7 +394,7 @@ class SynthesisBlock(torch.nn.Module):
         conv_clamp              = 256,          # Clamp the output of convolution layers to +-X, None = disable clamping.
         use_fp16                = False,        # Use FP16 for this block?
         fp16_channels_last      = False,        # Use channels-last memory format with FP16?
-        fused_modconv_default   = True,         # Default value of fused_modconv. 'inference_only' = True for inference, False for training.
+        fused_modconv_default   = 'auto',       # Default value of fused_modconv. 'auto' = choose per layer, 'inference_only' = 'auto' for inference, False for training.
         **layer_kwargs,                         # Arguments for SynthesisLayer.
     ):
         assert architecture in ['orig', 'skip', 'resnet']
@@ -416,15 +436,20 @@ class SynthesisBlock(torch.nn.Module):
     def forward(self, x, img, ws, force_fp32=False, fused_modconv=None, update_emas=False, **layer_kwargs):
         _ = update_emas # unused
         misc.assert_shape(ws, [None, self.num_conv + self.num_torgb, self.w_dim])
+        if mixed_precision.keep_fp32(self, 'layer', ws.device.type):
+            with mixed_precision.fp32(ws.device.type):
+                return self.forward(x, img, ws, force_fp32=force_fp32, fused_modconv=fused_modconv, update_emas=update_emas, **layer_kwargs)
         w_iter = iter(ws.unbind(dim=1))
         if ws.device.type != 'cuda':
             force_fp32 = True
         dtype = torch.float16 if self.use_fp16 and not force_fp32 else torch.float32
+        if mixed_precision.autocast_dtype(ws.device.type) is not None:
+            dtype = mixed_precision.autocast_dtype(ws.device.type) # Follow autocast, see torch_utils/mixed_precision.py.
         memory_format = torch.channels_last if self.channels_last and not force_fp32 else torch.contiguous_format
         if fused_modconv is None:
             fused_modconv = self.fused_modconv_default
         if fused_modconv == 'inference_only':
-            fused_modconv = (not self.training)
+            fused_modconv = 'auto' if not self.training else False
 
         # Input.
         if self.in_channels == 0:
@@ -449,7 +474,8 @@ class SynthesisBlock(torch.nn.Module):
         # ToRGB.
         if img is not None:
             misc.assert_shape(img, [None, self.img_channels, self.resolution // 2, self.resolution // 2])
-            img = upfirdn2d.upsample2d(img, self.resample_filter)
+            with mixed_precision.fp32(img.device.type): # The image stays in FP32.
+                img = upfirdn2d.upsample2d(img, self.resample_filter)
         if self.is_last or self.architecture == 'skip':
             y = self.torgb(x, next(w_iter), fused_modconv=fused_modconv)
             y = y.to(dtype=torch.float32, memory_format=torch.contiguous_format)
@@ -16,6 +16,7 @@ import torch
 import torch.nn.functional as F
 from torch_utils import misc
 from torch_utils import persistence
+from torch_utils import mixed_precision
 from torch_utils.ops import conv2d_gradfix
 from torch_utils.ops import filtered_lrelu
 from torch_utils.ops import bias_act
@@ -331,6 +332,9 @@ class SynthesisLayer(torch.nn.Module):
         assert noise_mode in ['random', 'const', 'none'] # unused
         misc.assert_shape(x, [None, self.in_channels, int(self.in_size[1]), int(self.in_size[0])])
         misc.assert_shape(w, [x.shape[0], self.w_dim])
+        if mixed_precision.keep_fp32(self, 'layer', x.device.type) or (self.is_torgb and mixed_precision.keep_fp32(self, 'torgb', x.device.type)):
+            with mixed_precision.fp32(x.device.type):
+                return self.forward(x.to(torch.float32), w, noise_mode=noise_mode, force_fp32=force_fp32, update_emas=update_emas)
 
         # Track input magnitude.
         if update_emas:
@@ -340,13 +344,18 @@ class SynthesisLayer(torch.nn.Module):
         input_gain = self.magnitude_ema.rsqrt()
 
         # Execute affine layer.
-        styles = self.affine(w)
+        with mixed_precision.fp32(x.device.type, enabled=mixed_precision.keep_fp32(self, 'affine', x.device.type)):
+            styles = self.affine(w)
         if self.is_torgb:
             weight_gain = 1 / np.sqrt(self.in_channels * (self.conv_kernel ** 2))
             styles = styles * weight_gain
+        if mixed_precision.keep_fp32(self, 'demod', x.device.type):
+            styles = styles.to(torch.float32) # Demodulation is elementwise, so FP32 inputs keep it in FP32.
 
         # Execute modulated conv2d.
         dtype = torch.float16 if (self.use_fp16 and not force_fp32 and x.device.type == 'cuda') else torch.float32
+        if mixed_precision.autocast_dtype(x.device.type) is not None:
+            dtype = mixed_precision.autocast_dtype(x.device.type) # Follow autocast, see torch_utils/mixed_precision.py.
         x = modulated_conv2d(x=x.to(dtype), w=self.weight, s=styles,
             padding=self.conv_kernel-1, demodulate=(not self.is_torgb), input_gain=input_gain)
 
@@ -468,7 +477,8 @@ class SynthesisNetwork(torch.nn.Module):
         ws = ws.to(torch.float32).unbind(dim=1)
 
         # Execute layers.
-        x = self.input(ws[0])
+        with mixed_precision.fp32(ws[0].device.type): # The Fourier features are sensitive to phase errors.
+            x = self.input(ws[0])
         for name, w in zip(self.layer_names, ws[1:]):
             x = getattr(self, name)(x, w, **layer_kwargs)
             features.append(x)
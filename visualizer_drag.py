@@ -23,22 +23,26 @@ from viz import pickle_widget
 from viz import latent_widget
 from viz import drag_widget
 from viz import capture_widget
+from viz import session_log
 
 #----------------------------------------------------------------------------
 
 class Visualizer(imgui_window.ImguiWindow):
-    def __init__(self, capture_dir=None):
+    def __init__(self, capture_dir=None, session_log_dir=None, renderer_kwargs={}):
         super().__init__(title='DragGAN', window_width=3840, window_height=2160)
 
         # Internals.
         self._last_error_print  = None
-        self._async_renderer    = AsyncRenderer()
+        self._async_renderer    = AsyncRenderer(renderer_kwargs=renderer_kwargs)
         self._defer_rendering   = 0
         self._tex_img           = None
         self._tex_obj           = None
         self._mask_obj          = None
         self._image_area        = None
         self._status            = dnnlib.EasyDict()
+        self._session_observer  = None
+        if session_log_dir is not None:
+            self._session_observer = session_log.RenderArgsObserver(session_log.open_session_log(session_log_dir, 'glfw'))
 
         # Widget interface.
         self.args               = dnnlib.EasyDict()
@@ -165,6 +169,8 @@ class Visualizer(imgui_window.ImguiWindow):
         elif self._defer_rendering > 0:
             self._defer_rendering -= 1
         elif self.args.pkl is not None:
+            if self._session_observer is not None:
+                self._session_observer.observe(self.args)
             self._async_renderer.set_args(**self.args)
             result = self._async_renderer.get_result()
             if result is not None:
@@ -197,11 +203,12 @@ class Visualizer(imgui_window.ImguiWindow):
             zoom = np.floor(zoom) if zoom >= 1 else zoom
             self._tex_obj.draw(pos=pos, zoom=zoom, align=0.5, rint=True)
             if self.drag_widget.show_mask and hasattr(self.drag_widget, 'mask'):
-                mask = ((1-self.drag_widget.mask.unsqueeze(-1)) * 255).to(torch.uint8)
-                if self._mask_obj is None or not self._mask_obj.is_compatible(image=self._tex_img):
-                    self._mask_obj = gl_utils.Texture(image=mask, bilinear=False, mipmap=False)
-                else:
-                    self._mask_obj.update(mask)
+                editor = self.drag_widget.mask_editor
+                dirty = editor.pop_dirty()
+                if self._mask_obj is None or not self._mask_obj.is_compatible(width=editor.width, height=editor.height, channels=1):
+                    self._mask_obj = gl_utils.Texture(image=editor.overlay(), bilinear=False, mipmap=False)
+                elif dirty is not None:
+                    self._mask_obj.update(editor.overlay(dirty), rect=dirty)
                 self._mask_obj.draw(pos=pos, zoom=zoom, align=0.5, rint=True, alpha=0.15)
 
             if self.drag_widget.mode in ['flexible', 'fixed']:
@@ -250,7 +257,8 @@ class Visualizer(imgui_window.ImguiWindow):
 #----------------------------------------------------------------------------
 
 class AsyncRenderer:
-    def __init__(self):
+    def __init__(self, renderer_kwargs={}):
+        self._renderer_kwargs = dict(renderer_kwargs) # Arguments for renderer.Renderer.
         self._closed        = False
         self._is_async      = False
         self._cur_args      = None
@@ -302,13 +310,13 @@ class AsyncRenderer:
                 multiprocessing.set_start_method('spawn')
             except RuntimeError:
                 pass
-            self._process = multiprocessing.Process(target=self._process_fn, args=(self._args_queue, self._result_queue), daemon=True)
+            self._process = multiprocessing.Process(target=self._process_fn, args=(self._args_queue, self._result_queue, self._renderer_kwargs), daemon=True)
             self._process.start()
         self._args_queue.put([args, self._cur_stamp])
 
     def _set_args_sync(self, **args):
         if self._renderer_obj is None:
-            self._renderer_obj = renderer.Renderer()
+            self._renderer_obj = renderer.Renderer(**self._renderer_kwargs)
         self._cur_result = self._renderer_obj.render(**args)
 
     def get_result(self):
@@ -327,8 +335,8 @@ class AsyncRenderer:
         self._cur_stamp += 1
 
     @staticmethod
-    def _process_fn(args_queue, result_queue):
-        renderer_obj = renderer.Renderer()
+    def _process_fn(args_queue, result_queue, renderer_kwargs={}):
+        renderer_obj = renderer.Renderer(**renderer_kwargs)
         cur_args = None
         cur_stamp = None
         while True:
@@ -345,20 +353,50 @@ class AsyncRenderer:
 
 #----------------------------------------------------------------------------
 
+# Pretrained networks listed when no pickle is given; also the default manifest of prewarm_cache.py.
+PRETRAINED_URLS = [
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqcat-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqdog-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqv2-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqwild-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-brecahad-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-celebahq-256x256.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-cifar10-32x32.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-1024x1024.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-256x256.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-512x512.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhqu-1024x1024.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhqu-256x256.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-lsundog-256x256.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-metfaces-1024x1024.pkl',
+    'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-metfacesu-1024x1024.pkl',
+]
+
+#----------------------------------------------------------------------------
+
 @click.command()
 @click.argument('pkls', metavar='PATH', nargs=-1)
 @click.option('--capture-dir', help='Where to save screenshot captures', metavar='PATH', default=None)
 @click.option('--browse-dir', help='Specify model path for the \'Browse...\' button', metavar='PATH')
+@click.option('--session-log-dir', help='Where to save an event trace of the session for replay_session.py', metavar='DIR', default=None)
+@click.option('--compile-synthesis', is_flag=True, help='Run the synthesis network through torch.compile()')
+@click.option('--precision', type=click.Choice(list(renderer.PRECISION_MODES)), default='fp32', show_default=True,
+    help='Precision of the synthesis network; the latent and the losses stay in FP32. bf16-fast also runs '
+    'the layers up to the tracked features in bf16, faster but the points drift from FP32 by about a pixel')
 def main(
     pkls,
     capture_dir,
-    browse_dir
+    browse_dir,
+    session_log_dir,
+    compile_synthesis,
+    precision
 ):
     """Interactive model visualizer.
 
     Optional PATH argument can be used specify which .pkl file to load.
     """
-    viz = Visualizer(capture_dir=capture_dir)
+    renderer_kwargs = dict(compile_synthesis=compile_synthesis, **renderer.PRECISION_MODES[precision])
+    viz = Visualizer(capture_dir=capture_dir, session_log_dir=session_log_dir, renderer_kwargs=renderer_kwargs)
 
     if browse_dir is not None:
         viz.pickle_widget.search_dirs = [browse_dir]
@@ -369,26 +407,8 @@ def main(
             viz.add_recent_pickle(pkl)
         viz.load_pickle(pkls[0])
     else:
-        pretrained = [
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqcat-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqdog-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqv2-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-afhqwild-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-brecahad-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-celebahq-256x256.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-cifar10-32x32.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-1024x1024.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-256x256.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhq-512x512.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhqu-1024x1024.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-ffhqu-256x256.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-lsundog-256x256.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-metfaces-1024x1024.pkl',
-            'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan2/versions/1/files/stylegan2-metfacesu-1024x1024.pkl'
-        ]
-
         # Populate recent pickles list with pretrained model URLs.
-        for url in pretrained:
+        for url in PRETRAINED_URLS:
             viz.add_recent_pickle(url)
 
     # Run.
@@ -1,5 +1,6 @@
 import os
 import os.path as osp
+import threading
 import time
 import uuid
 from argparse import ArgumentParser
@@ -11,10 +12,14 @@ import torch
 from PIL import Image
 
 import dnnlib
+from checkpoint_catalog import CheckpointCatalog
 from gradio_utils import (ImageMask, draw_mask_on_image, draw_points_on_image,
                           get_latest_points_pair, get_valid_mask,
-                          on_change_single_global_state)
-from viz.renderer import Renderer, add_watermark_np
+                          on_change_single_global_state, update_mask)
+from viz import metrics, renderer as renderer_module, session_log, timing, tracing
+from viz.prefetch import Prefetcher
+from viz.renderer import PRECISION_MODES, MemoryBudgetExceeded, Renderer, add_watermark_np
+from viz.seed_cache import SeedCache
 
 try:
     from openxlab.model import download
@@ -38,10 +43,80 @@ parser.add_argument('--cache-dir', type=str, default='./checkpoints')
 
 parser.add_argument('--disable-queue', action='store_true')
 parser.add_argument('--log-level', choices=['debug', 'info'])
+parser.add_argument('--timing-json',
+                    type=str,
+                    default=None,
+                    help='Dump per-checkpoint drag step timings to this JSON '
+                    'file after every drag run.')
+parser.add_argument('--metrics-port',
+                    type=int,
+                    default=None,
+                    help='Serve Prometheus metrics on this port.')
+parser.add_argument('--metrics-host', type=str, default='127.0.0.1')
+parser.add_argument('--memory-budget',
+                    type=float,
+                    default=None,
+                    help='Memory budget of all sessions in GB. Caches are '
+                    'evicted first, then new sessions are refused.')
+parser.add_argument('--session-log-dir',
+                    type=str,
+                    default=None,
+                    help='Save an event trace of every session to this '
+                    'directory, for replay with replay_session.py.')
+parser.add_argument('--compile-synthesis',
+                    action='store_true',
+                    help='Run the synthesis network through torch.compile(). '
+                    'The first steps of every checkpoint are slow while compiling.')
+parser.add_argument('--precision',
+                    choices=list(PRECISION_MODES),
+                    default='fp32',
+                    help='Precision of the synthesis network. With bf16 it runs '
+                    'under autocast, while the latent, the optimizer, and the '
+                    'losses stay in FP32. bf16-fast also runs the layers up to '
+                    'the tracked features in bf16: faster, but the handle points '
+                    'drift from FP32 by about a pixel within a few dozen steps.')
+parser.add_argument('--prefetch',
+                    nargs='*',
+                    default=[],
+                    help='Checkpoints to load in the background at startup '
+                    'and keep in memory.')
+parser.add_argument('--prefetch-max-models',
+                    type=int,
+                    default=2,
+                    help='Number of checkpoints to load in the background '
+                    'when they are likely to be switched to next, learned '
+                    'from the model switches of earlier sessions. 0 disables '
+                    'this.')
+parser.add_argument('--seed-cache-gb',
+                    type=float,
+                    default=0,
+                    help='Size of the on-disk cache of the latents and images '
+                    'of seeds in GB, filled by the sessions and by '
+                    'precompute_seeds.py, e.g. 2. Off by default.')
+parser.add_argument('--seed-cache-dir',
+                    type=str,
+                    default=None,
+                    help='Directory of the seed cache. Defaults to the dnnlib '
+                    'cache directory.')
+parser.add_argument('--trace-dir',
+                    type=str,
+                    default=None,
+                    help='Record drag steps of sampled sessions with the '
+                    'PyTorch profiler and write the traces to this directory.')
+parser.add_argument('--trace-steps',
+                    type=int,
+                    default=10,
+                    help='Number of drag steps to record per traced session.')
+parser.add_argument('--trace-fraction',
+                    type=float,
+                    default=1.0,
+                    help='Fraction of sessions to trace.')
 
 args = parser.parse_args()
 
 MAX_STEP = args.max_step
+if args.memory_budget is not None:
+    renderer_module.set_memory_budget(int(args.memory_budget * 1024**3))
 disable_queue = args.disable_queue
 LOG_LEVEL = args.log_level
 # cache_dir = args.cache_dir
@@ -52,6 +127,25 @@ def get_curr_time():
     return time.time() * 1000
 
 
+class ActiveCounter:
+    """Thread-safe gauge of the number of drag loops currently running."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self):
+        with self._lock:
+            self.value += 1
+
+    def dec(self):
+        with self._lock:
+            self.value -= 1
+
+
+active_drags = ActiveCounter()
+
+
 if is_openxlab:
     cache_dir = '/home/xlab-app-center/.cache/model'
     # os.makedirs(cache_dir, exist_ok=True)
@@ -108,12 +202,41 @@ def clear_state(global_state, target=None):
     return global_state
 
 
+def log_session_event(global_state, event, **fields):
+    """Append an event to the trace of the session if session logging is
+    enabled. The initial state shared by all sessions is never logged."""
+    if args.session_log_dir is None or isinstance(global_state, gr.State):
+        return
+    log = global_state.get('session_log', None)
+    if log is None:
+        log = session_log.open_session_log(args.session_log_dir, 'gradio')
+        global_state['session_log'] = log
+        if event != 'init':
+            # The session starts from the network of the initial state.
+            log_init_event(global_state)
+    log.log(event, **fields)
+
+
+def log_init_event(global_state):
+    log_session_event(
+        global_state,
+        'init',
+        pkl=valid_checkpoints_dict[global_state['pretrained_weight']],
+        w0_seed=global_state['params']['seed'],
+        w_plus=global_state['params']['latent_space'] == 'w+',
+        trunc_psi=global_state['params']['trunc_psi'],
+        trunc_cutoff=global_state['params']['trunc_cutoff'],
+        lr=global_state['params']['lr'],
+        img_resolution=global_state['generator_params'].get(
+            'img_resolution', None))
+
+
 def init_images(global_state):
     """This function is called only ones with Gradio App is started.
     0. pre-process global_state, unpack value from global_state of need
     1. Re-init renderer
-    2. run `renderer._render_drag_impl` with `is_drag=False` to generate
-       new image
+    2. run `renderer.render_initial_image` to generate new image, or load
+       it from the seed cache
     3. Assign images to global state and re-generate mask
     """
 
@@ -122,22 +245,24 @@ def init_images(global_state):
     else:
         state = global_state
 
-    state['renderer'].init_network(
-        state['generator_params'],  # res
-        valid_checkpoints_dict[state['pretrained_weight']],  # pkl
-        state['params']['seed'],  # w0_seed,
-        None,  # w_load
-        state['params']['latent_space'] == 'w+',  # w_plus
-        'const',
-        state['params']['trunc_psi'],  # trunc_psi,
-        state['params']['trunc_cutoff'],  # trunc_cutoff,
-        None,  # input_transform
-        state['params']['lr']  # lr,
-    )
+    try:
+        state['renderer'].init_network(
+            state['generator_params'],  # res
+            valid_checkpoints_dict[state['pretrained_weight']],  # pkl
+            state['params']['seed'],  # w0_seed,
+            None,  # w_load
+            state['params']['latent_space'] == 'w+',  # w_plus
+            'const',
+            state['params']['trunc_psi'],  # trunc_psi,
+            state['params']['trunc_cutoff'],  # trunc_cutoff,
+            None,  # input_transform
+            state['params']['lr']  # lr,
+        )
+    except MemoryBudgetExceeded as e:
+        raise gr.Error(str(e))
+    log_init_event(global_state)
 
-    state['renderer']._render_drag_impl(state['generator_params'],
-                                        is_drag=False,
-                                        to_pil=True)
+    state['renderer'].render_initial_image(state['generator_params'])
 
     init_image = state['generator_params'].image
     state['images']['image_orig'] = init_image
@@ -170,29 +295,25 @@ def preprocess_mask_info(global_state, image):
         2.2 global_state is add_mask:
     """
     if isinstance(image, dict):
-        last_mask = get_valid_mask(image['mask'])
+        sketch = image['mask']
     else:
-        last_mask = None
+        return global_state
     mask = global_state['mask']
 
     # mask in global state is a placeholder with all 1.
     if (mask == 1).all():
-        mask = last_mask
+        mask = get_valid_mask(sketch)
 
     # last_mask = global_state['last_mask']
     editing_mode = global_state['editing_state']
 
-    if last_mask is None:
-        return global_state
-
+    # Only the bounding box of the new strokes is merged into the mask.
+    updated_mask = update_mask(mask, sketch, editing_mode)
     if editing_mode == 'remove_mask':
-        updated_mask = np.clip(mask - last_mask, 0, 1)
         print_log(f'Last editing_state is {editing_mode}, do remove.')
     elif editing_mode == 'add_mask':
-        updated_mask = np.clip(mask + last_mask, 0, 1)
         print_log(f'Last editing_state is {editing_mode}, do add.')
     else:
-        updated_mask = mask
         print_log(f'Last editing_state is {editing_mode}, '
                   'do nothing to mask.')
 
@@ -201,18 +322,53 @@ def preprocess_mask_info(global_state, image):
     return global_state
 
 
-valid_checkpoints_dict = {
-    f.split('/')[-1].split('.')[0]: osp.join(cache_dir, f)
-    for f in os.listdir(cache_dir)
-    if (f.endswith('pkl') and osp.exists(osp.join(cache_dir, f)))
-}
-print(f'File under cache_dir ({cache_dir}):')
-print(os.listdir(cache_dir))
+# The catalog describes the checkpoints without loading them and only reads
+# the files that changed since the last start.
+catalog = CheckpointCatalog(cache_dir)
+print(f'Checkpoint catalog of {cache_dir}: {catalog.refresh()}')
+renderer_module.set_catalog(catalog)
+valid_checkpoints_dict = catalog.choices()  # native checkpoints win over their pickles
 print('Valid checkpoint file:')
 print(valid_checkpoints_dict)
 
+# Load the pinned and the likely next checkpoints while no drag runs.
+prefetcher = None
+if len(args.prefetch) > 0 or args.prefetch_max_models > 0:
+    prefetcher = Prefetcher(valid_checkpoints_dict,
+                            pinned=args.prefetch,
+                            max_models=args.prefetch_max_models,
+                            stats_path=osp.join(cache_dir,
+                                                'prefetch_stats.json'),
+                            is_idle=lambda: active_drags.value == 0)
+    renderer_module.set_prefetcher(prefetcher)
+    prefetcher.start()
+
+# Sessions started from a cached seed run neither the mapping nor the
+# synthesis network.
+seed_cache = None
+if args.seed_cache_gb > 0:
+    seed_cache = SeedCache(args.seed_cache_dir,
+                           max_bytes=int(args.seed_cache_gb * 1024**3),
+                           catalog=catalog)
+    renderer_module.set_seed_cache(seed_cache)
+
 init_pkl = 'stylegan2_lions_512_pytorch'
 
+
+def get_seed_gallery(global_state, max_num=100):
+    """Thumbnails of the cached seeds of the current model, as gallery items.
+    """
+    if seed_cache is None:
+        return []
+    thumbnails = seed_cache.thumbnails(
+        valid_checkpoints_dict[global_state['pretrained_weight']],
+        max_num=max_num,
+        trunc_psi=global_state['params']['trunc_psi'],
+        trunc_cutoff=global_state['params']['trunc_cutoff'],
+        noise_mode='const',
+        precision=args.precision)
+    return [(path, str(seed)) for seed, path in thumbnails]
+
 with gr.Blocks() as app:
 
     def print_log(cont, uid=None):
@@ -251,7 +407,7 @@ with gr.Blocks() as app:
         },
         "device": device,
         "draw_interval": 1,
-        "renderer": Renderer(disable_timing=True),
+        "renderer": Renderer(disable_timing=True, compile_synthesis=args.compile_synthesis, **PRECISION_MODES[args.precision]),
         "points": {},
         "curr_point": None,
         "curr_type_point": "start",
@@ -310,6 +466,13 @@ with gr.Blocks() as app:
                             interactive=True,
                             label="Seed",
                         )
+                        with gr.Accordion('Cached Seeds',
+                                          open=False,
+                                          visible=seed_cache is not None):
+                            form_seed_gallery = gr.Gallery(
+                                value=get_seed_gallery(global_state.value),
+                                show_label=False,
+                            ).style(columns=4, height='auto')
                         form_lr_number = gr.Number(
                             value=global_state.value["params"]["lr"],
                             interactive=True,
@@ -415,16 +578,24 @@ with gr.Blocks() as app:
         2. Re-init images and clear all states
         """
 
+        if prefetcher is not None:
+            prefetcher.record_switch(global_state['pretrained_weight'],
+                                     pretrained_value)
         global_state['pretrained_weight'] = pretrained_value
         init_images(global_state)
         clear_state(global_state)
+        if prefetcher is not None:
+            lookups = prefetcher.get_stats()['lookups']
+            print_log(f'Prefetch lookups: {lookups["hit"]} hits, '
+                      f'{lookups["wait"]} waited, {lookups["miss"]} misses.')
 
-        return global_state, global_state["images"]['image_show']
+        return (global_state, global_state["images"]['image_show'],
+                get_seed_gallery(global_state))
 
     form_pretrained_dropdown.change(
         on_change_pretrained_dropdown,
         inputs=[form_pretrained_dropdown, global_state],
-        outputs=[global_state, form_image])
+        outputs=[global_state, form_image, form_seed_gallery])
 
     def on_click_reset_image(global_state):
         """Reset image to the original one and clear all states
@@ -452,11 +623,26 @@ with gr.Blocks() as app:
         init_images(global_state)
         clear_state(global_state)
 
-        return global_state, global_state['images']['image_show']
+        return (global_state, global_state['images']['image_show'],
+                get_seed_gallery(global_state))
+
+    form_seed_number.change(
+        on_change_update_image_seed,
+        inputs=[form_seed_number, global_state],
+        outputs=[global_state, form_image, form_seed_gallery])
+
+    def on_select_seed_gallery(evt: gr.SelectData, global_state):
+        """Switch to the cached seed clicked in the gallery, through the
+        seed number, whose change handler loads it.
+        """
+        gallery = get_seed_gallery(global_state)
+        if evt.index >= len(gallery):
+            return gr.Number.update()
+        return gr.Number.update(value=int(gallery[evt.index][1]))
 
-    form_seed_number.change(on_change_update_image_seed,
-                            inputs=[form_seed_number, global_state],
-                            outputs=[global_state, form_image])
+    form_seed_gallery.select(on_select_seed_gallery,
+                             inputs=[global_state],
+                             outputs=[form_seed_number])
 
     def on_click_latent_space(latent_space, global_state):
         """Function to reset latent space to optimize.
@@ -490,6 +676,7 @@ with gr.Blocks() as app:
             global_state["params"]["lr"] = lr
             renderer = global_state['renderer']
             renderer.update_lr(lr)
+            log_session_event(global_state, 'lr', lr=lr)
             print_log('New optimizer: ')
             print_log(renderer.w_optim)
         return global_state
@@ -592,104 +779,152 @@ with gr.Blocks() as app:
             print_log(f'    Source: {p_in_pixels}')
             print_log(f'    Target: {t_in_pixels}')
             step_idx = 0
-            while True:
-                if global_state["temporal_params"]["stop"]:
-                    print_log('Stop Drag by STOP.', uid)
-                    break
-                if step_idx > MAX_STEP:
-                    print_log(f'Reach Max Step ({MAX_STEP}), Stop!', uid)
-                    break
-
-                # do drage here!
-                start_time = get_curr_time()
-                print_log(f'Drag step {step_idx}, start', uid)
-                renderer._render_drag_impl(
-                    global_state['generator_params'],
-                    p_to_opt,  # point
-                    t_to_opt,  # target
-                    drag_mask,  # mask,
-                    global_state['params']['motion_lambda'],  # lambda_mask
-                    reg=0,
-                    feature_idx=5,  # NOTE: do not support change for now
-                    r1=global_state['params']['r1_in_pixels'],  # r1
-                    r2=global_state['params']['r2_in_pixels'],  # r2
-                    # random_seed     = 0,
-                    # noise_mode      = 'const',
-                    trunc_psi=global_state['params']['trunc_psi'],
-                    # force_fp32      = False,
-                    # layer_name      = None,
-                    # sel_channels    = 3,
-                    # base_channel    = 0,
-                    # img_scale_db    = 0,
-                    # img_normalize   = False,
-                    # untransform     = False,
-                    is_drag=True,
-                    to_pil=True)
-                end_time = get_curr_time()
-
-                print_log(f'Drag step {step_idx}, end, time cost: '
-                          f'{end_time-start_time}', uid)
-
-                _should_stop = global_state['generator_params']['stop']
-                if _should_stop:
-                    print_log('Optimization Finish. Stop Drag.', uid)
-                    break
-
-                if step_idx % global_state['draw_interval'] == 0:
-                    # print_log('Current Source:')
-                    for key_point, p_i, t_i in zip(valid_points, p_to_opt,
-                                                   t_to_opt):
-                        global_state["points"][key_point]["start_temp"] = [
-                            p_i[1],
-                            p_i[0],
-                        ]
-                        global_state["points"][key_point]["target"] = [
-                            t_i[1],
-                            t_i[0],
-                        ]
-                        # start_temp = global_state["points"][key_point][
-                        #     "start_temp"]
-                        # print_log(f'    {start_temp}')
-
-                    image_result = global_state['generator_params']['image']
-                    image_draw = update_image_draw(
-                        image_result,
-                        global_state['points'],
-                        global_state['mask'],
-                        global_state['show_mask'],
+            try:
+                renderer.register_session()
+            except MemoryBudgetExceeded as e:
+                raise gr.Error(str(e))
+            if (args.trace_dir is not None
+                    and not global_state.get('traced', False)
+                    and tracing.sample_session(renderer.session_id,
+                                               args.trace_fraction)):
+                renderer.start_trace(args.trace_dir, args.trace_steps)
+                global_state['traced'] = True
+                print_log(f'Tracing {args.trace_steps} drag steps.', uid)
+            log_session_event(
+                global_state,
+                'drag_start',
+                points=p_to_opt,
+                targets=t_to_opt,
+                mask=session_log.encode_mask(drag_mask),
+                lambda_mask=global_state['params']['motion_lambda'],
+                reg=0,
+                feature_idx=5,
+                r1=global_state['params']['r1_in_pixels'],
+                r2=global_state['params']['r2_in_pixels'],
+                trunc_psi=global_state['params']['trunc_psi'])
+            num_steps = 0
+            stop_reason = 'aborted'
+            active_drags.inc()
+            try:
+                while True:
+                    if global_state["temporal_params"]["stop"]:
+                        print_log('Stop Drag by STOP.', uid)
+                        stop_reason = 'stopped'
+                        break
+                    if step_idx > MAX_STEP:
+                        print_log(f'Reach Max Step ({MAX_STEP}), Stop!', uid)
+                        stop_reason = 'max_step'
+                        break
+
+                    # do drage here!
+                    start_time = get_curr_time()
+                    print_log(f'Drag step {step_idx}, start', uid)
+                    renderer._render_drag_impl(
+                        global_state['generator_params'],
+                        p_to_opt,  # point
+                        t_to_opt,  # target
+                        drag_mask,  # mask,
+                        global_state['params']['motion_lambda'],  # lambda_mask
+                        reg=0,
+                        feature_idx=5,  # NOTE: do not support change for now
+                        r1=global_state['params']['r1_in_pixels'],  # r1
+                        r2=global_state['params']['r2_in_pixels'],  # r2
+                        # random_seed     = 0,
+                        # noise_mode      = 'const',
+                        trunc_psi=global_state['params']['trunc_psi'],
+                        # force_fp32      = False,
+                        # layer_name      = None,
+                        # sel_channels    = 3,
+                        # base_channel    = 0,
+                        # img_scale_db    = 0,
+                        # img_normalize   = False,
+                        # untransform     = False,
+                        is_drag=True,
+                        to_pil=True)
+                    num_steps += 1
+                    end_time = get_curr_time()
+
+                    print_log(f'Drag step {step_idx}, end, time cost: '
+                              f'{end_time-start_time}', uid)
+
+                    _should_stop = global_state['generator_params']['stop']
+                    if _should_stop:
+                        print_log('Optimization Finish. Stop Drag.', uid)
+                        stop_reason = 'converged'
+                        break
+
+                    if step_idx % global_state['draw_interval'] == 0:
+                        # print_log('Current Source:')
+                        for key_point, p_i, t_i in zip(valid_points, p_to_opt,
+                                                       t_to_opt):
+                            global_state["points"][key_point]["start_temp"] = [
+                                p_i[1],
+                                p_i[0],
+                            ]
+                            global_state["points"][key_point]["target"] = [
+                                t_i[1],
+                                t_i[0],
+                            ]
+                            # start_temp = global_state["points"][key_point][
+                            #     "start_temp"]
+                            # print_log(f'    {start_temp}')
+
+                        image_result = global_state['generator_params']['image']
+                        with renderer.timer.stage('overlay'):
+                            image_draw = update_image_draw(
+                                image_result,
+                                global_state['points'],
+                                global_state['mask'],
+                                global_state['show_mask'],
+                                global_state,
+                            )
+                        global_state['images']['image_raw'] = image_result
+
+                    stage_times = renderer.timer.end_step()
+                    if stage_times is not None:
+                        print_log(f'Drag step {step_idx}, stages: '
+                                  f'{timing.format_times(stage_times)}', uid)
+
+                    yield (
                         global_state,
+                        step_idx,
+                        global_state['images']['image_show'],
+                        # gr.File.update(visible=False),
+                        gr.Button.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        # latent space
+                        gr.Radio.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        # enable stop button in loop
+                        gr.Button.update(interactive=True),
+
+                        # update other comps
+                        gr.Dropdown.update(interactive=False),
+                        gr.Number.update(interactive=False),
+                        gr.Number.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        gr.Button.update(interactive=False),
+                        gr.Checkbox.update(interactive=False),
+                        # gr.Number.update(interactive=False),
+                        gr.Number.update(interactive=False),
                     )
-                    global_state['images']['image_raw'] = image_result
-
-                yield (
-                    global_state,
-                    step_idx,
-                    global_state['images']['image_show'],
-                    # gr.File.update(visible=False),
-                    gr.Button.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    # latent space
-                    gr.Radio.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    # enable stop button in loop
-                    gr.Button.update(interactive=True),
-
-                    # update other comps
-                    gr.Dropdown.update(interactive=False),
-                    gr.Number.update(interactive=False),
-                    gr.Number.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    gr.Button.update(interactive=False),
-                    gr.Checkbox.update(interactive=False),
-                    # gr.Number.update(interactive=False),
-                    gr.Number.update(interactive=False),
-                )
-
-                # increate step
-                step_idx += 1
+
+                    # increate step
+                    step_idx += 1
+            finally:
+                active_drags.dec()
+                log_session_event(global_state,
+                                  'drag_stop',
+                                  steps=num_steps,
+                                  reason=stop_reason)
+
+            renderer.timer.end_step()  # step that finished the drag
+            renderer.finish_trace()
+            if args.timing_json is not None:
+                timing.dump_json(args.timing_json, {uid: renderer.timer})
 
             image_result = global_state['generator_params']['image']
             global_state['images']['image_raw'] = image_result
@@ -923,6 +1158,7 @@ with gr.Blocks() as app:
 
         renderer: Renderer = global_state["renderer"]
         renderer.feat_refs = None
+        log_session_event(global_state, 'reset_points')
 
         image_raw = global_state['images']['image_raw']
         image_draw = update_image_draw(image_raw, {}, global_state['mask'],
@@ -953,6 +1189,49 @@ with gr.Blocks() as app:
                      outputs=[global_state, form_image],
                      queue=not disable_queue)
 
+    def on_app_load():
+        """Pick up checkpoints added to or removed from cache_dir."""
+        catalog.refresh()
+        choices = catalog.choices()
+        valid_checkpoints_dict.update(choices)
+        for name in set(valid_checkpoints_dict) - set(choices):
+            del valid_checkpoints_dict[name]
+        return gr.Dropdown.update(choices=list(valid_checkpoints_dict.keys()))
+
+    app.load(on_app_load, outputs=[form_pretrained_dropdown])
+
+
+
+def collect_app_metrics():
+    queue = getattr(app, '_queue', None)
+    queue_depth = len(getattr(queue, 'event_queue', []))
+    return [
+        metrics.MetricFamily('draggan_queue_depth', 'gauge',
+                             'Number of events waiting in the Gradio queue.'
+                             ).add(queue_depth),
+        metrics.MetricFamily('draggan_active_drags', 'gauge',
+                             'Number of drag loops currently running.').add(
+                                 active_drags.value),
+    ]
+
+
+if args.metrics_port is not None:
+    # Export the admission control counters before the first event.
+    metrics.inc('draggan_sessions_rejected_total', 0,
+                help='Sessions refused by admission control.')
+    metrics.inc('draggan_sessions_evicted_total', 0,
+                help='Sessions whose state was evicted.')
+    metrics.register_collector(collect_app_metrics)
+    metrics.register_collector(renderer_module.collect_metrics)
+    if prefetcher is not None:
+        metrics.register_collector(prefetcher.collect_metrics)
+    if seed_cache is not None:
+        metrics.register_collector(seed_cache.collect_metrics)
+    metrics.register_collector(timing.collect_metrics)
+    metrics.start_http_server(args.metrics_port, args.metrics_host)
+    print(f'Serving metrics on '
+          f'http://{args.metrics_host}:{args.metrics_port}/metrics')
+
 gr.close_all()
 app.queue(concurrency_count=args.concurrency_count, max_size=args.max_size)
 app.launch(share=args.share, server_name=args.host, server_port=args.port)
@@ -26,6 +26,8 @@ class CaptureWidget:
         self.dump_gui       = False
         self.defer_frames   = 0
         self.disabled_time  = 0
+        self.trace_steps    = 10
+        self.trace          = None  # Trace request passed to the renderer: dict(id, out_dir, num_steps).
 
     def dump_png(self, image):
         viz = self.viz
@@ -74,7 +76,21 @@ class CaptureWidget:
                     self.defer_frames = 2
                     self.disabled_time = 0.5
 
+                imgui.text(' ')
+                imgui.same_line(viz.label_w)
+                if imgui_utils.button('Trace', width=viz.button_w, enabled=(self.disabled_time == 0 and 'image' in viz.result)):
+                    trace_id = self.trace['id'] + 1 if self.trace is not None else 0
+                    self.trace = dict(id=trace_id, out_dir=os.path.join(self.path, 'traces'), num_steps=self.trace_steps)
+                    self.disabled_time = 0.5
+                if imgui.is_item_hovered():
+                    imgui.set_tooltip('Record the next drag steps with the PyTorch profiler')
+                imgui.same_line()
+                with imgui_utils.item_width(viz.font_size * 6):
+                    _changed, self.trace_steps = imgui.input_int('Steps', self.trace_steps)
+                    self.trace_steps = max(self.trace_steps, 1)
+
         self.disabled_time = max(self.disabled_time - viz.frame_delta, 0)
+        viz.args.trace = self.trace
         if self.defer_frames > 0:
             self.defer_frames -= 1
         elif self.dump_image:
@@ -4,6 +4,7 @@ import numpy as np
 import imgui
 import dnnlib
 from gui_utils import imgui_utils
+from viz.mask_editor import MaskEditor
 
 #----------------------------------------------------------------------------
 
@@ -20,7 +21,8 @@ class DragWidget:
         self.mode           = 'point'
         self.r_mask         = 50
         self.show_mask      = False
-        self.mask           = torch.ones(256, 256)
+        self.mask_editor    = MaskEditor(256, 256)
+        self.mask           = self.mask_editor.mask
         self.lambda_mask    = 20
         self.feature_idx    = 5
         self.r1             = 3
@@ -34,6 +36,8 @@ class DragWidget:
             self.add_point(click, x, y)
         elif down:
             self.draw_mask(x, y)
+        else:
+            self.mask_editor.end_stroke()
 
     def add_point(self, click, x, y):
         if click:
@@ -51,17 +55,14 @@ class DragWidget:
 
     def init_mask(self, w, h):
         self.width, self.height = w, h
-        self.mask = torch.ones(h, w)
+        self.mask_editor = MaskEditor(w, h)
+        self.mask = self.mask_editor.mask
 
     def draw_mask(self, x, y):
-        X = torch.linspace(0, self.width, self.width)
-        Y = torch.linspace(0, self.height, self.height)
-        yy, xx = torch.meshgrid(Y, X)
-        circle = (xx - x)**2 + (yy - y)**2 < self.r_mask**2
         if self.mode == 'flexible':
-            self.mask[circle] = 0
+            self.mask_editor.stroke_to(x, y, self.r_mask, 0)
         elif self.mode == 'fixed':
-            self.mask[circle] = 1
+            self.mask_editor.stroke_to(x, y, self.r_mask, 1)
 
     def stop_drag(self):
         self.is_drag = False
@@ -133,7 +134,7 @@ class DragWidget:
                 imgui.text(' ')
                 imgui.same_line(viz.label_w)
                 if imgui_utils.button('Reset mask', width=viz.button_w, enabled='image' in viz.result):
-                    self.mask = torch.ones(self.height, self.width)
+                    self.mask_editor.reset()
                 imgui.same_line()
                 _clicked, self.show_mask = imgui.checkbox('Show mask', self.show_mask)
 
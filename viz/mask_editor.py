@@ -0,0 +1,105 @@
+import math
+import torch
+
+#----------------------------------------------------------------------------
+
+def union_rect(a, b):
+    """Smallest rectangle `[x0, y0, x1, y1]` containing both `a` and `b`.
+    Either argument may be None (empty)."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+#----------------------------------------------------------------------------
+
+class MaskEditor:
+    """Incremental brush editor for the drag mask.
+
+    Painting stamps a cached circular brush kernel into the bounding
+    rectangle of the brush only, so the cost of a mouse event is
+    O(brush area) instead of O(image area). Successive positions within
+    one stroke are connected by interpolated stamps. Every modification is
+    accumulated into a dirty rectangle `[x0, y0, x1, y1]` (exclusive upper
+    bounds) that consumers can fetch with `pop_dirty()` to update only the
+    affected part of e.g. an OpenGL texture. The mask itself is modified
+    in-place, which also bumps the tensor version counter that `Renderer`
+    uses to decide whether its device copy is stale.
+    """
+
+    def __init__(self, width, height, fill=1):
+        self.width      = width
+        self.height     = height
+        self.mask       = torch.full([height, width], float(fill))
+        self._kernels   = dict()    # {radius: torch.Tensor, ...}
+        self._last      = None      # Last stamped position of the current stroke.
+        self._dirty     = [0, 0, width, height]
+
+    def reset(self, fill=1):
+        self.mask.fill_(float(fill))
+        self._last = None
+        self._mark_dirty([0, 0, self.width, self.height])
+
+    def _get_kernel(self, radius):
+        kernel = self._kernels.get(radius, None)
+        if kernel is None:
+            r = max(int(math.ceil(radius)), 0)
+            coords = torch.arange(-r, r + 1, dtype=torch.float32)
+            yy, xx = torch.meshgrid(coords, coords, indexing='ij')
+            kernel = (xx ** 2 + yy ** 2) < radius ** 2
+            self._kernels[radius] = kernel
+        return kernel
+
+    def _mark_dirty(self, rect):
+        self._dirty = union_rect(self._dirty, rect)
+
+    def stamp(self, x, y, radius, value):
+        """Stamp a single brush footprint centered at pixel (x, y).
+        Returns the modified rectangle, or None if it lies outside the mask."""
+        kernel = self._get_kernel(radius)
+        r = kernel.shape[0] // 2
+        x, y = int(round(x)), int(round(y))
+        x0, x1 = max(x - r, 0), min(x + r + 1, self.width)
+        y0, y1 = max(y - r, 0), min(y + r + 1, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        k = kernel[y0 - (y - r) : y1 - (y - r), x0 - (x - r) : x1 - (x - r)]
+        self.mask[y0:y1, x0:x1][k] = float(value)
+        rect = [x0, y0, x1, y1]
+        self._mark_dirty(rect)
+        return rect
+
+    def stroke_to(self, x, y, radius, value):
+        """Continue the current stroke to (x, y), filling the gap to the
+        previous position with stamps spaced at most half a radius apart."""
+        rect = None
+        if self._last is None:
+            rect = self.stamp(x, y, radius, value)
+        else:
+            lx, ly = self._last
+            dist = math.hypot(x - lx, y - ly)
+            num = max(int(math.ceil(dist / max(radius / 2, 1))), 1)
+            for i in range(1, num + 1):
+                t = i / num
+                rect = union_rect(rect, self.stamp(lx + (x - lx) * t, ly + (y - ly) * t, radius, value))
+        self._last = (x, y)
+        return rect
+
+    def end_stroke(self):
+        self._last = None
+
+    def pop_dirty(self):
+        """Return the rectangle modified since the previous call and clear it."""
+        rect, self._dirty = self._dirty, None
+        return rect
+
+    def overlay(self, rect=None):
+        """Uint8 visualization of the mask (255 = flexible area) for the given
+        rectangle, or for the whole mask if `rect` is None."""
+        if rect is None:
+            rect = [0, 0, self.width, self.height]
+        x0, y0, x1, y1 = rect
+        return ((1 - self.mask[y0:y1, x0:x1].unsqueeze(-1)) * 255).to(torch.uint8)
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,120 @@
+"""Minimal metrics registry with Prometheus text exposition.
+
+Metrics are produced by collector functions that are called on every
+scrape and return a list of `MetricFamily` objects. This keeps the hot
+paths free of bookkeeping: the drag loop only updates plain counters and
+the expensive aggregation happens when somebody actually asks for it.
+The registry can be served with `start_http_server()` or rendered with
+`generate_text()`."""
+
+import threading
+import http.server
+
+#----------------------------------------------------------------------------
+
+class MetricFamily:
+    def __init__(self, name, type, help): # pylint: disable=redefined-builtin
+        assert type in ['counter', 'gauge', 'summary', 'histogram', 'untyped']
+        self.name = name
+        self.type = type
+        self.help = help
+        self.samples = [] # [(name, {label: value}, value), ...]
+
+    def add(self, value, labels=None, suffix=''):
+        self.samples.append((self.name + suffix, dict(labels or {}), value))
+        return self
+
+#----------------------------------------------------------------------------
+# Simple process-wide counters, e.g. number of rejected sessions.
+
+_lock       = threading.Lock()
+_counters   = dict()    # {(name, ((label, value), ...)): float, ...}
+_collectors = []        # [fn() -> [MetricFamily, ...], ...]
+_help       = dict()    # {name: help, ...}
+
+def inc(name, value=1, help='', **labels): # pylint: disable=redefined-builtin
+    r"""Increment a process-wide counter."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        if help:
+            _help[name] = help
+
+def register_collector(fn):
+    r"""Register a function that returns a list of `MetricFamily` objects
+    when the metrics are scraped. Can be used as a decorator."""
+    assert callable(fn)
+    _collectors.append(fn)
+    return fn
+
+def _collect_counters():
+    with _lock:
+        items = sorted(_counters.items())
+        helps = dict(_help)
+    families = dict()
+    for (name, labels), value in items:
+        if name not in families:
+            families[name] = MetricFamily(name, 'counter', helps.get(name, ''))
+        families[name].add(value, dict(labels))
+    return list(families.values())
+
+#----------------------------------------------------------------------------
+
+def _format_value(value):
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in [float('inf'), float('-inf')]:
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+def generate_text():
+    r"""Collect all metrics and render them in the Prometheus text
+    exposition format (version 0.0.4).
+    """
+    families = _collect_counters()
+    for fn in list(_collectors):
+        try:
+            families += fn()
+        except Exception as e: # pylint: disable=broad-except
+            print(f'Metrics collector {getattr(fn, "__name__", fn)} failed: {e}')
+    lines = []
+    for family in families:
+        lines.append(f'# HELP {family.name} {family.help}')
+        lines.append(f'# TYPE {family.name} {family.type}')
+        for name, labels, value in family.samples:
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+#----------------------------------------------------------------------------
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self): # pylint: disable=invalid-name
+        if self.path.split('?')[0] not in ['/metrics', '/']:
+            self.send_error(404)
+            return
+        body = generate_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass # Do not spam stdout on every scrape.
+
+def start_http_server(port, addr='127.0.0.1'):
+    r"""Serve `/metrics` from a daemon thread. Returns the server object."""
+    server = http.server.ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,284 @@
+"""Background prefetch of the checkpoints that sessions are likely to load.
+
+`Prefetcher` loads checkpoints on a background thread, so that switching
+the model of a session finds it ready instead of loading it on the request
+path. Which checkpoints to load is decided by two policies:
+
+    pinned      Checkpoints warmed at startup and never evicted.
+    learned     Counts of model switches `{from: {to: count}}`, persisted
+                as JSON. After every switch to a model, the models most
+                often switched to from it are loaded, and at startup the
+                models most often switched to overall.
+
+At most `max_models` learned checkpoints stay resident, least recently used
+first out. Loads wait while `is_idle()` is False, e.g. while drags run,
+run one at a time at a lower OS priority, and are skipped if they would
+exceed the memory budget of the renderer. Under budget pressure, the
+learned checkpoints are dropped before the caches of any session (see
+`evict()`), so that guessed models never keep real sessions out. `Renderer.get_network()` asks the
+prefetcher before loading a checkpoint itself (see
+`viz.renderer.set_prefetcher()`) and waits for a load in progress rather
+than starting a second one. The weights of a prefetched checkpoint are
+shared with the sessions through the weight store, and a network built
+from it keeps the device copy of the weights alive."""
+
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from torch_utils import weight_store
+from viz import metrics
+from viz import renderer as renderer_module
+
+#----------------------------------------------------------------------------
+
+class SwitchStats:
+    r"""Counts of model switches `{from_name: {to_name: count}}`, saved
+    to `path` (if given) after every switch.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._switches = dict()
+        try:
+            with open(path) as f:
+                self._switches = json.load(f)['switches']
+        except (TypeError, OSError, ValueError, KeyError):
+            pass
+
+    def record(self, old_name, new_name):
+        with self._lock:
+            counts = self._switches.setdefault(old_name, dict())
+            counts[new_name] = counts.get(new_name, 0) + 1
+            switches = json.dumps(dict(switches=self._switches), indent=1, sort_keys=True)
+        if self.path is not None:
+            try:
+                temp_path = f'{self.path}.{uuid.uuid4().hex}.tmp'
+                with open(temp_path, 'w') as f:
+                    f.write(switches)
+                os.replace(temp_path, self.path) # atomic
+            except OSError:
+                pass
+
+    def predict(self, name=None, num=1):
+        r"""The `num` models most often switched to from `name`, followed by
+        the most often switched to overall. Overall only if `name` is None.
+        """
+        with self._lock:
+            popular = collections.Counter()
+            for counts in self._switches.values():
+                popular.update(counts)
+            after = collections.Counter(self._switches.get(name, dict())) if name is not None else collections.Counter()
+        names = [n for n, _count in after.most_common()] + [n for n, _count in popular.most_common()]
+        return [n for n in dict.fromkeys(names) if n != name][:num]
+
+#----------------------------------------------------------------------------
+
+class Prefetcher:
+    def __init__(self, choices, device='cuda', pinned=(), max_models=2, stats_path=None, is_idle=None, poll_interval=0.1):
+        self.choices        = choices       # {name: pkl, ...}, may change while running.
+        self.device         = device
+        self.pinned         = list(pinned)
+        self.max_models     = max_models    # Learned checkpoints kept resident.
+        self.stats          = SwitchStats(stats_path)
+        self.is_idle        = is_idle if is_idle is not None else (lambda: True)
+        self.poll_interval  = poll_interval
+        self._cond          = threading.Condition()
+        self._queue         = []            # [(pkl, pinned), ...]
+        self._entries       = collections.OrderedDict() # {pkl: dict(ready, data, net, pinned, sha256), ...} in LRU order.
+        self._lookups       = dict(hit=0, wait=0, miss=0)
+        self._loads         = dict(loaded=0, failed=0, skipped=0)
+        self._evicted       = 0             # Learned checkpoints dropped under budget pressure.
+        self._thread        = None
+        self._stopping      = False
+
+    def start(self):
+        r"""Start the background thread and warm the pinned checkpoints and
+        the most popular learned ones.
+        """
+        for name in self.pinned:
+            self.prefetch(name, pinned=True)
+        for name in self.stats.predict(None, self.max_models):
+            self.prefetch(name)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=60):
+        r"""Stop the background thread after the load in progress, if any.
+        Runs at exit, since a daemon thread killed while running PyTorch
+        code can abort the process.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def prefetch(self, name, pinned=False):
+        r"""Queue checkpoint `name` for loading."""
+        pkl = self.choices.get(name, None)
+        if pkl is None:
+            return
+        with self._cond:
+            entry = self._entries.get(pkl, None)
+            if entry is not None:
+                entry['pinned'] = entry['pinned'] or pinned
+                return
+            if all(queued != pkl for queued, _pinned in self._queue):
+                self._queue.append((pkl, pinned))
+                self._cond.notify()
+
+    def record_switch(self, old_name, new_name):
+        r"""Learn from a session switching models, and queue the models
+        most likely to be switched to next.
+        """
+        if old_name == new_name:
+            return
+        self.stats.record(old_name, new_name)
+        for name in self.stats.predict(new_name, self.max_models):
+            self.prefetch(name)
+
+    def lookup(self, pkl, key):
+        r"""Loaded data of checkpoint `pkl` as `viz.renderer.load_pkl_data()`
+        returns it, or None if it was not prefetched. Waits if it is being
+        loaded.
+        """
+        with self._cond:
+            entry = self._entries.get(pkl, None)
+            result = 'miss' if entry is None else ('hit' if entry['ready'].is_set() else 'wait')
+            self._lookups[result] += 1
+        if entry is None:
+            return None
+        entry['ready'].wait()
+        data = entry['data']
+        catalog = renderer_module.get_catalog()
+        catalog_entry = catalog.lookup(pkl) if catalog is not None else None
+        if catalog_entry is not None and catalog_entry['sha256'] != entry['sha256']:
+            self._drop(pkl, entry) # The file has changed since it was prefetched.
+            return None
+        if data is None or (isinstance(data, dict) and key not in data):
+            return None
+        with self._cond:
+            if pkl in self._entries:
+                self._entries.move_to_end(pkl)
+        return data
+
+    def _drop(self, pkl, entry):
+        with self._cond:
+            if self._entries.get(pkl, None) is entry:
+                del self._entries[pkl]
+
+    def _fits(self, pkl):
+        budget = renderer_module.get_memory_budget()
+        if budget is None:
+            return True
+        catalog = renderer_module.get_catalog()
+        entry = catalog.lookup(pkl) if catalog is not None else None
+        incoming = entry['param_bytes'] * (1 if str(self.device) == 'cpu' else 2) if entry is not None else 0
+        return renderer_module.get_total_memory_usage() + incoming <= budget # Only loads into free memory.
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10) # This thread only, on Linux.
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._cond:
+                while len(self._queue) == 0 and not self._stopping:
+                    self._cond.wait()
+            while not self.is_idle() and not self._stopping:
+                time.sleep(self.poll_interval)
+            with self._cond:
+                if self._stopping:
+                    return
+                if len(self._queue) == 0:
+                    continue
+                pkl, pinned = self._queue.pop(0)
+                if pkl in self._entries:
+                    continue
+                if not self._fits(pkl):
+                    self._loads['skipped'] += 1
+                    continue
+                entry = dict(ready=threading.Event(), data=None, net=None, pinned=pinned, sha256=None)
+                self._entries[pkl] = entry
+            self._load(pkl, entry)
+            del entry # Lets evict() free the checkpoint while this thread waits.
+            self._evict()
+
+    def _load(self, pkl, entry):
+        catalog = renderer_module.get_catalog()
+        catalog_entry = catalog.lookup(pkl) if catalog is not None else None
+        entry['sha256'] = catalog_entry['sha256'] if catalog_entry is not None else None
+        t0 = time.time()
+        try:
+            data = renderer_module.load_pkl_data(pkl, 'G_ema')
+            entry['net'] = renderer_module.build_network(data, pkl, 'G_ema', self.device) # Keeps the device weights alive.
+            entry['data'] = data
+            self._loads['loaded'] += 1
+            print(f'Prefetched "{pkl}" in {time.time() - t0:.1f}s.')
+        except:
+            self._loads['failed'] += 1
+            print(f'Prefetching "{pkl}" failed:')
+            traceback.print_exc()
+            self._drop(pkl, entry)
+        entry['ready'].set()
+
+    def _evict(self):
+        with self._cond:
+            learned = [pkl for pkl, entry in self._entries.items() if not entry['pinned'] and entry['ready'].is_set()]
+            for pkl in learned[:max(len(learned) - self.max_models, 0)]:
+                del self._entries[pkl]
+
+    def evict(self, num_bytes):
+        r"""Drop learned checkpoints, least recently used first, until
+        `num_bytes` bytes are freed or none are left. Called by
+        `viz.renderer.enforce_memory_budget()` before it evicts sessions.
+        Counts only the weights whose last reference goes away, since
+        sessions may use them as well. Returns the number of bytes freed.
+        """
+        freed = 0
+        store_bytes = weight_store.get_stats()['bytes_live']
+        while freed < num_bytes:
+            with self._cond:
+                learned = [pkl for pkl, entry in self._entries.items() if not entry['pinned'] and entry['ready'].is_set()]
+                if len(learned) == 0:
+                    break
+                del self._entries[learned[0]]
+                self._evicted += 1
+            new_store_bytes = weight_store.get_stats()['bytes_live']
+            freed += max(store_bytes - new_store_bytes, 0)
+            store_bytes = new_store_bytes
+        return freed
+
+    def get_stats(self):
+        r"""Lookups by result, loads by result, evicted and resident checkpoints."""
+        with self._cond:
+            return dict(lookups=dict(self._lookups), loads=dict(self._loads), evicted=self._evicted,
+                resident=[pkl for pkl, entry in self._entries.items() if entry['ready'].is_set()])
+
+    def collect_metrics(self):
+        r"""Metrics collector for `viz.metrics.register_collector()`."""
+        stats = self.get_stats()
+        lookups = metrics.MetricFamily('draggan_prefetch_lookups_total', 'counter', 'Checkpoint loads that asked the prefetcher, by result.')
+        for result, num in stats['lookups'].items():
+            lookups.add(num, dict(result=result))
+        total = sum(stats['lookups'].values())
+        hit_rate = metrics.MetricFamily('draggan_prefetch_hit_ratio', 'gauge', 'Fraction of checkpoint loads served by the prefetcher, ready or in progress.')
+        hit_rate.add((stats['lookups']['hit'] + stats['lookups']['wait']) / total if total > 0 else float('nan'))
+        loads = metrics.MetricFamily('draggan_prefetch_loads_total', 'counter', 'Background checkpoint loads, by result.')
+        for result, num in stats['loads'].items():
+            loads.add(num, dict(result=result))
+        evicted = metrics.MetricFamily('draggan_prefetch_evicted_total', 'counter', 'Prefetched checkpoints dropped under memory budget pressure.')
+        evicted.add(stats['evicted'])
+        resident = metrics.MetricFamily('draggan_prefetch_resident', 'gauge', 'Number of prefetched checkpoints in memory.')
+        resident.add(len(stats['resident']))
+        return [lookups, hit_rate, loads, evicted, resident]
+
+#----------------------------------------------------------------------------
@@ -7,10 +7,17 @@
 # license agreement from NVIDIA CORPORATION is strictly prohibited.
 
 from socket import has_dualstack_ipv6
+import os
 import sys
 import copy
+import importlib
 import traceback
 import math
+import threading
+import time
+import uuid
+import warnings
+import weakref
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import torch
@@ -19,8 +26,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 import matplotlib.cm
 import dnnlib
+from torch_utils import compiled_synthesis
+from torch_utils import mixed_precision
+from torch_utils import persistence
+from torch_utils import quantization
+from torch_utils import weight_store
 from torch_utils.ops import upfirdn2d
 import legacy # pylint: disable=import-error
+import native_checkpoint # pylint: disable=import-error
+from viz.timing import StageTimer
+from viz.tracing import DragTracer
+from viz import metrics
 
 #----------------------------------------------------------------------------
 
@@ -45,6 +61,11 @@ class CaptureSuccess(Exception):
 
 #----------------------------------------------------------------------------
 
+class MemoryBudgetExceeded(Exception):
+    pass
+
+#----------------------------------------------------------------------------
+
 def add_watermark_np(input_image_array, watermark_text="AI Generated"):
     image = Image.fromarray(np.uint8(input_image_array)).convert("RGBA")
 
@@ -65,21 +86,247 @@ def add_watermark_np(input_image_array, watermark_text="AI Generated"):
     watermarked_array = np.array(watermarked)
     return watermarked_array
 
+#----------------------------------------------------------------------------
+# Process-wide bookkeeping for the metrics endpoint.
+
+_live_renderers = weakref.WeakSet()         # Renderers that have initialized a network.
+_cache_requests = dict(hit=0, miss=0)       # Lookups of Renderer._pkl_data.
+
+def _tensor_bytes(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size() if not weight_store.is_shared(obj) else 0 # Counted once for all sessions.
+    if isinstance(obj, torch.nn.Module):
+        return _tensor_bytes(list(obj.state_dict(keep_vars=True).values()))
+    if isinstance(obj, dict):
+        return sum(_tensor_bytes(v) for v in list(obj.values()))
+    if isinstance(obj, (list, tuple)):
+        return sum(_tensor_bytes(v) for v in obj)
+    return 0
+
+def collect_metrics():
+    r"""Metrics collector for `viz.metrics.register_collector()`."""
+    renderers = list(_live_renderers)
+    sessions = metrics.MetricFamily('draggan_sessions', 'gauge', 'Number of live renderer sessions.').add(len(renderers))
+    memory = metrics.MetricFamily('draggan_session_memory_bytes', 'gauge', 'Bytes held by the tensors of each session.')
+    resident = metrics.MetricFamily('draggan_model_cache_resident', 'gauge', 'Number of sessions holding each checkpoint in memory.')
+    counts = dict()
+    for renderer in renderers:
+        for component, nbytes in renderer.get_memory_usage().items():
+            memory.add(nbytes, dict(session=renderer.session_id, component=component))
+        for pkl in list(renderer._pkl_data.keys()): # pylint: disable=protected-access
+            name = os.path.splitext(os.path.basename(pkl))[0]
+            counts[name] = counts.get(name, 0) + 1
+    for name, num in counts.items():
+        resident.add(num, dict(checkpoint=name))
+    requests = metrics.MetricFamily('draggan_model_cache_requests_total', 'counter', 'Model cache lookups by result.')
+    for result, num in list(_cache_requests.items()):
+        requests.add(num, dict(result=result))
+    total = sum(_cache_requests.values())
+    hit_rate = metrics.MetricFamily('draggan_model_cache_hit_ratio', 'gauge', 'Fraction of model cache lookups that were hits.')
+    hit_rate.add(_cache_requests['hit'] / total if total > 0 else float('nan'))
+    store_stats = weight_store.get_stats()
+    total = metrics.MetricFamily('draggan_memory_usage_bytes', 'gauge', 'Bytes held by the tensors of all live sessions, including their shared weights.')
+    total.add(get_total_memory_usage())
+    store = metrics.MetricFamily('draggan_weight_store_bytes', 'gauge', 'Bytes held by the network weights shared between sessions.')
+    store.add(store_stats['bytes_live'])
+    deduped = metrics.MetricFamily('draggan_weight_store_shared_bytes_total', 'counter', 'Bytes of network weights served from the weight store instead of copied.')
+    deduped.add(store_stats['bytes_shared'])
+    budget = metrics.MetricFamily('draggan_memory_budget_bytes', 'gauge', 'Memory budget of all live sessions.')
+    budget.add(_memory_budget if _memory_budget is not None else float('inf'))
+    stats = persistence.get_stats()
+    modules = metrics.MetricFamily('draggan_persistence_modules_total', 'counter', 'Modules imported from network pickles, by origin of their bytecode.')
+    for origin in ['compiled', 'cached', 'shared']:
+        modules.add(stats[f'modules_{origin}'], dict(origin=origin))
+    unpickle = metrics.MetricFamily('draggan_persistence_seconds_total', 'counter', 'Time spent unpickling persistent objects, including their modules.')
+    unpickle.add(stats['unpickle_time'])
+    return [sessions, memory, resident, requests, hit_rate, total, store, deduped, budget, modules, unpickle]
+
+def format_persistence_stats(stats0, stats1):
+    r"""Describe the work done by `torch_utils.persistence` between two
+    `persistence.get_stats()` snapshots.
+    """
+    delta = {key: stats1[key] - stats0[key] for key in stats1}
+    return (f'persistence {delta["unpickle_time"]:.2f}s: {delta["modules_compiled"]} modules compiled '
+        f'({delta["compile_time"]:.3f}s), {delta["modules_cached"]} from cache, {delta["modules_shared"]} shared, '
+        f'executed in {delta["exec_time"]:.2f}s')
+
+#----------------------------------------------------------------------------
+# Checkpoint catalog (see checkpoint_catalog.py), if the app has one. It
+# tells the architecture of checkpoints whose names do not, the memory that
+# sessions for checkpoints without a live session are expected to hold, and
+# when a checkpoint file changes.
+
+_catalog = None
+
+def set_catalog(catalog):
+    global _catalog
+    _catalog = catalog
+
+def get_catalog():
+    return _catalog
+
+#----------------------------------------------------------------------------
+# Seed cache (see viz/seed_cache.py), if the app has one. Sessions started
+# from a cached seed skip the mapping network and, for the initial image,
+# the synthesis network.
+
+_seed_cache = None
+
+def set_seed_cache(seed_cache):
+    global _seed_cache
+    _seed_cache = seed_cache
+
+def get_seed_cache():
+    return _seed_cache
+
+#----------------------------------------------------------------------------
+# Precision modes of the frontends, as Renderer kwargs. 'bf16' keeps the
+# synthesis layers up to the tracked features in FP32, so that the handle
+# points and the latent follow an FP32 drag and only the image differs.
+# 'bf16-fast' runs them in bfloat16 as well: faster, but the tracked points
+# drift from FP32 by a pixel or so within a few dozen steps.
+
+PRECISION_MODES = {
+    'fp32':         dict(precision='fp32'),
+    'bf16':         dict(precision='bf16'),
+    'bf16-fast':    dict(precision='bf16', fp32_features=False),
+}
+
+#----------------------------------------------------------------------------
+# Process-wide memory budget. When the sessions together hold more than the
+# budget, the checkpoints loaded speculatively by the prefetcher are dropped
+# first, then the recomputable caches of the least recently used sessions.
+# If that is not enough, new sessions are refused.
+
+_memory_budget  = None              # Bytes, None = unlimited.
+_budget_lock    = threading.Lock()
+
+def set_memory_budget(nbytes):
+    global _memory_budget
+    _memory_budget = nbytes
+
+def get_memory_budget():
+    return _memory_budget
+
+def estimate_session_memory(pkl):
+    r"""Bytes that a new session for `pkl` is expected to hold, based on
+    the live sessions that use the same checkpoint, or else on the
+    checkpoint catalog. 0 if unknown.
+    """
+    usages = [sum(renderer.get_memory_usage().values()) for renderer in list(_live_renderers) if getattr(renderer, 'pkl', None) == pkl]
+    entry = _catalog.lookup(pkl) if _catalog is not None else None
+    return max(usages, default=entry['est_session_bytes'] if entry is not None else 0)
+
+def get_total_memory_usage():
+    r"""Bytes held by all live sessions, including their shared weights."""
+    return weight_store.get_stats()['bytes_live'] + sum(sum(renderer.get_memory_usage().values()) for renderer in list(_live_renderers))
+
+def enforce_memory_budget(incoming=0):
+    r"""Drop prefetched checkpoints, then evict caches of the least recently
+    used sessions, until the live sessions plus `incoming` bytes fit into
+    the budget. Returns False if they still do not fit.
+    """
+    if _memory_budget is None:
+        return True
+    with _budget_lock:
+        renderers = sorted(list(_live_renderers), key=lambda renderer: renderer._last_used) # pylint: disable=protected-access
+        total = incoming + weight_store.get_stats()['bytes_live'] + sum(sum(renderer.get_memory_usage().values()) for renderer in renderers)
+        if total > _memory_budget and _prefetcher is not None:
+            total -= _prefetcher.evict(total - _memory_budget)
+        for renderer in renderers:
+            if total <= _memory_budget:
+                break
+            freed = renderer.evict_caches()
+            if freed > 0:
+                total -= freed
+                metrics.inc('draggan_sessions_evicted_total', help='Sessions whose state was evicted.')
+        return total <= _memory_budget
+
+#----------------------------------------------------------------------------
+# Loading checkpoints, shared by `Renderer.get_network()` and the prefetcher
+# (see viz/prefetch.py), if the app has one.
+
+_prefetcher = None
+
+def set_prefetcher(prefetcher):
+    global _prefetcher
+    _prefetcher = prefetcher
+
+def get_prefetcher():
+    return _prefetcher
+
+def load_pkl_data(pkl, key):
+    r"""Load network `key` of checkpoint `pkl`: the header of a native
+    checkpoint, or the `{key: network}` dict of a pickle, whose weights go
+    into the weight store.
+    """
+    if native_checkpoint.is_native(pkl):
+        return native_checkpoint.NativeCheckpoint(pkl) # Only reads the header.
+    with dnnlib.util.open_url(pkl, verbose=False) as f:
+        data = legacy.load_network_pkl(f, keys=[key]) # Does not construct the other networks.
+    for value in data.values():
+        if isinstance(value, torch.nn.Module):
+            weight_store.share(value) # One copy for all sessions and checkpoints with the same weights.
+    return data
+
+def build_network(data, pkl, key, device):
+    r"""Construct network `key` with the current code from the result of
+    `load_pkl_data()`. Its weights are read-only views into the weight
+    store; the drag only optimizes the latent.
+    """
+    if isinstance(data, native_checkpoint.NativeCheckpoint):
+        return weight_store.share(data.build(key, device='cpu'), device=device) # Mapped tensors on the CPU.
+    entry = _catalog.lookup(pkl) if _catalog is not None else None
+    orig_net = data[key]  # this is a state dict
+    module_name, class_name, extra_kwargs = native_checkpoint.infer_generator_class(entry['arch'] if entry is not None else pkl)
+    Generator = getattr(importlib.import_module(module_name), class_name)
+    print(orig_net.init_args)
+    print(orig_net.init_kwargs)
+    net = Generator(*orig_net.init_args, **orig_net.init_kwargs, **extra_kwargs)
+    if quantization.is_quantized(orig_net):
+        quantization.quantize(net, names=quantization.quantized_names(orig_net))
+    return weight_store.share_from(net, orig_net, device=device)
+
 #----------------------------------------------------------------------------
 
 class Renderer:
-    def __init__(self, disable_timing=False):
-        self._device        = torch.device('cuda')
+    def __init__(self, disable_timing=False, device='cuda', stage_timing=True, compile_synthesis=False,
+        precision='fp32', fp32_parts=mixed_precision.FP32_PARTS, fp32_features=True):
+        if precision not in mixed_precision.PRECISIONS:
+            raise ValueError(f'Unknown precision: {precision}')
+        self._device        = torch.device(device)
+        self._compile_synthesis = compile_synthesis # Run G.synthesis through torch.compile()?
+        self._precision     = precision # Synthesis precision: 'fp32', 'bf16', or 'fp16'. The latent, optimizer, and losses stay in FP32.
+        self._fp32_parts    = tuple(fp32_parts) # Parts of the synthesis network kept in FP32 under 'bf16' / 'fp16', see torch_utils/mixed_precision.py.
+        self._fp32_features = fp32_features # Run the synthesis layers up to the tracked features in FP32 under 'bf16' / 'fp16'?
+        self._fp32_layers   = 0         # Leading synthesis layers that currently run entirely in FP32.
+        self._fp32_fallback = set()     # {(pkl, feature_idx), ...} warned to run in plain FP32.
         self._pkl_data      = dict()    # {pkl: dict | CapturedException, ...}
+        self._pkl_hashes    = dict()    # {pkl: sha256 in the catalog when loaded, ...}
         self._networks      = dict()    # {cache_key: torch.nn.Module, ...}
         self._pinned_bufs   = dict()    # {(shape, dtype): torch.Tensor, ...}
         self._cmaps         = dict()    # {name: torch.Tensor, ...}
         self._is_timing     = False
+        if self._device.type != 'cuda':
+            disable_timing = True
         if not disable_timing:
             self._start_event   = torch.cuda.Event(enable_timing=True)
             self._end_event     = torch.cuda.Event(enable_timing=True)
         self._disable_timing = disable_timing
         self._net_layers    = dict()    # {cache_key: [dnnlib.EasyDict, ...], ...}
+        self._mask_src      = None      # Mask tensor that _mask_usq was derived from.
+        self._mask_version  = None
+        self._mask_usq      = None
+        self.timer          = StageTimer(self._device, enabled=stage_timing)
+        self._trace_id      = None      # Id of the last trace request passed to render().
+        self._last_used     = time.time()
+
+    @property
+    def precision_mode(self):
+        r"""Name of the precision of this renderer in `PRECISION_MODES`."""
+        if self._precision != 'fp32' and not self._fp32_features:
+            return f'{self._precision}-fast'
+        return self._precision
 
     def render(self, **args):
         if self._disable_timing:
@@ -88,6 +335,10 @@ class Renderer:
             self._start_event.record(torch.cuda.current_stream(self._device))
             self._is_timing = True
         res = dnnlib.EasyDict()
+        trace = args.get('trace', None)
+        if trace is not None and trace['id'] != self._trace_id:
+            self._trace_id = trace['id']
+            self.start_trace(trace['out_dir'], trace['num_steps'])
         try:
             init_net = False
             if not hasattr(self, 'G'):
@@ -115,8 +366,10 @@ class Renderer:
         if not self._disable_timing:
             self._end_event.record(torch.cuda.current_stream(self._device))
         if 'image' in res:
-            res.image = self.to_cpu(res.image).detach().numpy()
-            res.image = add_watermark_np(res.image, 'AI Generated')
+            with self.timer.stage('to_cpu'):
+                res.image = self.to_cpu(res.image).detach().numpy()
+            with self.timer.stage('overlay'):
+                res.image = add_watermark_np(res.image, 'AI Generated')
         if 'stats' in res:
             res.stats = self.to_cpu(res.stats).detach().numpy()
         if 'error' in res:
@@ -127,16 +380,33 @@ class Renderer:
             self._end_event.synchronize()
             res.render_time = self._start_event.elapsed_time(self._end_event) * 1e-3
             self._is_timing = False
+        if self.timer.in_step:
+            res.stage_times = self.timer.end_step()
         return res
 
     def get_network(self, pkl, key, **tweak_kwargs):
+        entry = _catalog.lookup(pkl) if _catalog is not None else None
+        if entry is not None and self._pkl_hashes.get(pkl, entry['sha256']) != entry['sha256']:
+            self._pkl_data.pop(pkl, None) # The file has changed since it was loaded.
+            self._networks = {k: v for k, v in self._networks.items() if k[0] != pkl}
+        if entry is not None:
+            self._pkl_hashes[pkl] = entry['sha256']
         data = self._pkl_data.get(pkl, None)
+        if isinstance(data, dict) and key not in data:
+            data = None # Loaded before, but without this network.
+        _cache_requests['miss' if data is None else 'hit'] += 1
+        if data is None and _prefetcher is not None:
+            data = _prefetcher.lookup(pkl, key) # Waits if the checkpoint is being prefetched.
+            if data is not None:
+                self._pkl_data[pkl] = data
         if data is None:
             print(f'Loading "{pkl}"... ', end='', flush=True)
             try:
-                with dnnlib.util.open_url(pkl, verbose=False) as f:
-                    data = legacy.load_network_pkl(f)
-                print('Done.')
+                stats0 = persistence.get_stats()
+                data = load_pkl_data(pkl, key)
+                if isinstance(data, dict):
+                    data.update({k: v for k, v in self._pkl_data.get(pkl, dict()).items() if k not in data})
+                print(f'Done ({format_persistence_stats(stats0, persistence.get_stats())}).')
             except:
                 data = CapturedException()
                 print('Failed!')
@@ -145,28 +415,11 @@ class Renderer:
         if isinstance(data, CapturedException):
             raise data
 
-        orig_net = data[key]  # this is a state dict
-        cache_key = (orig_net, self._device, tuple(sorted(tweak_kwargs.items())))
+        cache_key = (pkl, key, self._device, tuple(sorted(tweak_kwargs.items())))
         net = self._networks.get(cache_key, None)
         if net is None:
             try:
-                if 'stylegan2' in pkl:
-                    from training.networks_stylegan2 import Generator
-                elif 'stylegan3' in pkl:
-                    from training.networks_stylegan3 import Generator
-                elif 'stylegan_human' in pkl:
-                    from stylegan_human.training_scripts.sg2.training.networks import Generator
-                else:
-                    raise NameError('Cannot infer model type from pkl name!')
-
-                print(data[key].init_args)
-                print(data[key].init_kwargs)
-                if 'stylegan_human' in pkl:
-                    net = Generator(*data[key].init_args, **data[key].init_kwargs, square=False, padding=True)
-                else:
-                    net = Generator(*data[key].init_args, **data[key].init_kwargs)
-                net.load_state_dict(data[key].state_dict())
-                net.to(self._device)
+                net = build_network(data, pkl, key, self._device)
             except:
                 net = CapturedException()
             # self._networks[cache_key] = net  # --> do not cache
@@ -175,11 +428,21 @@ class Renderer:
             raise net
         return net
 
+    def add_pkl_data(self, pkl, data):
+        r"""Make `get_network()` use the given `{key: network}` dict for `pkl`
+        instead of loading it, e.g. for randomly initialized networks. The
+        networks must be persistent classes, and `pkl` must name the
+        architecture like a real checkpoint would.
+        """
+        self._pkl_data[pkl] = data
+
     def _get_pinned_buf(self, ref):
         key = (tuple(ref.shape), ref.dtype)
         buf = self._pinned_bufs.get(key, None)
         if buf is None:
-            buf = torch.empty(ref.shape, dtype=ref.dtype).pin_memory()
+            buf = torch.empty(ref.shape, dtype=ref.dtype)
+            if self._device.type == 'cuda':
+                buf = buf.pin_memory()
             self._pinned_bufs[key] = buf
         return buf
 
@@ -189,6 +452,88 @@ class Renderer:
     def to_cpu(self, buf):
         return self._get_pinned_buf(buf).copy_(buf).clone()
 
+    def get_memory_usage(self):
+        r"""Bytes held by the tensors of this session, by component."""
+        w_optim = getattr(self, 'w_optim', None)
+        usage = dict(
+            network     = _tensor_bytes(getattr(self, 'G', None)),
+            latents     = _tensor_bytes([getattr(self, 'w', None), getattr(self, 'w0', None)]),
+            optimizer   = _tensor_bytes(list(w_optim.state.values())) if w_optim is not None else 0,
+            features    = _tensor_bytes([getattr(self, 'feat0_resize', None), getattr(self, 'feat_refs', None)]),
+            pkl_data    = _tensor_bytes(self._pkl_data),
+            networks    = _tensor_bytes(self._networks),
+            mask        = _tensor_bytes(self._mask_usq),
+            pinned_bufs = _tensor_bytes(self._pinned_bufs),
+            cmaps       = _tensor_bytes(self._cmaps),
+        )
+        return usage
+
+    def evict_caches(self):
+        r"""Drop the caches that are rebuilt on demand: loaded pickles, device
+        copy of the mask, pinned staging buffers, and colormaps. The pickle
+        and networks of the current checkpoint are kept if their weights
+        are all in the weight store, since the network of the session holds
+        on to them anyway. Returns the number of bytes freed, including the
+        store bytes whose last reference went away.
+        """
+        usage = self.get_memory_usage()
+        freed = sum(usage[name] for name in ['pkl_data', 'networks', 'mask', 'pinned_bufs', 'cmaps'])
+        store_bytes = weight_store.get_stats()['bytes_live']
+        pkl = getattr(self, 'pkl', None)
+        self._pkl_data = {k: v for k, v in self._pkl_data.items() if k == pkl and _tensor_bytes(v) == 0}
+        self._networks = {k: v for k, v in self._networks.items() if k[0] == pkl and _tensor_bytes(v) == 0}
+        self._mask_src = None
+        self._mask_version = None
+        self._mask_usq = None
+        self._pinned_bufs = dict()
+        self._cmaps = dict()
+        return freed + max(store_bytes - weight_store.get_stats()['bytes_live'], 0)
+
+    def start_trace(self, out_dir, num_steps=10, with_stack=False):
+        r"""Record the next `num_steps` drag steps with the PyTorch profiler
+        and write the trace to a new directory under `out_dir`.
+        """
+        assert self.timer.enabled, 'Tracing requires stage timing'
+        self.finish_trace()
+        label = os.path.splitext(os.path.basename(str(getattr(self, 'pkl', 'network'))))[0]
+        label = f'{label}-{getattr(self, "session_id", "session")}'
+        self.timer.tracer = DragTracer(out_dir, num_steps=num_steps, label=label, device=self._device, with_stack=with_stack)
+        return self.timer.tracer
+
+    def finish_trace(self):
+        r"""Write an unfinished trace early. Returns its directory, if any."""
+        tracer, self.timer.tracer = self.timer.tracer, None
+        return tracer.finish() if tracer is not None else None
+
+    def register_session(self):
+        r"""Admit this renderer as a live session. Copies of a registered
+        renderer (e.g. per-session copies of gr.State) get their own id and
+        have to fit into the memory budget. Raises `MemoryBudgetExceeded`
+        otherwise.
+        """
+        self._last_used = time.time()
+        if self in _live_renderers:
+            return
+        incoming = max(sum(self.get_memory_usage().values()), estimate_session_memory(getattr(self, 'pkl', None)))
+        if not enforce_memory_budget(incoming):
+            metrics.inc('draggan_sessions_rejected_total', help='Sessions refused by admission control.')
+            raise MemoryBudgetExceeded('The server is out of memory for new sessions, please try again later.')
+        self.session_id = uuid.uuid4().hex[:12]
+        _live_renderers.add(self)
+
+    def _get_device_mask(self, mask):
+        # The mask only changes when the user paints, so keep the device copy
+        # until the source tensor is replaced or modified in-place.
+        mask_usq = self._mask_usq
+        if mask is not self._mask_src or mask._version != self._mask_version:
+            mask_usq = None
+            if mask.min() == 0 and mask.max() == 1:
+                mask_usq = mask.to(self._device).unsqueeze(0).unsqueeze(0)
+            self._mask_src = mask
+            self._mask_version = mask._version
+            self._mask_usq = mask_usq
+        return mask_usq
+
     def _ignore_timing(self):
         self._is_timing = False
 
@@ -217,12 +562,18 @@ class Renderer:
         **kwargs
         ):
         # Dig up network details.
+        self.register_session()
         self.pkl = pkl
+        self.timer.checkpoint = pkl
         if hasattr(self, 'G'):
             del self.G
             torch.cuda.empty_cache()
 
         G = self.get_network(pkl, 'G_ema')
+        mixed_precision.set_fp32_parts(G.synthesis, self._fp32_parts)
+        self._fp32_layers = 0
+        if self._compile_synthesis:
+            compiled_synthesis.enable(G, checkpoint=pkl)
         self.G = G
         res.img_resolution = G.img_resolution
         res.num_ws = G.num_ws
@@ -237,19 +588,29 @@ class Renderer:
                     m = np.linalg.inv(np.asarray(input_transform))
             except np.linalg.LinAlgError:
                 res.error = CapturedException()
+            weight_store.unshare(G.synthesis.input) # Copy on write: the transform is per session.
             G.synthesis.input.transform.copy_(torch.from_numpy(m))
 
         # Generate random latents.
         self.w0_seed = w0_seed
         self.w_load = w_load
 
-        if self.w_load is None:
+        self._seed_key = None
+        if self.w_load is None and _seed_cache is not None and input_transform is None:
+            self._seed_key = (pkl, w0_seed, dict(trunc_psi=trunc_psi, trunc_cutoff=trunc_cutoff, noise_mode=noise_mode, precision=self.precision_mode))
+        w = _seed_cache.get_w(self._seed_key[0], self._seed_key[1], **self._seed_key[2]) if self._seed_key is not None else None
+
+        if w is not None:
+            w = torch.from_numpy(w).to(self._device)
+        elif self.w_load is None:
             # Generate random latents.
             z = torch.from_numpy(np.random.RandomState(w0_seed).randn(1, 512)).to(self._device).float()
 
             # Run mapping network.
             label = torch.zeros([1, G.c_dim], device=self._device)
             w = G.mapping(z, label, truncation_psi=trunc_psi, truncation_cutoff=trunc_cutoff)
+            if self._seed_key is not None:
+                _seed_cache.put(self._seed_key[0], self._seed_key[1], w=w, **self._seed_key[2])
         else:
             w = self.w_load.clone().to(self._device)
 
@@ -264,6 +625,20 @@ class Renderer:
 
         self.feat_refs = None
         self.points0_pt = None
+        enforce_memory_budget()
+
+    def render_initial_image(self, res, **render_kwargs):
+        r"""Render the image of the latent set by `init_network()` to
+        `res.image` as a PIL image, from the seed cache if possible.
+        """
+        seed_key = getattr(self, '_seed_key', None)
+        image = _seed_cache.get_image(seed_key[0], seed_key[1], **seed_key[2]) if seed_key is not None else None
+        if image is not None:
+            res.image = image
+            return
+        self._render_drag_impl(res, is_drag=False, to_pil=True, **render_kwargs)
+        if seed_key is not None:
+            _seed_cache.put(seed_key[0], seed_key[1], image=res.image, **seed_key[2])
 
     def update_lr(self, lr):
 
@@ -296,7 +671,11 @@ class Renderer:
         to_pil          = False,
         **kwargs
     ):
+        if is_drag:
+            self.register_session()
         try:
+            if is_drag:
+                self.timer.begin_step()
             G = self.G
             ws = self.w
             if ws.dim() == 2:
@@ -310,9 +689,23 @@ class Renderer:
                 self.points0_pt = None
             self.points = points
 
-            # Run synthesis network.
-            label = torch.zeros([1, G.c_dim], device=self._device)
-            img, feat = G(ws, label, truncation_psi=trunc_psi, noise_mode=noise_mode, input_is_w=True, return_feature=True)
+            # Run synthesis network. Under reduced precision, the layers up to
+            # the tracked features run in FP32 by default, so that tracking and
+            # the latent follow FP32 and only the image after them differs.
+            # When they are all of the layers, autocast would only add casts.
+            precision = self._precision
+            num_fp32_layers = feature_idx + 1 if self._fp32_features else 0
+            if precision != 'fp32' and num_fp32_layers >= len(mixed_precision.synthesis_layers(G.synthesis)):
+                if (self.pkl, feature_idx) not in self._fp32_fallback:
+                    self._fp32_fallback.add((self.pkl, feature_idx))
+                    warnings.warn(f'The FP32 layers up to features {feature_idx} are all synthesis layers of "{self.pkl}", running in FP32 instead of {precision}')
+                precision = 'fp32'
+            elif precision != 'fp32' and self._fp32_layers != num_fp32_layers:
+                mixed_precision.set_fp32_layers(G.synthesis, num_fp32_layers, self._fp32_parts)
+                self._fp32_layers = num_fp32_layers
+            with self.timer.stage('synthesis'), mixed_precision.autocast(self._device.type, precision):
+                label = torch.zeros([1, G.c_dim], device=self._device)
+                img, feat = G(ws, label, truncation_psi=trunc_psi, noise_mode=noise_mode, input_is_w=True, return_feature=True)
 
             h, w = G.img_resolution, G.img_resolution
 
@@ -320,17 +713,19 @@ class Renderer:
                 X = torch.linspace(0, h, h)
                 Y = torch.linspace(0, w, w)
                 xx, yy = torch.meshgrid(X, Y)
-                feat_resize = F.interpolate(feat[feature_idx], [h, w], mode='bilinear')
-                if self.feat_refs is None:
-                    self.feat0_resize = F.interpolate(feat[feature_idx].detach(), [h, w], mode='bilinear')
-                    self.feat_refs = []
-                    for point in points:
-                        py, px = round(point[0]), round(point[1])
-                        self.feat_refs.append(self.feat0_resize[:,:,py,px])
-                    self.points0_pt = torch.Tensor(points).unsqueeze(0).to(self._device) # 1, N, 2
+                with self.timer.stage('feature_resize'):
+                    feat_resize = F.interpolate(feat[feature_idx].float(), [h, w], mode='bilinear') # Tracking and losses run in FP32.
+                    if self.feat_refs is None:
+                        self.feat0_resize = F.interpolate(feat[feature_idx].detach().float(), [h, w], mode='bilinear')
+                        self.feat_refs = []
+                        for point in points:
+                            py, px = round(point[0]), round(point[1])
+                            self.feat_refs.append(self.feat0_resize[:,:,py,px])
+                        self.points0_pt = torch.Tensor(points).unsqueeze(0).to(self._device) # 1, N, 2
+                        enforce_memory_budget()
 
                 # Point tracking with feature matching
-                with torch.no_grad():
+                with torch.no_grad(), self.timer.stage('tracking'):
                     for j, point in enumerate(points):
                         r = round(r2 / 512 * h)
                         up = max(point[0] - r, 0)
@@ -349,33 +744,37 @@ class Renderer:
                 # Motion supervision
                 loss_motion = 0
                 res.stop = True
-                for j, point in enumerate(points):
-                    direction = torch.Tensor([targets[j][1] - point[1], targets[j][0] - point[0]])
-                    # if torch.linalg.norm(direction) > max(5 / 512 * h, 5):
-                    if torch.linalg.norm(direction) > max(2 / 512 * h, 2):
-                        res.stop = False
-                    if torch.linalg.norm(direction) > 1:
-                        distance = ((xx.to(self._device) - point[0])**2 + (yy.to(self._device) - point[1])**2)**0.5
-                        relis, reljs = torch.where(distance < round(r1 / 512 * h))
-                        direction = direction / (torch.linalg.norm(direction) + 1e-7)
-                        gridh = (relis-direction[1]) / (h-1) * 2 - 1
-                        gridw = (reljs-direction[0]) / (w-1) * 2 - 1
-                        grid = torch.stack([gridw,gridh], dim=-1).unsqueeze(0).unsqueeze(0)
-                        target = F.grid_sample(feat_resize.float(), grid, align_corners=True).squeeze(2)
-                        loss_motion += F.l1_loss(feat_resize[:,:,relis,reljs], target.detach())
+                with self.timer.stage('motion_loss'):
+                    for j, point in enumerate(points):
+                        direction = torch.Tensor([targets[j][1] - point[1], targets[j][0] - point[0]])
+                        # if torch.linalg.norm(direction) > max(5 / 512 * h, 5):
+                        if torch.linalg.norm(direction) > max(2 / 512 * h, 2):
+                            res.stop = False
+                        if torch.linalg.norm(direction) > 1:
+                            distance = ((xx.to(self._device) - point[0])**2 + (yy.to(self._device) - point[1])**2)**0.5
+                            relis, reljs = torch.where(distance < round(r1 / 512 * h))
+                            direction = direction / (torch.linalg.norm(direction) + 1e-7)
+                            gridh = (relis-direction[1]) / (h-1) * 2 - 1
+                            gridw = (reljs-direction[0]) / (w-1) * 2 - 1
+                            grid = torch.stack([gridw,gridh], dim=-1).unsqueeze(0).unsqueeze(0)
+                            target = F.grid_sample(feat_resize.float(), grid, align_corners=True).squeeze(2)
+                            loss_motion += F.l1_loss(feat_resize[:,:,relis,reljs], target.detach())
 
                 loss = loss_motion
-                if mask is not None:
-                    if mask.min() == 0 and mask.max() == 1:
-                        mask_usq = mask.to(self._device).unsqueeze(0).unsqueeze(0)
-                        loss_fix = F.l1_loss(feat_resize * mask_usq, self.feat0_resize * mask_usq)
-                        loss += lambda_mask * loss_fix
-
-                loss += reg * F.l1_loss(ws, self.w0)  # latent code regularization
+                with self.timer.stage('mask_loss'):
+                    if mask is not None:
+                        mask_usq = self._get_device_mask(mask)
+                        if mask_usq is not None:
+                            loss_fix = F.l1_loss(feat_resize * mask_usq, self.feat0_resize * mask_usq)
+                            loss += lambda_mask * loss_fix
+
+                    loss += reg * F.l1_loss(ws, self.w0)  # latent code regularization
                 if not res.stop:
                     self.w_optim.zero_grad()
-                    loss.backward()
-                    self.w_optim.step()
+                    with self.timer.stage('backward'):
+                        loss.backward()
+                    with self.timer.stage('optimizer_step'):
+                        self.w_optim.step()
 
             # Scale and convert to uint8.
             img = img[0]
@@ -385,8 +784,10 @@ class Renderer:
             img = (img * 127.5 + 128).clamp(0, 255).to(torch.uint8).permute(1, 2, 0)
             if to_pil:
                 from PIL import Image
-                img = img.cpu().numpy()
-                img = Image.fromarray(img)
+                with self.timer.stage('to_cpu'):
+                    img = img.cpu().numpy()
+                with self.timer.stage('encode'):
+                    img = Image.fromarray(img)
             res.image = img
 
         except Exception as e:
@@ -0,0 +1,215 @@
+"""On-disk cache of the latents and images of seeds, per checkpoint.
+
+Initializing a session from a seed runs the mapping network and, for the
+first image, the synthesis network. `SeedCache` keeps their results for
+every checkpoint and seed, so that switching to a cached seed runs neither:
+
+    <cache_dir>/<checkpoint id>/<seed key>.w.npy        Latent w, float32 [1, num_ws, w_dim].
+    <cache_dir>/<checkpoint id>/<seed key>.png          Initial image.
+    <cache_dir>/<checkpoint id>/<seed key>.thumb.jpg    Thumbnail for the gallery.
+
+The checkpoint id is the SHA-256 of the checkpoint file, from the catalog
+(see checkpoint_catalog.py) if the renderer has one. The seed key also
+holds the truncation, noise mode, and synthesis precision. Files are
+written atomically, so several processes, e.g. the app and
+precompute_seeds.py, can share a cache. Every lookup marks the seed as
+used, and when the cache exceeds its byte budget, the least recently used
+seeds of all checkpoints are evicted."""
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+from PIL import Image
+
+import dnnlib
+from viz import metrics
+
+#----------------------------------------------------------------------------
+
+THUMBNAIL_SIZE = 128    # Pixels on the long side.
+
+_EXTENSIONS = ['.w.npy', '.png', '.thumb.jpg']
+_file_hashes = dict()   # {(path, size, mtime_ns): sha256, ...}
+
+def checkpoint_id(pkl, catalog=None):
+    r"""Id of the checkpoint `pkl` in the cache: the SHA-256 of the file, or
+    of the URL if `pkl` is not a local file.
+    """
+    entry = catalog.lookup(pkl) if catalog is not None else None
+    if entry is not None:
+        return entry['sha256']
+    if not os.path.isfile(pkl):
+        return hashlib.sha256(pkl.encode('utf-8')).hexdigest()
+    stat = os.stat(pkl)
+    key = (os.path.abspath(pkl), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha256 = hashlib.sha256()
+        with open(pkl, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        _file_hashes[key] = sha256.hexdigest()
+    return _file_hashes[key]
+
+def seed_key(seed, trunc_psi=0.7, trunc_cutoff=None, noise_mode='const', precision='fp32'):
+    return f'seed{int(seed):010d}-psi{float(trunc_psi):g}-cutoff{trunc_cutoff}-{noise_mode}-{precision}'
+
+def _save_npy(path, array):
+    with open(path, 'wb') as f: # np.save() would append .npy to the name.
+        np.save(f, array)
+
+def _atomic_save(path, save_fn):
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        save_fn(temp_path)
+        os.replace(temp_path, path) # atomic
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+#----------------------------------------------------------------------------
+
+class SeedCache:
+    def __init__(self, cache_dir=None, max_bytes=None, catalog=None):
+        self.cache_dir  = cache_dir if cache_dir is not None else dnnlib.make_cache_dir_path('seeds')
+        self.max_bytes  = max_bytes     # Byte budget, None = unlimited.
+        self.catalog    = catalog       # For the checkpoint ids.
+        self._lock      = threading.Lock()
+        self._bytes     = None          # Bytes in the cache at the last scan plus the bytes added since.
+        self.stats      = dict(w_hits=0, w_misses=0, image_hits=0, image_misses=0, evicted=0)
+
+    def _path(self, pkl, key, ext):
+        return os.path.join(self.cache_dir, checkpoint_id(pkl, self.catalog), key + ext)
+
+    def _touch(self, path):
+        try:
+            os.utime(path) # Marks the seed as used.
+        except OSError:
+            pass
+
+    def get_w(self, pkl, seed, **key_kwargs):
+        r"""Cached latent w of `seed`, or None."""
+        path = self._path(pkl, seed_key(seed, **key_kwargs), '.w.npy')
+        try:
+            w = np.load(path)
+        except (OSError, ValueError):
+            self.stats['w_misses'] += 1
+            return None
+        self._touch(path)
+        self.stats['w_hits'] += 1
+        return w
+
+    def get_image(self, pkl, seed, **key_kwargs):
+        r"""Cached initial image of `seed` as a PIL image, or None."""
+        path = self._path(pkl, seed_key(seed, **key_kwargs), '.png')
+        try:
+            with Image.open(path) as image:
+                image.load()
+        except OSError:
+            self.stats['image_misses'] += 1
+            return None
+        self._touch(path)
+        self.stats['image_hits'] += 1
+        return image
+
+    def put(self, pkl, seed, w=None, image=None, **key_kwargs):
+        r"""Cache the latent w (array or tensor) and/or the initial image
+        (PIL image or uint8 array [H, W, C]) of `seed`.
+        """
+        key = seed_key(seed, **key_kwargs)
+        os.makedirs(os.path.dirname(self._path(pkl, key, '')), exist_ok=True)
+        added = 0
+        if w is not None:
+            w = w.detach().cpu().numpy() if hasattr(w, 'detach') else np.asarray(w)
+            path = self._path(pkl, key, '.w.npy')
+            _atomic_save(path, lambda temp_path: _save_npy(temp_path, w.astype(np.float32)))
+            added += os.path.getsize(path)
+        if image is not None:
+            image = image if isinstance(image, Image.Image) else Image.fromarray(np.asarray(image))
+            path = self._path(pkl, key, '.png')
+            _atomic_save(path, lambda temp_path: image.save(temp_path, format='PNG'))
+            added += os.path.getsize(path)
+            thumb = image.copy()
+            thumb.thumbnail([THUMBNAIL_SIZE, THUMBNAIL_SIZE])
+            path = self._path(pkl, key, '.thumb.jpg')
+            _atomic_save(path, lambda temp_path: thumb.convert('RGB').save(temp_path, format='JPEG', quality=90))
+            added += os.path.getsize(path)
+        self._added(added)
+
+    def thumbnails(self, pkl, max_num=None, **key_kwargs):
+        r"""[(seed, thumbnail path), ...] of the cached seeds of `pkl` for the
+        given truncation, noise mode, and precision, by seed.
+        """
+        suffix = seed_key(0, **key_kwargs)[len('seed0000000000'):] + '.thumb.jpg'
+        try:
+            names = os.listdir(os.path.dirname(self._path(pkl, '', '')))
+        except OSError:
+            return []
+        result = []
+        for name in sorted(names):
+            match = re.fullmatch(r'seed(\d{10})' + re.escape(suffix), name)
+            if match:
+                result.append((int(match[1]), self._path(pkl, name[:-len('.thumb.jpg')], '.thumb.jpg')))
+        return result[:max_num] if max_num is not None else result
+
+    #------------------------------------------------------------------------
+    # LRU eviction.
+
+    def _scan(self):
+        r"""{(dir, key): (last use, [(path, size), ...]), ...} of all seeds."""
+        seeds = dict()
+        for dirpath, _dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                ext = next((ext for ext in _EXTENSIONS if name.endswith(ext)), None)
+                if ext is None:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                last_use, files = seeds.get((dirpath, name[:-len(ext)]), (0, []))
+                seeds[(dirpath, name[:-len(ext)])] = (max(last_use, stat.st_mtime), files + [(path, stat.st_size)])
+        return seeds
+
+    def _added(self, num_bytes):
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += num_bytes
+                if self._bytes <= self.max_bytes:
+                    return
+            seeds = self._scan()
+            total = sum(size for _last_use, files in seeds.values() for _path, size in files)
+            for _last_use, files in sorted(seeds.values(), key=lambda item: item[0]):
+                if total <= self.max_bytes:
+                    break
+                for path, size in files:
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except FileNotFoundError:
+                        pass
+                self.stats['evicted'] += 1
+            self._bytes = total
+
+    def get_stats(self):
+        r"""Hits and misses of latents and images, and evicted seeds."""
+        return dict(self.stats)
+
+    def collect_metrics(self):
+        r"""Metrics collector for `viz.metrics.register_collector()`."""
+        stats = self.get_stats()
+        lookups = metrics.MetricFamily('draggan_seed_cache_lookups_total', 'counter', 'Seed cache lookups, by kind and result.')
+        for kind in ['w', 'image']:
+            lookups.add(stats[f'{kind}_hits'], dict(kind=kind, result='hit'))
+            lookups.add(stats[f'{kind}_misses'], dict(kind=kind, result='miss'))
+        evicted = metrics.MetricFamily('draggan_seed_cache_evicted_total', 'counter', 'Seeds evicted from the seed cache.')
+        evicted.add(stats['evicted'])
+        return [lookups, evicted]
+
+#----------------------------------------------------------------------------
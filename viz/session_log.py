@@ -0,0 +1,138 @@
+"""Compact per-session event traces for record and replay.
+
+A trace is a JSON Lines file with one event per line. Every event has a
+`type` and the time `t` in seconds since the session started:
+
+    session         Header: id, frontend, start time.
+    init            Network (re)initialization: pkl, w0_seed, w_plus,
+                    trunc_psi, trunc_cutoff, lr, and img_resolution if
+                    known.
+    lr              Optimizer rebuilt with a new learning rate.
+    reset_points    Reference features dropped, e.g. after editing points.
+    drag_start      Points and targets in renderer coordinates ([y, x]),
+                    run-length encoded mask, and the drag parameters.
+    mask            Mask changed during a drag, after `step` steps.
+    drag_stop       Number of drag steps and why the drag ended.
+
+Events only describe what is passed to `Renderer`, so `replay_session.py`
+can drive a renderer headlessly from them. The log reopens the file for
+every event and keeps no handles, so it can live in state that is
+deep-copied, such as `gr.State`."""
+
+import json
+import os
+import time
+import uuid
+import numpy as np
+import torch
+
+#----------------------------------------------------------------------------
+
+def encode_mask(mask):
+    r"""Run-length encode a binary mask (values > 0.5 are 1) as
+    `dict(shape, runs)`, where the runs alternate between 0 and 1 and start
+    with 0.
+    """
+    if mask is None:
+        return None
+    if isinstance(mask, torch.Tensor):
+        mask = mask.detach().cpu().numpy()
+    mask = np.asarray(mask)
+    flat = (mask.reshape(-1) > 0.5).astype(np.int8)
+    edges = np.flatnonzero(np.diff(flat)) + 1
+    bounds = np.concatenate([[0], edges, [flat.size]])
+    runs = np.diff(bounds).tolist()
+    if flat.size > 0 and flat[0] == 1:
+        runs = [0] + runs
+    return dict(shape=list(mask.shape), runs=runs)
+
+def decode_mask(data):
+    r"""Inverse of `encode_mask()`. Returns a float32 tensor."""
+    if data is None:
+        return None
+    values = np.arange(len(data['runs'])) % 2
+    flat = np.repeat(values, data['runs']).astype(np.float32)
+    return torch.from_numpy(flat.reshape(data['shape']))
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+#----------------------------------------------------------------------------
+
+class SessionLog:
+    def __init__(self, path, frontend='unknown', session_id=None):
+        self.path       = path
+        self.session_id = session_id if session_id is not None else uuid.uuid4().hex[:12]
+        self._t0        = time.time()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.log('session', id=self.session_id, frontend=frontend, start=self._t0)
+
+    def log(self, type, **fields): # pylint: disable=redefined-builtin
+        event = dict(t=round(time.time() - self._t0, 4), type=type, **fields)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+def open_session_log(log_dir, frontend):
+    r"""Start a new trace `<log_dir>/<frontend>-<session id>.jsonl`."""
+    session_id = uuid.uuid4().hex[:12]
+    return SessionLog(os.path.join(log_dir, f'{frontend}-{session_id}.jsonl'), frontend=frontend, session_id=session_id)
+
+#----------------------------------------------------------------------------
+
+class RenderArgsObserver:
+    r"""Derives session events from the consecutive argument dicts that a
+    frontend passes to `Renderer.render()`, e.g. in the GLFW visualizer.
+    One drag step is counted per distinct `iteration` while dragging. With
+    the asynchronous renderer, steps that the renderer process skips are
+    still counted.
+    """
+
+    def __init__(self, log):
+        self.log        = log
+        self._init_args = None      # Arguments that triggered the last init.
+        self._dragging  = False
+        self._steps     = 0
+        self._iteration = None
+        self._mask      = None      # (mask, version) seen at the last drag step.
+
+    def observe(self, args):
+        if args.get('pkl') is None:
+            return
+        init_args = dict(pkl=args['pkl'], w0_seed=args.get('w0_seed', 0), w_plus=args.get('w_plus', True),
+            w_load=id(args.get('w_load')) if args.get('w_load') is not None else None)
+        if init_args != self._init_args or args.get('reset_w', False):
+            self._stop('init')
+            self._init_args = init_args
+            self.log.log('init', pkl=args['pkl'], w0_seed=init_args['w0_seed'], w_plus=init_args['w_plus'],
+                trunc_psi=args.get('trunc_psi', 0.7), trunc_cutoff=args.get('trunc_cutoff', None), lr=args.get('lr', 0.001))
+
+        mask = args.get('mask', None)
+        if args.get('is_drag', False):
+            if not self._dragging:
+                self._dragging = True
+                self._steps = 0
+                self._iteration = None
+                self._mask = (mask, getattr(mask, '_version', None))
+                self.log.log('drag_start', points=[list(p) for p in args.get('points', [])], targets=[list(p) for p in args.get('targets', [])],
+                    mask=encode_mask(mask), lambda_mask=args.get('lambda_mask', 10), reg=args.get('reg', 0),
+                    feature_idx=args.get('feature_idx', 5), r1=args.get('r1', 3), r2=args.get('r2', 12), trunc_psi=args.get('trunc_psi', 0.7))
+            elif mask is not self._mask[0] or getattr(mask, '_version', None) != self._mask[1]:
+                self._mask = (mask, getattr(mask, '_version', None))
+                self.log.log('mask', step=self._steps, mask=encode_mask(mask))
+            if args.get('iteration') != self._iteration:
+                self._iteration = args.get('iteration')
+                self._steps += 1
+        else:
+            self._stop('stopped')
+        if args.get('reset', False):
+            self.log.log('reset_points')
+
+    def _stop(self, reason):
+        if self._dragging:
+            self._dragging = False
+            self.log.log('drag_stop', steps=self._steps, reason=reason)
+
+#----------------------------------------------------------------------------
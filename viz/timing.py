@@ -0,0 +1,260 @@
+"""Low-overhead per-stage timing of drag steps.
+
+`StageTimer` wraps the stages of a drag step in `with timer.stage(name):`
+blocks. On CUDA devices the stages are delimited by CUDA events that are
+only resolved once at the end of the step, so timing does not add any
+extra synchronization. On other devices `time.perf_counter()` is used.
+
+Finished steps are aggregated into per-session histograms (owned by the
+timer) and into process-wide per-checkpoint histograms (owned by this
+module), which can be rendered as a log line, dumped as JSON, or exported
+through a metrics endpoint."""
+
+import bisect
+import collections
+import contextlib
+import copy
+import json
+import math
+import os
+import threading
+import time
+import torch
+from viz.metrics import MetricFamily
+
+#----------------------------------------------------------------------------
+
+DRAG_STAGES = [
+    'synthesis',        # Generator forward pass.
+    'feature_resize',   # Upsampling of the feature map to image resolution.
+    'tracking',         # Point tracking by feature matching.
+    'motion_loss',      # Motion supervision loss.
+    'mask_loss',        # Fixed-area loss and latent regularization.
+    'backward',         # Backward pass.
+    'optimizer_step',   # Latent optimizer step.
+    'to_cpu',           # Device-to-host copy of the output image.
+    'overlay',          # Watermark, points, and mask overlay.
+    'encode',           # Conversion to PIL image / output encoding.
+]
+
+#----------------------------------------------------------------------------
+
+class Histogram:
+    r"""Latency histogram in seconds with logarithmically spaced buckets,
+    ranging from 10us to ~170s with 4 buckets per octave.
+    """
+    bounds = tuple(1e-5 * 2 ** (i / 4) for i in range(97))
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for idx, num in enumerate(other.buckets):
+            self.buckets[idx] += num
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for idx, num in enumerate(self.buckets):
+            if num > 0 and seen + num >= rank:
+                lo = self.bounds[idx - 1] if idx > 0 else 0.0
+                hi = self.bounds[idx] if idx < len(self.bounds) else self.max
+                value = lo + (hi - lo) * (rank - seen) / num
+                return min(max(value, self.min), self.max)
+            seen += num
+        return self.max
+
+    def as_dict(self):
+        if self.count == 0:
+            return dict(count=0)
+        return dict(count=self.count, sum=self.sum, mean=self.sum / self.count, min=self.min, max=self.max,
+            p50=self.quantile(0.5), p90=self.quantile(0.9), p99=self.quantile(0.99))
+
+#----------------------------------------------------------------------------
+# Process-wide per-checkpoint statistics.
+
+_lock               = threading.Lock()
+_checkpoint_stats   = dict()    # {checkpoint: {stage: Histogram, ...}, ...}
+_step_stamps        = collections.deque(maxlen=10000) # time.time() of recently finished steps.
+
+def report_step(checkpoint, times):
+    r"""Add the stage times (in seconds) of one finished step to the
+    per-checkpoint statistics.
+    """
+    with _lock:
+        stats = _checkpoint_stats.setdefault(str(checkpoint), dict())
+        for name, value in times.items():
+            stats.setdefault(name, Histogram()).add(value)
+        _step_stamps.append(time.time())
+
+def get_step_rate(window=60):
+    r"""Number of steps per second finished within the last `window` seconds."""
+    now = time.time()
+    with _lock:
+        num = sum(1 for stamp in _step_stamps if stamp >= now - window)
+    return num / window
+
+def get_checkpoint_stats():
+    r"""Return a snapshot of the per-checkpoint statistics as
+    `{checkpoint: {stage: Histogram}}`.
+    """
+    with _lock:
+        return copy.deepcopy(_checkpoint_stats)
+
+def stats_as_dict(stats):
+    return {name: hist.as_dict() for name, hist in stats.items()}
+
+def dump_json(path, sessions=None):
+    r"""Write the per-checkpoint statistics and, optionally, the statistics
+    of the given `{session_id: StageTimer}` dict to a JSON file.
+    """
+    data = dict(checkpoints={ckpt: stats_as_dict(stats) for ckpt, stats in get_checkpoint_stats().items()})
+    if sessions is not None:
+        data['sessions'] = {str(sid): timer.as_dict() for sid, timer in sessions.items()}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def collect_metrics(quantiles=(0.5, 0.9, 0.99)):
+    r"""Metrics collector for `viz.metrics.register_collector()`."""
+    step = MetricFamily('draggan_drag_step_seconds', 'summary', 'Wall time of a drag step per checkpoint.')
+    stage = MetricFamily('draggan_drag_stage_seconds', 'summary', 'Time spent in each stage of a drag step per checkpoint.')
+    for ckpt, stats in get_checkpoint_stats().items():
+        ckpt = os.path.splitext(os.path.basename(ckpt))[0]
+        for name, hist in stats.items():
+            family, labels = (step, dict(checkpoint=ckpt)) if name == 'total' else (stage, dict(checkpoint=ckpt, stage=name))
+            for q in quantiles:
+                family.add(hist.quantile(q), dict(labels, quantile=q))
+            family.add(hist.sum, labels, suffix='_sum')
+            family.add(hist.count, labels, suffix='_count')
+    rate = MetricFamily('draggan_drag_steps_per_second', 'gauge', 'Drag steps per second over the last minute.').add(get_step_rate())
+    return [step, stage, rate]
+
+def format_times(times):
+    r"""Format a `{stage: seconds}` dict as a compact log line."""
+    order = DRAG_STAGES + ['total']
+    names = sorted(times.keys(), key=lambda name: order.index(name) if name in order else len(order))
+    return ' | '.join(f'{name} {times[name] * 1e3:.1f}ms' for name in names)
+
+#----------------------------------------------------------------------------
+
+class StageTimer:
+    def __init__(self, device, enabled=True):
+        self.device     = torch.device(device)
+        self.enabled    = enabled
+        self.checkpoint = None      # Label for the per-checkpoint statistics.
+        self.stats      = dict()    # {stage: Histogram, ...} of this session.
+        self.num_steps  = 0
+        self.last_times = None      # {stage: seconds, ...} of the last finished step.
+        self._pending   = []        # [(stage, start_mark, end_mark), ...] of the current step.
+        self._step_mark = None      # Start mark of the current step, None = no step in progress.
+        self.tracer     = None      # viz.tracing.DragTracer that records the next steps, if any.
+
+    def __deepcopy__(self, memo):
+        # Pending CUDA events and profilers cannot be copied; a copy starts without an open step.
+        other = copy.copy(self)
+        other.stats = copy.deepcopy(self.stats, memo)
+        other._pending = []
+        other._step_mark = None
+        other.tracer = None
+        return other
+
+    def _mark(self):
+        if self.device.type == 'cuda':
+            event = torch.cuda.Event(enable_timing=True)
+            event.record(torch.cuda.current_stream(self.device))
+            return event
+        return time.perf_counter()
+
+    def _elapsed(self, start, end):
+        if self.device.type == 'cuda':
+            return start.elapsed_time(end) * 1e-3
+        return end - start
+
+    @property
+    def in_step(self):
+        return self._step_mark is not None
+
+    def begin_step(self):
+        r"""Start timing a new step. An unfinished previous step is finished first."""
+        if not self.enabled:
+            return
+        self.end_step()
+        if self.tracer is not None:
+            self.tracer.begin_step()
+        self._step_mark = self._mark()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        r"""Time the enclosed block as the given stage of the current step.
+        Does nothing if no step is in progress.
+        """
+        if not self.enabled or self._step_mark is None:
+            yield
+            return
+        tracer = self.tracer if self.tracer is not None and self.tracer.active else None
+        start = self._mark()
+        try:
+            if tracer is not None:
+                with tracer.record_stage(name):
+                    yield
+            else:
+                yield
+        finally:
+            if self._step_mark is not None:
+                self._pending.append((name, start, self._mark()))
+            if tracer is not None:
+                tracer.sample_memory(name)
+
+    def end_step(self):
+        r"""Finish the current step, add it to the statistics, and return its
+        `{stage: seconds}` dict including the `'total'` wall time.
+        """
+        if not self.enabled or self._step_mark is None:
+            return None
+        end = self._mark()
+        if self.device.type == 'cuda':
+            end.synchronize()
+        times = dict()
+        for name, start, stop in self._pending:
+            times[name] = times.get(name, 0.0) + self._elapsed(start, stop)
+        times['total'] = self._elapsed(self._step_mark, end)
+        self._pending = []
+        self._step_mark = None
+
+        for name, value in times.items():
+            self.stats.setdefault(name, Histogram()).add(value)
+        self.num_steps += 1
+        self.last_times = times
+        report_step(self.checkpoint, times)
+        if self.tracer is not None:
+            self.tracer.end_step(times)
+            if self.tracer.done:
+                self.tracer = None
+        return times
+
+    def reset(self):
+        self.stats = dict()
+        self.num_steps = 0
+        self.last_times = None
+
+    def as_dict(self):
+        return dict(checkpoint=self.checkpoint, num_steps=self.num_steps, stages=stats_as_dict(self.stats))
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,182 @@
+"""Opt-in PyTorch profiler traces of drag steps.
+
+A `DragTracer` records a fixed number of drag steps of one session with
+`torch.profiler` and writes them to a directory of its own:
+
+    trace.json      Chrome trace (chrome://tracing, Perfetto) with one
+                    `drag::step#N` range per drag step, `drag::<stage>`
+                    ranges for the stages of `viz.timing.DRAG_STAGES`,
+                    and allocator events.
+    summary.json    Op-level table, per-step stage times, and a memory
+                    timeline sampled at the end of every stage.
+    ops.txt         Human-readable version of the op-level table.
+
+The tracer is driven by `StageTimer`, so it sees exactly the steps and
+stages that are reported by the timing statistics."""
+
+import hashlib
+import json
+import os
+import time
+import torch
+
+#----------------------------------------------------------------------------
+
+def sample_session(session_id, fraction):
+    r"""Decide whether a session should be traced. The decision only depends
+    on the session id, so repeated calls for the same session agree.
+    """
+    if fraction >= 1:
+        return True
+    if fraction <= 0:
+        return False
+    digest = hashlib.sha1(str(session_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 < fraction
+
+def _memory_in_use(device):
+    # Bytes allocated by the caching allocator, or the resident set size of
+    # the process for devices without allocator statistics.
+    if device.type == 'cuda':
+        return torch.cuda.memory_allocated(device)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _event_stat(event, *names):
+    # Profiler attribute names differ between PyTorch versions (cuda_* -> device_*).
+    for name in names:
+        if hasattr(event, name):
+            return getattr(event, name)
+    return 0
+
+#----------------------------------------------------------------------------
+
+class DragTracer:
+    def __init__(self, out_dir, num_steps=10, label='session', device='cuda', with_stack=False):
+        self.out_dir    = out_dir
+        self.num_steps  = num_steps
+        self.label      = label
+        self.device     = torch.device(device)
+        self.with_stack = with_stack
+        self.steps      = []        # [{stage: seconds, ...}, ...] of the recorded steps.
+        self.memory     = []        # [dict(time, step, stage, bytes), ...]
+        self.path       = None      # Output directory, set once the trace has been written.
+        self._prof      = None
+        self._t0        = None
+        self._step_rec  = None      # record_function of the current step.
+
+    @property
+    def active(self):
+        return self._prof is not None
+
+    @property
+    def done(self):
+        return self.path is not None
+
+    def begin_step(self):
+        r"""Called by `StageTimer` at the beginning of every step. Starts the
+        profiler on the first step.
+        """
+        if self.done:
+            return
+        if not self.active:
+            self.start()
+        self._step_rec = torch.profiler.record_function(f'drag::step#{len(self.steps)}')
+        self._step_rec.__enter__()
+
+    def start(self):
+        if self.active or self.done:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._prof = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True, with_stack=self.with_stack)
+        self._prof.start()
+        self._t0 = time.perf_counter()
+
+    def record_stage(self, name):
+        r"""Context manager that annotates the enclosed block in the trace."""
+        return torch.profiler.record_function(f'drag::{name}')
+
+    def sample_memory(self, stage):
+        self.memory.append(dict(time=time.perf_counter() - self._t0, step=len(self.steps), stage=stage, bytes=_memory_in_use(self.device)))
+
+    def end_step(self, times):
+        r"""Called by `StageTimer` at the end of every step. Writes the trace
+        once `num_steps` steps have been recorded.
+        """
+        if not self.active:
+            return
+        if self._step_rec is not None:
+            self._step_rec.__exit__(None, None, None)
+            self._step_rec = None
+        self.steps.append(times)
+        self.sample_memory('end_step')
+        if len(self.steps) >= self.num_steps:
+            self.finish()
+
+    def finish(self):
+        r"""Stop profiling and write the results. Returns the output
+        directory, or None if no step was recorded.
+        """
+        if not self.active:
+            return self.path
+        if self._step_rec is not None:
+            self._step_rec.__exit__(None, None, None)
+            self._step_rec = None
+        prof, self._prof = self._prof, None
+        prof.stop()
+        if len(self.steps) == 0:
+            return None
+
+        path = os.path.join(self.out_dir, f'{self.label}-{time.strftime("%Y%m%d-%H%M%S")}')
+        os.makedirs(path, exist_ok=True)
+        prof.export_chrome_trace(os.path.join(path, 'trace.json'))
+        if self.with_stack and self.device.type == 'cuda' and hasattr(prof, 'export_memory_timeline'):
+            try:
+                prof.export_memory_timeline(os.path.join(path, 'memory_timeline.json'), device=str(self.device))
+            except Exception as e: # pylint: disable=broad-except
+                print(f'Could not export memory timeline: {e}')
+
+        events = prof.key_averages()
+        sort_by = 'self_cpu_time_total'
+        if self.device.type == 'cuda':
+            sort_by = 'self_device_time_total' if len(events) > 0 and hasattr(events[0], 'self_device_time_total') else 'self_cuda_time_total'
+        with open(os.path.join(path, 'ops.txt'), 'w') as f:
+            f.write(events.table(sort_by=sort_by, row_limit=100))
+        ops = [dict(
+            name                = event.key,
+            count               = event.count,
+            cpu_time_us         = event.cpu_time_total,
+            self_cpu_time_us    = event.self_cpu_time_total,
+            device_time_us      = _event_stat(event, 'device_time_total', 'cuda_time_total'),
+            self_device_time_us = _event_stat(event, 'self_device_time_total', 'self_cuda_time_total'),
+            cpu_memory_bytes    = event.cpu_memory_usage,
+            self_cpu_memory_bytes = event.self_cpu_memory_usage,
+            device_memory_bytes = _event_stat(event, 'device_memory_usage', 'cuda_memory_usage'),
+            self_device_memory_bytes = _event_stat(event, 'self_device_memory_usage', 'self_cuda_memory_usage'),
+        ) for event in events]
+        ops.sort(key=lambda op: (op['self_device_time_us'], op['self_cpu_time_us']), reverse=True)
+
+        stages = dict()
+        for times in self.steps:
+            for name, value in times.items():
+                stages.setdefault(name, []).append(value)
+        summary = dict(
+            label   = self.label,
+            device  = str(self.device),
+            torch   = torch.__version__,
+            steps   = self.steps,
+            stages  = {name: dict(mean=sum(values) / len(values), min=min(values), max=max(values)) for name, values in stages.items()},
+            memory  = self.memory,
+            ops     = ops,
+        )
+        with open(os.path.join(path, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        self.path = path
+        print(f'Wrote trace of {len(self.steps)} drag steps to "{path}"')
+        return path
+
+#----------------------------------------------------------------------------